@@ -1,59 +1,161 @@
-import argparse
-
-from pkg import (
-    build,
-    constants,
-    cycle,
-    install,
-    list,
-    query,
-    unbuild,
-    uninstall,
-    utils,
-)
-
-
-def get_args():
-    """Get args from argument parser.
+import functools
+import importlib
+import sys
+
+from pkg import constants, timings
+
+
+# module that defines each subcommand. Only the module of the command being
+# run is imported, so that quick commands like pkg query start up fast.
+COMMAND_MODULES = {
+    constants.BUILD: "build",
+    constants.CYCLE: "cycle",
+    constants.EXPORT: "bundle",
+    constants.GC: "retention",
+    constants.IMPORT: "bundle",
+    constants.INSTALL: "install",
+    constants.LIST: "list",
+    constants.PURGE: "purge",
+    constants.QUERY: "query",
+    constants.SERVE: "serve",
+    constants.UNBUILD: "unbuild",
+    constants.UNINSTALL: "uninstall",
+    constants.VERIFY: "verify",
+}
+
+
+def _import_command_module(module_name):
+    """Import subcommand module.
+
+    Args:
+        module_name (str): name of module in pkg package.
 
     Returns:
-        (argparse.Namespace): commandline arguments.
+        (module): imported module.
     """
+    return importlib.import_module("pkg." + module_name)
+
+
+# options of the pkg command itself that take a value
+_VALUE_OPTIONS = ("--trace",)
+
+
+def get_command_name(argv):
+    """Get name of subcommand being run, without parsing all arguments.
+
+    Args:
+        argv (list(str)): commandline arguments, excluding the program name.
+
+    Returns:
+        (str or None): subcommand name, if a known subcommand is given.
+    """
+    skip_next = False
+    for arg in argv:
+        if skip_next:
+            skip_next = False
+            continue
+        if arg.startswith("-"):
+            skip_next = arg in _VALUE_OPTIONS
+            continue
+        return arg if arg in COMMAND_MODULES else None
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def get_parser(command_name=None):
+    """Get argument parser.
+
+    If a known subcommand is given, only its module is imported to add its
+    arguments. Otherwise (eg. for pkg --help), all subcommand modules are
+    imported so that the full help can be shown. Parsers are cached, so that
+    pkg serve only builds each one once.
+
+    Args:
+        command_name (str or None): name of subcommand being run.
+
+    Returns:
+        (argparse.ArgumentParser): argument parser.
+    """
+    # imported here, as commands answered by pkg serve don't parse arguments
+    import argparse
+
     parser = argparse.ArgumentParser(
         description='Package development'
     )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="print table of time spent in each phase of the command",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        metavar="TRACE_FILE",
+        help=(
+            "write time spent in each phase of the command to a Chrome trace "
+            "json file, for chrome://tracing or Perfetto"
+        ),
+    )
     command = parser.add_subparsers(dest='command', required=True)
-    build.add_subparser_command(command)
-    cycle.add_subparser_command(command)
-    install.add_subparser_command(command)
-    list.add_subparser_command(command)
-    query.add_subparser_command(command)
-    unbuild.add_subparser_command(command)
-    uninstall.add_subparser_command(command)
-    return parser.parse_args()
+    if command_name:
+        module_names = [COMMAND_MODULES[command_name]]
+    else:
+        module_names = sorted(set(COMMAND_MODULES.values()))
+    for module_name in module_names:
+        _import_command_module(module_name).add_subparser_command(command)
+    return parser
+
+
+def get_args(argv=None):
+    """Get args from argument parser.
+
+    Args:
+        argv (list(str) or None): commandline arguments. If None, use
+            sys.argv.
+
+    Returns:
+        (argparse.Namespace): commandline arguments.
+        (module): module of subcommand being run.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    args = get_parser(get_command_name(argv)).parse_args(argv)
+    return args, _import_command_module(COMMAND_MODULES[args.command])
 
 
 def main():
     """Install package based on commandline args."""
-    args = get_args()
-    if args.command == constants.BUILD:
-        build.main(args)
-    elif args.command == constants.CYCLE:
-        cycle.main(args)
-    elif args.command == constants.INSTALL:
-        install.main(args)
-    elif args.command == constants.LIST:
-        list.main(args)
-    elif args.command == constants.QUERY:
-        query.main(args)
-    elif args.command == constants.UNBUILD:
-        unbuild.main(args)
-    elif args.command == constants.UNINSTALL:
-        uninstall.main(args)
-    elif not args.command:
-        utils.print_error("No subcommand given to 'pkg' command")
-    else:
-        utils.print_error("pkg subcommand {0} not recognised", args.command)
+    argv = sys.argv[1:]
+    timed = any(arg.startswith(("--timings", "--trace")) for arg in argv)
+    if get_command_name(argv) in (constants.LIST, constants.QUERY) and not timed:
+        # read-only commands are answered by pkg serve, if it's running
+        from pkg import serve
+        status = serve.run_client(argv)
+        if status is not None:
+            sys.exit(status)
+    args, module = get_args(argv)
+    # trees removed by the command are deleted by a single purge process
+    # once it's finished, rather than the command waiting for them
+    from pkg import trash
+    trash.enable_background_deletes()
+    try:
+        if not (args.timings or args.trace):
+            module.main(args)
+            return
+
+        timings.enable()
+        try:
+            with timings.span(args.command):
+                module.main(args)
+        finally:
+            timings.disable()
+            if args.timings:
+                print ("\n" + timings.format_summary())
+            if args.trace:
+                timings.write_trace(args.trace)
+                print ("Wrote trace to {0}".format(args.trace))
+    finally:
+        trash.start_purge()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,459 @@
+"""Python API for building, installing and querying packages.
+
+The pkg commands talk to the user through the console, so this wraps the
+functions behind them for use from other python code. Errors are raised as
+utils.PkgError rather than printed, any prompt is declined, with the prompt
+message included in the raised error, and progress messages are written to
+the repository's output stream, or discarded if it has none.
+
+Parsed metadata is cached between calls: install and build info come from
+the in-process registry cache, and source pkg-info files are only re-read
+when they change. Copies are returned, so callers can modify them freely.
+Batched operations run packages concurrently, in dependency order.
+
+Example:
+
+    from pkg.api import PackageRepository
+
+    repo = PackageRepository(dev_mode=True)
+    builds, errors = repo.build_many(["~/packages"])
+    repo.install("my-package", ">=1.2,<2")
+"""
+
+from collections import OrderedDict
+import copy
+import io
+import os
+import threading
+
+from pkg import build, constants, cycle, graph, install, layers, registry
+from pkg import utils, version_spec
+
+
+def _run(function, *args, **kwargs):
+    """Run pkg function that prints errors, raising them instead.
+
+    Args:
+        function (function): function to run, which returns whether it
+            succeeded.
+        args (list): arguments to pass to function.
+        kwargs (dict): keyword arguments to pass to function.
+
+    Raises:
+        (utils.PkgError): if the function fails, or raises an OSError.
+    """
+    with utils.capture_errors() as errors:
+        try:
+            success = function(*args, **kwargs)
+        except OSError as error:
+            errors.append(str(error))
+            success = False
+    if not success:
+        utils.raise_error(
+            "\n".join(errors) or "{0} failed".format(function.__name__)
+        )
+
+
+class PackageRepository(object):
+    """Builds and installs of packages in the pkg roots."""
+
+    def __init__(
+            self,
+            dev_mode=False,
+            force=True,
+            workers=None,
+            package_workers=None,
+            output=None):
+        """Initialise repository.
+
+        Args:
+            dev_mode (bool): whether to use the dev builds and installs.
+            force (bool): whether to overwrite existing builds and installs.
+                If False, trying to overwrite raises an error instead.
+            workers (int or None): number of threads to copy files with.
+            package_workers (int or None): number of packages to process at
+                once in batched operations.
+            output (file or None): stream to write progress messages to. If
+                None, they're discarded.
+        """
+        self.dev_mode = dev_mode
+        self.force = force
+        self.workers = workers
+        self.package_workers = (
+            package_workers or constants.DEFAULT_PACKAGE_WORKERS
+        )
+        self.output = output
+        # source pkg-info of each package directory, with file mtime
+        self._source_info = {}
+        self._source_info_lock = threading.Lock()
+
+    def _get_output(self):
+        """Get stream for a pkg function to write progress messages to.
+
+        Returns:
+            (file): output stream, or a buffer that's discarded.
+        """
+        return io.StringIO() if self.output is None else self.output
+
+    @property
+    def builds_dir(self):
+        """Get directory builds are made in.
+
+        Returns:
+            (str): build directory.
+        """
+        if self.dev_mode:
+            return constants.DEV_PKG_BUILDS_DIR
+        return constants.PKG_BUILDS_DIR
+
+    @property
+    def pkgs_dir(self):
+        """Get directory packages are installed to.
+
+        Returns:
+            (str): install directory.
+        """
+        return constants.DEV_PKGS_DIR if self.dev_mode else constants.PKGS_DIR
+
+    def get_source_info(self, src_dir):
+        """Get pkg-info of package source directory.
+
+        Args:
+            src_dir (str): directory of package.
+
+        Raises:
+            (utils.PkgError): if the pkg-info file is missing or invalid.
+
+        Returns:
+            (dict): pkg-info dictionary.
+        """
+        pkg_info_file = utils.get_package_info_file(os.path.abspath(src_dir))
+        try:
+            mtime = os.stat(pkg_info_file).st_mtime_ns
+        except OSError:
+            utils.raise_error(
+                "No pkg-info file found:\n\n\t{0}",
+                pkg_info_file,
+            )
+        with self._source_info_lock:
+            cached = self._source_info.get(pkg_info_file)
+        if cached and cached[0] == mtime:
+            return copy.deepcopy(cached[1])
+
+        _, pkg_info = utils.get_package_info(
+            os.path.dirname(pkg_info_file),
+            print_on_error=False,
+        )
+        if not pkg_info or not pkg_info.get(constants.NAME_KEY):
+            utils.raise_error(
+                "The pkg-info file is invalid or has no pkg name:\n\n\t{0}",
+                pkg_info_file,
+            )
+        with self._source_info_lock:
+            self._source_info[pkg_info_file] = (mtime, pkg_info)
+        return copy.deepcopy(pkg_info)
+
+    def get_installs(self):
+        """Get pkg-info of all installed packages.
+
+        Returns:
+            (OrderedDict(str, dict)): pkg-info of each install, keyed by name.
+        """
+        return copy.deepcopy(registry.get_installs(self.pkgs_dir))
+
+    def get_install(self, pkg_name):
+        """Get pkg-info of installed package.
+
+        Args:
+            pkg_name (str): name of package.
+
+        Returns:
+            (dict or None): pkg-info of install, if package is installed.
+        """
+        return copy.deepcopy(registry.get_install(self.pkgs_dir, pkg_name))
+
+    def get_installed_version(self, pkg_name):
+        """Get installed version of package.
+
+        Args:
+            pkg_name (str): name of package.
+
+        Returns:
+            (str or None): installed version, if package is installed.
+        """
+        return install.get_installed_version(self.pkgs_dir, pkg_name)
+
+    def get_builds(self, pkg_name, spec=None):
+        """Get info on builds of package.
+
+        Args:
+            pkg_name (str): name of package.
+            spec (str or None): if given, only get builds matching this
+                version spec.
+
+        Raises:
+            (utils.PkgError): if the spec is invalid.
+
+        Returns:
+            (OrderedDict(str, dict)): dicts with the pkg-info and version
+                comment of each build, keyed by version, in ascending version
+                order.
+        """
+        builds = copy.deepcopy(registry.get_builds(self.builds_dir, pkg_name))
+        if not spec:
+            return builds
+        keys, versions = registry.get_version_index(self.builds_dir, pkg_name)
+        return OrderedDict(
+            (version, builds[version])
+            for version in version_spec.filter_versions(spec, keys, versions)
+        )
+
+    def resolve_version(self, pkg_name, spec=version_spec.LATEST):
+        """Get highest built version of package matching version spec.
+
+        Builds in shared build stores are included, as they can be installed.
+
+        Args:
+            pkg_name (str): name of package.
+            spec (str): version spec, eg. latest, >=1.2,<2 or ~1.2, or an
+                exact version.
+
+        Raises:
+            (utils.PkgError): if the spec is invalid or no build matches it.
+
+        Returns:
+            (str): matching version.
+        """
+        builds_dirs = layers.get_builds_dirs(self.builds_dir)
+        version = layers.resolve_version(builds_dirs, pkg_name, spec)
+        if version is None or layers.find_build(
+                builds_dirs, pkg_name, version) is None:
+            utils.raise_error(
+                "Package {0} has no build matching version {1}",
+                pkg_name,
+                spec,
+            )
+        return version
+
+    def build(self, src_dir, version=None, incremental=False):
+        """Build package.
+
+        Args:
+            src_dir (str): directory of package.
+            version (str or None): version to build. If None, use the version
+                in pkg-info, or the default dev version in dev mode.
+            incremental (bool): if True, only copy over files that have
+                changed since the last incremental build of this version.
+
+        Raises:
+            (utils.PkgError): if the build fails.
+
+        Returns:
+            (dict): pkg-info of build.
+        """
+        src_dir = os.path.abspath(src_dir)
+        pkg_info = self.get_source_info(src_dir)
+        if not version:
+            version = (
+                constants.DEFAULT_DEV_VERSION if self.dev_mode
+                else pkg_info.get(constants.VERSION_KEY)
+            )
+        if not version:
+            utils.raise_error(
+                "No version given and pkg-info file has no version:\n\n\t{0}",
+                utils.get_package_info_file(src_dir),
+            )
+        _run(
+            build.run_build,
+            version,
+            self.dev_mode,
+            self.force,
+            incremental,
+            self.workers,
+            src_dir,
+            output=self._get_output(),
+        )
+        pkg_name = pkg_info[constants.NAME_KEY]
+        builds = registry.get_builds(self.builds_dir, pkg_name)
+        build_info = builds.get(version)
+        if not build_info:
+            utils.raise_error(
+                "Build {0} {1} isn't in the registry after building",
+                pkg_name,
+                version,
+            )
+        return copy.deepcopy(build_info["pkg_info"])
+
+    def install(self, pkg_name, version=version_spec.LATEST, link_mode=None):
+        """Install package.
+
+        Args:
+            pkg_name (str): name of package.
+            version (str): version to install, or version spec to resolve.
+            link_mode (str or None): if given, link install to the build
+                instead of copying it. This can be either HARDLINK or SYMLINK.
+
+        Raises:
+            (utils.PkgError): if no build matches the version, or the install
+                fails.
+
+        Returns:
+            (dict): pkg-info of install.
+        """
+        version = self.resolve_version(pkg_name, version)
+        _run(
+            install.run_install,
+            pkg_name,
+            version,
+            self.dev_mode,
+            self.dev_mode,
+            self.force,
+            self.workers,
+            link_mode,
+            output=self._get_output(),
+        )
+        return self.get_install(pkg_name)
+
+    def _run_batch(self, dependencies, function):
+        """Run function on packages concurrently, in dependency order.
+
+        Args:
+            dependencies (dict(str, iterable(str))): dependency names of each
+                package.
+            function (function): function to run, which takes a package name
+                and returns a result or raises utils.PkgError.
+
+        Raises:
+            (utils.PkgError): if the dependencies contain a cycle.
+
+        Returns:
+            (OrderedDict(str, object)): result of each successful package,
+                in the order they finished.
+            (dict(str, str)): error message of each failed or skipped package.
+        """
+        results = OrderedDict()
+        errors = {}
+
+        def run_package(pkg_name):
+            try:
+                results[pkg_name] = function(pkg_name)
+            except utils.PkgError as error:
+                errors[pkg_name] = str(error)
+                return False
+            except Exception as error:
+                # recorded against the package, like graph does, rather than
+                # printed
+                errors[pkg_name] = "{0}: {1}".format(
+                    type(error).__name__,
+                    error,
+                )
+                return False
+            return True
+
+        statuses = graph.run_in_dependency_order(
+            dependencies,
+            run_package,
+            self.package_workers,
+        )
+        for pkg_name, status in statuses.items():
+            if status is None:
+                errors[pkg_name] = "Skipped, as a dependency failed"
+        return results, errors
+
+    def build_many(self, root_dirs, incremental=False):
+        """Build multiple packages concurrently, in dependency order.
+
+        Args:
+            root_dirs (list(str)): directories that are either packages or
+                contain packages.
+            incremental (bool): if True, only copy over files that have
+                changed since the last incremental build of each package.
+
+        Raises:
+            (utils.PkgError): if any package can't be read, or the packages
+                depend on each other in a cycle.
+
+        Returns:
+            (OrderedDict(str, dict)): pkg-info of each successful build, keyed
+                by name.
+            (dict(str, str)): error message of each failed or skipped package.
+        """
+        with utils.capture_errors() as errors:
+            src_dirs, dependencies = cycle.find_packages(root_dirs)
+        if errors:
+            utils.raise_error("\n".join(errors))
+        return self._run_batch(
+            dependencies,
+            lambda pkg_name: self.build(
+                src_dirs[pkg_name],
+                incremental=incremental,
+            ),
+        )
+
+    def install_many(
+            self,
+            requirements,
+            with_dependencies=False,
+            link_mode=None):
+        """Install multiple packages concurrently.
+
+        Args:
+            requirements (list(str)): packages to install, each a package
+                name optionally followed by a version spec, as in the
+                dependencies of a pkg-info, eg. my-package>=1.2,<2.
+            with_dependencies (bool): if True, also install dependencies that
+                aren't installed at a matching version, before the packages
+                that depend on them.
+            link_mode (str or None): if given, link installs to the builds
+                instead of copying them. This can be either HARDLINK or
+                SYMLINK.
+
+        Raises:
+            (utils.PkgError): if the dependencies contain a cycle.
+
+        Returns:
+            (OrderedDict(str, dict)): pkg-info of each successful install,
+                keyed by name.
+            (dict(str, str)): error message of each package that failed,
+                couldn't be resolved, or was skipped.
+        """
+        versions = {}
+        dependencies = {}
+        resolve_errors = {}
+        for requirement in requirements:
+            pkg_name, spec = install.parse_dependency(requirement)
+            try:
+                if with_dependencies:
+                    new_versions, new_dependencies = (
+                        install.resolve_dependencies(
+                            pkg_name,
+                            spec or version_spec.LATEST,
+                            self.builds_dir,
+                            self.pkgs_dir,
+                            self._get_output(),
+                        )
+                    )
+                else:
+                    new_versions = {
+                        pkg_name: self.resolve_version(
+                            pkg_name,
+                            spec or version_spec.LATEST,
+                        )
+                    }
+                    new_dependencies = {pkg_name: []}
+            except utils.PkgError as error:
+                resolve_errors[pkg_name] = str(error)
+                continue
+            versions.update(new_versions)
+            dependencies.update(new_dependencies)
+
+        results, errors = self._run_batch(
+            dependencies,
+            lambda pkg_name: self.install(
+                pkg_name,
+                versions[pkg_name],
+                link_mode,
+            ),
+        )
+        errors.update(resolve_errors)
+        return results, errors
@@ -0,0 +1,388 @@
+"""Benchmark how pkg commands scale with the size of the pkg roots.
+
+Generates N synthetic source packages of K files each, points the pkg
+roots in constants at a temp directory, and times each command as the CLI
+runs it, in this order:
+
+- build: every one of M versions of every package.
+- install: the latest build of every package.
+- list: all packages, and then each package in turn.
+- query: the installed version of each package.
+- export: the latest build of every package, to a bundle file.
+- import: every bundle, overwriting the build it was exported from. As
+  the synthetic files all have the same contents, this also checks that
+  builds with hardlinked files round-trip through bundles.
+- uninstall: every package.
+- unbuild: every build.
+
+Commands are run in-process through the same argument parser as the pkg
+command, with output discarded. The in-process registry cache is cleared
+before each run, as every pkg command is a new process. Trees removed by
+uninstall and unbuild are moved to the trash as usual, but the trash is
+emptied in this process at the end, rather than by a purge process that
+would use the real roots.
+
+Results are written as json with --output, and compared against the
+results of a previous run with --baseline:
+
+    python benchmarks/bench_commands.py --output baseline.json
+    python benchmarks/bench_commands.py --baseline baseline.json
+
+Run with the pkg package on the PYTHONPATH.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+import yaml
+
+from pkg import __main__ as pkg_main
+from pkg import constants, registry, trash, utils
+
+
+def make_sources(root, num_packages, num_versions, num_files, file_size):
+    """Create synthetic source packages.
+
+    Args:
+        root (str): directory to create packages in.
+        num_packages (int): number of packages to create.
+        num_versions (int): number of versions to give each package in its
+            version-info.
+        num_files (int): number of files in each package.
+        file_size (int): size of each file in bytes.
+
+    Returns:
+        (dict(str, str)): source directory of each package, keyed by name.
+    """
+    src_dirs = {}
+    block = os.urandom(min(file_size, 1024 * 1024)) if file_size else b""
+    for i in range(num_packages):
+        pkg_name = "package_{0}".format(i)
+        src_dir = os.path.join(root, "src", pkg_name)
+        # spread files over a few subdirectories, like a real package
+        for j in range(num_files):
+            file_dir = os.path.join(src_dir, "module_{0}".format(j % 10))
+            if not os.path.isdir(file_dir):
+                os.makedirs(file_dir)
+            file_path = os.path.join(file_dir, "file_{0}.py".format(j))
+            with open(file_path, "wb") as f:
+                remaining = file_size
+                while remaining > 0:
+                    f.write(block[:remaining])
+                    remaining -= len(block)
+        utils.write_package_info(
+            utils.get_package_info_file(src_dir),
+            {constants.NAME_KEY: pkg_name, constants.VERSION_KEY: "1.0.0"},
+        )
+        with open(utils.get_version_info_file(src_dir), "w") as f:
+            yaml.safe_dump(
+                {
+                    get_version(k): "version " + get_version(k)
+                    for k in range(num_versions)
+                },
+                f,
+            )
+        src_dirs[pkg_name] = src_dir
+    return src_dirs
+
+
+def get_version(index):
+    """Get synthetic version string.
+
+    Args:
+        index (int): index of version.
+
+    Returns:
+        (str): version.
+    """
+    return "1.{0}.0".format(index)
+
+
+def set_roots(root):
+    """Point pkg roots at directories under given root.
+
+    Args:
+        root (str): directory to create roots in.
+    """
+    constants.PKGS_DIR = os.path.join(root, "my-pkgs")
+    constants.PKG_BUILDS_DIR = os.path.join(root, "pkg-builds")
+    constants.DEV_PKGS_DIR = os.path.join(root, "dev-pkgs")
+    constants.DEV_PKG_BUILDS_DIR = os.path.join(root, "dev-builds")
+    for root_dir in trash.get_root_dirs():
+        os.makedirs(root_dir)
+    # trash is emptied at the end instead of by a purge process, see module
+    # docstring
+    trash.enable_background_deletes()
+
+
+def run_command(argv, cwd=None):
+    """Run pkg command in-process, as the CLI would.
+
+    Args:
+        argv (list(str)): commandline arguments, excluding the program name.
+        cwd (str or None): directory to run command in.
+
+    Raises:
+        (RuntimeError): if the command reports any errors or prompts.
+
+    Returns:
+        (float): seconds taken.
+    """
+    registry._CACHE.clear()
+    old_cwd = os.getcwd()
+    if cwd:
+        os.chdir(cwd)
+    try:
+        with open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(devnull), \
+                utils.capture_errors() as errors:
+            start = time.perf_counter()
+            args, module = pkg_main.get_args(argv)
+            module.main(args)
+            duration = time.perf_counter() - start
+    finally:
+        os.chdir(old_cwd)
+    if errors:
+        raise RuntimeError(
+            "pkg {0} failed:\n{1}".format(" ".join(argv), "\n".join(errors))
+        )
+    return duration
+
+
+def run_build(src_dir, pkg_name, version):
+    """Build version of source package.
+
+    The source pkg-info is set to the version first, outside of the timing,
+    so that pkg build doesn't prompt to update it.
+
+    Args:
+        src_dir (str): source directory of package.
+        pkg_name (str): name of package.
+        version (str): version to build.
+
+    Returns:
+        (float): seconds taken.
+    """
+    utils.write_package_info(
+        utils.get_package_info_file(src_dir),
+        {constants.NAME_KEY: pkg_name, constants.VERSION_KEY: version},
+    )
+    return run_command(["build", version, "-f"], cwd=src_dir)
+
+
+def summarise(durations):
+    """Summarise durations of runs of a command.
+
+    Args:
+        durations (list(float)): seconds taken by each run.
+
+    Returns:
+        (dict): run count, and total, mean, min and max seconds.
+    """
+    return {
+        "runs": len(durations),
+        "total": sum(durations),
+        "mean": sum(durations) / len(durations),
+        "min": min(durations),
+        "max": max(durations),
+    }
+
+
+def run_benchmarks(src_dirs, num_versions, repeats, bundle_dir):
+    """Time each command over the synthetic packages.
+
+    Args:
+        src_dirs (dict(str, str)): source directory of each package.
+        num_versions (int): number of versions to build of each package.
+        repeats (int): number of times to list all packages.
+        bundle_dir (str): directory to export bundles to.
+
+    Returns:
+        (dict(str, dict)): summary of each command's run times, in the
+            order the commands were run.
+    """
+    pkg_names = sorted(src_dirs)
+    versions = [get_version(k) for k in range(num_versions)]
+    bundle_paths = dict(
+        (pkg_name, os.path.join(bundle_dir, pkg_name + ".tar.gz"))
+        for pkg_name in pkg_names
+    )
+    timings = [
+        ("build", [
+            run_build(src_dirs[pkg_name], pkg_name, version)
+            for pkg_name in pkg_names for version in versions
+        ]),
+        ("install", [
+            run_command(["install", pkg_name, "latest", "-f"])
+            for pkg_name in pkg_names
+        ]),
+        ("list", [run_command(["list"]) for _ in range(repeats)]),
+        ("list <pkg>", [
+            run_command(["list", pkg_name]) for pkg_name in pkg_names
+        ]),
+        ("query -v", [
+            run_command(["query", pkg_name, "-v"]) for pkg_name in pkg_names
+        ]),
+        ("export", [
+            run_command([
+                "export", pkg_name, versions[-1], "-o", bundle_paths[pkg_name]
+            ])
+            for pkg_name in pkg_names
+        ]),
+        ("import", [
+            run_command(["import", bundle_paths[pkg_name], "-f"])
+            for pkg_name in pkg_names
+        ]),
+        ("uninstall", [
+            run_command(["uninstall", pkg_name, "-f"])
+            for pkg_name in pkg_names
+        ]),
+        ("unbuild", [
+            run_command(["unbuild", pkg_name, version, "-f"])
+            for pkg_name in pkg_names for version in versions
+        ]),
+    ]
+    return dict(
+        (command, summarise(durations)) for command, durations in timings
+    )
+
+
+def print_results(results, baseline=None, threshold=0.1):
+    """Print results table, compared against baseline if given.
+
+    Args:
+        results (dict(str, dict)): summary of each command's run times.
+        baseline (dict(str, dict) or None): summaries from a previous run.
+        threshold (float): fractional slowdown of mean time to flag as a
+            regression.
+
+    Returns:
+        (list(str)): commands whose mean time regressed past threshold.
+    """
+    regressions = []
+    header = "{0:<14}{1:>7}{2:>12}{3:>12}{4:>12}".format(
+        "command", "runs", "mean ms", "min ms", "total s"
+    )
+    if baseline:
+        header += "{0:>14}{1:>10}".format("baseline ms", "change")
+    print(header)
+    print("-" * len(header))
+    for command, result in results.items():
+        line = "{0:<14}{1:>7}{2:>12.3f}{3:>12.3f}{4:>12.3f}".format(
+            command,
+            result["runs"],
+            result["mean"] * 1000,
+            result["min"] * 1000,
+            result["total"],
+        )
+        baseline_result = (baseline or {}).get(command)
+        if baseline_result:
+            change = result["mean"] / baseline_result["mean"] - 1
+            line += "{0:>14.3f}{1:>+9.1f}%".format(
+                baseline_result["mean"] * 1000,
+                change * 100,
+            )
+            if change > threshold:
+                line += "  REGRESSED"
+                regressions.append(command)
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--num-packages", type=int, default=20)
+    parser.add_argument("--num-versions", type=int, default=5)
+    parser.add_argument("--num-files", type=int, default=100)
+    parser.add_argument("--file-size-kb", type=float, default=4)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="path to write results json to",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help="path to results json of a previous run to compare against",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="percent slowdown against baseline to flag (default 10)",
+    )
+    args = parser.parse_args()
+
+    config = {
+        "num_packages": args.num_packages,
+        "num_versions": args.num_versions,
+        "num_files": args.num_files,
+        "file_size": int(args.file_size_kb * 1024),
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["config"] != config:
+            print(
+                "[WARNING] baseline was run with different sizes: "
+                "{0}\n".format(baseline["config"])
+            )
+
+    root = tempfile.mkdtemp(prefix="pkg-bench-")
+    try:
+        src_dirs = make_sources(
+            root,
+            args.num_packages,
+            args.num_versions,
+            args.num_files,
+            config["file_size"],
+        )
+        set_roots(root)
+        print(
+            "{num_packages} packages x {num_versions} versions x "
+            "{num_files} files of {file_size} bytes\n".format(**config)
+        )
+        bundle_dir = os.path.join(root, "bundles")
+        os.makedirs(bundle_dir)
+        results = run_benchmarks(
+            src_dirs,
+            args.num_versions,
+            args.repeats,
+            bundle_dir,
+        )
+        for root_dir in trash.get_root_dirs():
+            trash.empty_trash(root_dir)
+    finally:
+        shutil.rmtree(root)
+
+    regressions = print_results(
+        results,
+        baseline and baseline["results"],
+        args.threshold / 100.0,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "config": config,
+                    "python": platform.python_version(),
+                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "results": results,
+                },
+                f,
+                indent=4,
+            )
+    if regressions:
+        print("\nRegressed: {0}".format(", ".join(regressions)))
+
+
+if __name__ == "__main__":
+    main()
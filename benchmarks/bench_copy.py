@@ -0,0 +1,119 @@
+"""Benchmark file copy strategies against shutil.copytree.
+
+Generates a synthetic package of large files in a temp directory and
+reports the throughput of the original shutil.copytree/copy2 path against
+files.copy_tree with each copy strategy forced in turn.
+
+Run with the pkg package on the PYTHONPATH:
+
+    python benchmarks/bench_copy.py --num-files 20 --file-size-mb 50
+"""
+
+import argparse
+import functools
+import os
+import shutil
+import tempfile
+import time
+
+from pkg import files
+
+
+def make_package(root, num_files, file_size):
+    """Create synthetic package directory of random files.
+
+    Args:
+        root (str): directory to create package in.
+        num_files (int): number of files to create.
+        file_size (int): size of each file in bytes.
+
+    Returns:
+        (str): path to package directory.
+    """
+    pkg_dir = os.path.join(root, "src")
+    os.makedirs(pkg_dir)
+    block = os.urandom(min(file_size, 1024 * 1024))
+    for i in range(num_files):
+        with open(os.path.join(pkg_dir, "file_{0}.bin".format(i)), "wb") as f:
+            remaining = file_size
+            while remaining > 0:
+                f.write(block[:remaining])
+                remaining -= len(block)
+    return pkg_dir
+
+
+def time_copy(copy_tree, src_dir, dest_dir):
+    """Time a tree copy, removing the destination afterwards.
+
+    Args:
+        copy_tree (function): function taking src and dest directories.
+        src_dir (str): source directory.
+        dest_dir (str): destination directory.
+
+    Returns:
+        (float): seconds taken.
+    """
+    start = time.perf_counter()
+    copy_tree(src_dir, dest_dir)
+    duration = time.perf_counter() - start
+    shutil.rmtree(dest_dir)
+    return duration
+
+
+def main():
+    """Run benchmark and print throughput of each copy method."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--num-files", type=int, default=20)
+    parser.add_argument("--file-size-mb", type=float, default=50)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--dir",
+        default=None,
+        help="directory to run in, to test a specific filesystem",
+    )
+    args = parser.parse_args()
+
+    file_size = int(args.file_size_mb * 1024 * 1024)
+    total_bytes = file_size * args.num_files
+    methods = [("shutil.copytree (baseline)", shutil.copytree)]
+    for strategy in (
+            files.REFLINK,
+            files.COPY_FILE_RANGE,
+            files.SENDFILE,
+            files.READ_WRITE):
+        copy_function = functools.partial(
+            files.copy_file,
+            strategies=[strategy],
+        )
+        methods.append((
+            "files.copy_tree ({0})".format(strategy),
+            functools.partial(files.copy_tree, copy_function=copy_function),
+        ))
+    methods.append(("files.copy_tree (auto)", files.copy_tree))
+
+    root = tempfile.mkdtemp(dir=args.dir)
+    try:
+        src_dir = make_package(root, args.num_files, file_size)
+        dest_dir = os.path.join(root, "dest")
+        strategy_used = files.summarise_strategies(
+            files.copy_tree(src_dir, dest_dir)
+        )
+        shutil.rmtree(dest_dir)
+        print ("Auto strategy on this filesystem: " + strategy_used)
+        print ("{0:<40}{1:>12}{2:>12}".format("method", "seconds", "MB/s"))
+        for name, copy_tree in methods:
+            duration = min(
+                time_copy(copy_tree, src_dir, dest_dir)
+                for _ in range(args.repeats)
+            )
+            print ("{0:<40}{1:>12.3f}{2:>12.1f}".format(
+                name,
+                duration,
+                total_bytes / duration / (1024 * 1024),
+            ))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
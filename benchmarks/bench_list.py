@@ -0,0 +1,216 @@
+"""Benchmark scanning pkg roots for pkg list.
+
+Generates a synthetic set of pkg roots in a temp directory, with builds of
+many versions of each package plus an install of each, and reports the
+time taken to gather the info for pkg list with:
+
+- the original sequential os.listdir scan, parsing every pkg-info and
+  version-info file.
+- the registry when it's empty, so every root is scanned and read.
+- the registry when it's up to date, so only directory mtimes are checked.
+
+Use --latency-ms to add a delay to every metadata file read, to model roots
+on a network mount.
+
+Run with the pkg package on the PYTHONPATH:
+
+    python benchmarks/bench_list.py --num-packages 100 --num-versions 100
+"""
+
+import argparse
+import functools
+import os
+import shutil
+import tempfile
+import time
+
+import yaml
+
+from pkg import constants, list as list_, registry, utils
+
+
+def make_roots(root, num_packages, num_versions):
+    """Create synthetic install and build roots.
+
+    Args:
+        root (str): directory to create roots in.
+        num_packages (int): number of packages to create.
+        num_versions (int): number of builds of each package to create.
+
+    Returns:
+        (str): install directory.
+        (str): build directory.
+    """
+    pkgs_dir = os.path.join(root, "my-pkgs")
+    builds_dir = os.path.join(root, "pkg-builds")
+    for i in range(num_packages):
+        pkg_name = "package_{0}".format(i)
+        versions = ["1.{0}.0".format(j) for j in range(num_versions)]
+        for version in versions:
+            version_dir = os.path.join(builds_dir, pkg_name, version)
+            os.makedirs(version_dir)
+            utils.write_package_info(
+                utils.get_package_info_file(version_dir),
+                {
+                    constants.NAME_KEY: pkg_name,
+                    constants.VERSION_KEY: version,
+                    constants.BUILD_TIME_KEY: "2024-01-01 00:00:00",
+                },
+            )
+            with open(utils.get_version_info_file(version_dir), "w") as f:
+                yaml.safe_dump({version: "version " + version}, f)
+        pkg_dir = os.path.join(pkgs_dir, pkg_name)
+        os.makedirs(pkg_dir)
+        utils.write_package_info(
+            utils.get_package_info_file(pkg_dir),
+            {
+                constants.NAME_KEY: pkg_name,
+                constants.VERSION_KEY: versions[-1],
+                constants.INSTALL_TIME_KEY: "2024-01-01 00:00:00",
+            },
+        )
+    return pkgs_dir, builds_dir
+
+
+def scan_listdir(pkgs_dir, builds_dir):
+    """Gather list info with the original sequential os.listdir scan.
+
+    Args:
+        pkgs_dir (str): install directory.
+        builds_dir (str): build directory.
+    """
+    for pkg_name in os.listdir(pkgs_dir):
+        pkg_dir = os.path.join(pkgs_dir, pkg_name)
+        if os.path.isfile(utils.get_package_info_file(pkg_dir)):
+            utils.get_package_info(pkg_dir)
+    for pkg_name in os.listdir(builds_dir):
+        pkg_build_dir = os.path.join(builds_dir, pkg_name)
+        if not os.path.isdir(pkg_build_dir):
+            continue
+        for version in os.listdir(pkg_build_dir):
+            pkg_version_dir = os.path.join(pkg_build_dir, version)
+            if not os.path.isdir(pkg_version_dir):
+                continue
+            utils.get_package_info(pkg_version_dir)
+            utils.get_version_info(pkg_version_dir)
+
+
+def scan_registry(pkgs_dir, builds_dir):
+    """Gather list info through the registry, as pkg list does.
+
+    Args:
+        pkgs_dir (str): install directory.
+        builds_dir (str): build directory.
+    """
+    pkg_names = list(registry.get_installs(pkgs_dir))
+    list_._get_all_packages_info(pkgs_dir)
+    for pkg_name in pkg_names:
+        list_._get_package_build_info(builds_dir, pkg_name)
+
+
+def clear_registry(pkgs_dir, builds_dir):
+    """Remove registries of roots, so the next scan starts from nothing.
+
+    Args:
+        pkgs_dir (str): install directory.
+        builds_dir (str): build directory.
+    """
+    for root_dir in (pkgs_dir, builds_dir):
+        shutil.rmtree(
+            os.path.dirname(registry.get_registry_file(root_dir)),
+            ignore_errors=True,
+        )
+    registry._CACHE.clear()
+
+
+def add_latency(function, latency):
+    """Wrap function to sleep before each call.
+
+    Args:
+        function (function): function to wrap.
+        latency (float): seconds to sleep for.
+
+    Returns:
+        (function): wrapped function.
+    """
+    @functools.wraps(function)
+    def wrapped(*args, **kwargs):
+        time.sleep(latency)
+        return function(*args, **kwargs)
+    return wrapped
+
+
+def time_scan(scan, pkgs_dir, builds_dir):
+    """Time a scan of the roots.
+
+    Args:
+        scan (function): function taking install and build directories.
+        pkgs_dir (str): install directory.
+        builds_dir (str): build directory.
+
+    Returns:
+        (float): seconds taken.
+    """
+    start = time.perf_counter()
+    scan(pkgs_dir, builds_dir)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--num-packages", type=int, default=100)
+    parser.add_argument("--num-versions", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="pkg-bench-")
+    try:
+        pkgs_dir, builds_dir = make_roots(
+            root,
+            args.num_packages,
+            args.num_versions,
+        )
+        print(
+            "{0} packages x {1} versions ({2} builds), {3}ms latency\n".format(
+                args.num_packages,
+                args.num_versions,
+                args.num_packages * args.num_versions,
+                args.latency_ms,
+            )
+        )
+        if args.latency_ms:
+            latency = args.latency_ms / 1000.0
+            utils.get_package_info = add_latency(
+                utils.get_package_info,
+                latency,
+            )
+            utils.get_version_info = add_latency(
+                utils.get_version_info,
+                latency,
+            )
+
+        def cold_registry(pkgs_dir, builds_dir):
+            clear_registry(pkgs_dir, builds_dir)
+            scan_registry(pkgs_dir, builds_dir)
+
+        def warm_registry(pkgs_dir, builds_dir):
+            # drop the in-process cache, as each pkg list is a new process
+            registry._CACHE.clear()
+            scan_registry(pkgs_dir, builds_dir)
+
+        for name, scan in [
+                ("listdir (sequential)", scan_listdir),
+                ("registry (cold)", cold_registry),
+                ("registry (warm)", warm_registry)]:
+            durations = [
+                time_scan(scan, pkgs_dir, builds_dir)
+                for _ in range(args.repeats)
+            ]
+            print("{0:<24}{1:>10.3f}s".format(name, min(durations)))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
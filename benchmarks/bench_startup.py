@@ -0,0 +1,131 @@
+"""Benchmark startup time of pkg commands.
+
+Runs a pkg command (pkg query -v by default) repeatedly in new processes
+and reports the fastest and mean wall-clock times, along with the time to
+start an empty python process for reference. If a baseline git ref is
+given, the pkg package at that ref is extracted to a temp directory and
+timed in the same way.
+
+Run from the root of the pkg repository:
+
+    python benchmarks/bench_startup.py --baseline HEAD~1
+    python benchmarks/bench_startup.py -- list my-package
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def extract_package(ref, repo_dir, dest_dir):
+    """Extract pkg package at given git ref.
+
+    Args:
+        ref (str): git ref to extract.
+        repo_dir (str): path to pkg repository.
+        dest_dir (str): directory to extract package into.
+
+    Returns:
+        (str): directory to put on the PYTHONPATH to import the package.
+    """
+    pkg_dir = os.path.join(dest_dir, "pkg")
+    os.makedirs(pkg_dir)
+    archive = subprocess.run(
+        ["git", "-C", repo_dir, "archive", ref],
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    subprocess.run(
+        ["tar", "-x", "-C", pkg_dir],
+        input=archive.stdout,
+        check=True,
+    )
+    return dest_dir
+
+
+def time_command(command, python_path, repeats):
+    """Time command in new processes.
+
+    Args:
+        command (list(str)): command to run.
+        python_path (str or None): PYTHONPATH to run command with.
+        repeats (int): number of times to run command.
+
+    Returns:
+        (float): fastest time in seconds.
+        (float): mean time in seconds.
+    """
+    env = dict(os.environ)
+    if python_path:
+        env["PYTHONPATH"] = python_path
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(
+            command,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        durations.append(time.perf_counter() - start)
+    return min(durations), sum(durations) / len(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help="git ref of pkg to compare against, eg. HEAD~1",
+    )
+    parser.add_argument(
+        "pkg_args",
+        nargs="*",
+        default=["query", "pkg", "-v"],
+        help="arguments to pass to pkg (default: query pkg -v)",
+    )
+    args = parser.parse_args()
+
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pkg_command = [sys.executable, "-m", "pkg"] + args.pkg_args
+    print("pkg {0}, {1} runs\n".format(" ".join(args.pkg_args), args.repeats))
+
+    results = [(
+        "python (no imports)",
+        time_command([sys.executable, "-c", "pass"], None, args.repeats),
+    )]
+    with tempfile.TemporaryDirectory(prefix="pkg-bench-") as temp_dir:
+        if args.baseline:
+            baseline_path = extract_package(
+                args.baseline,
+                repo_dir,
+                os.path.join(temp_dir, "baseline"),
+            )
+            results.append((
+                "pkg ({0})".format(args.baseline),
+                time_command(pkg_command, baseline_path, args.repeats),
+            ))
+        # link the working tree in as pkg, whatever the repo is called
+        current_path = os.path.join(temp_dir, "current")
+        os.makedirs(current_path)
+        os.symlink(repo_dir, os.path.join(current_path, "pkg"))
+        results.append((
+            "pkg (working tree)",
+            time_command(pkg_command, current_path, args.repeats),
+        ))
+
+    for name, (fastest, mean) in results:
+        print("{0:<28}{1:>8.1f}ms min{2:>8.1f}ms mean".format(
+            name,
+            fastest * 1000,
+            mean * 1000,
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 """pkg-build command."""
 
 from datetime import datetime
+import functools
 import json
 import os
 
-from pkg import build, constants, install, utils
+from pkg import build, constants, fingerprint, install, manifest, registry
+from pkg import store, utils
 
 
 def add_subparser_command(subparser):
@@ -35,22 +37,46 @@ def add_subparser_command(subparser):
         action="store_true",
         help="install to develop mode",
     )
+    build_command.add_argument(
+        "-i",
+        action="store_true",
+        help="incremental build (only copy files changed since last build)",
+    )
+    build_command.add_argument(
+        "-j",
+        type=int,
+        default=None,
+        metavar="WORKERS",
+        help="number of threads to copy files with (default {0})".format(
+            constants.DEFAULT_COPY_WORKERS
+        ),
+    )
+    build_command.add_argument(
+        "--full",
+        action="store_true",
+        help="build even if the source hasn't changed since the last build",
+    )
 
 
-def get_build_version(pkg_info, pkg_info_file, dev_mode):
+def get_build_version(pkg_info, pkg_info_file, dev_mode, output=None):
     """Get version to build, if none specified on commandline.
 
     Args:
         pkg_info (dict): pkg-info dictionary.
         pkg_info_file (str): path to pkg-info file.
         dev_mode (bool): whether or not we're building to dev builds directory.
+        output (file or None): stream to print progress to. If None, print
+            to stdout.
 
     Returns:
         (str or None): version to build, if found.
     """
     if dev_mode:
         version = constants.DEFAULT_DEV_VERSION
-        print ("Building version dev-0.0.0 (default dev version)")
+        print (
+            "Building version dev-0.0.0 (default dev version)",
+            file=output,
+        )
     else:
         version = pkg_info.get(constants.VERSION_KEY)
         if not version:
@@ -60,18 +86,41 @@ def get_build_version(pkg_info, pkg_info_file, dev_mode):
             )
             return None
         print (
-            "Building version {0} (specified in pkg-info file)".format(version)
+            "Building version {0} (specified in pkg-info file)".format(
+                version
+            ),
+            file=output,
         )
     return version
 
 
-def run_build(version, dev_mode, force):
+def run_build(
+        version,
+        dev_mode,
+        force,
+        incremental=False,
+        workers=None,
+        src_dir=None,
+        full=False,
+        output=None):
     """Run build action.
 
+    If the build already exists and the source tree's fingerprint shows it
+    hasn't changed since, nothing is copied.
+
     Args:
         version (str or None): version to build. If None, use pkg-info.
         dev_mode (bool): whether or not to build in dev-builds directory.
         force (bool): if True, don't ask for confirmation when rewriting.
+        incremental (bool): if True, only copy over files that have changed
+            since the last incremental build of this version.
+        workers (int or None): number of threads to copy files with.
+        src_dir (str or None): directory of package to build. If None, use
+            the current working directory.
+        full (bool): if True, build even if the source hasn't changed since
+            the last build.
+        output (file or None): stream to print progress to. If None, print
+            to stdout.
 
     Returns:
         (bool): if build was successful.
@@ -83,7 +132,7 @@ def run_build(version, dev_mode, force):
         build_dir = constants.PKG_BUILDS_DIR
         success_message = "Package Built Successfully"
 
-    src_dir = os.path.abspath(os.getcwd())
+    src_dir = os.path.abspath(src_dir or os.getcwd())
     pkg_info_file, pkg_info = utils.get_package_info(src_dir)
     if not pkg_info:
         return False
@@ -96,7 +145,12 @@ def run_build(version, dev_mode, force):
         )
         return False
 
-    version = version or get_build_version(pkg_info, pkg_info_file, dev_mode)
+    version = version or get_build_version(
+        pkg_info,
+        pkg_info_file,
+        dev_mode,
+        output,
+    )
     if not version:
         return False
 
@@ -128,20 +182,45 @@ def run_build(version, dev_mode, force):
                 accepted_chars=['y', 'n', ''],
             )
             if not continue_build:
-                print ("Aborting.")
+                print ("Aborting.", file=output)
                 return False
 
     pkg_build_dir = os.path.join(build_dir, pkg_name)
     if not os.path.isdir(pkg_build_dir):
         os.mkdir(pkg_build_dir)
     dest_dir = os.path.join(pkg_build_dir, version)
+    ignore_patterns = pkg_info.get(constants.IGNORE_PATTERNS_KEY, [])
+    # fingerprint the source before copying, so that anything changed while
+    # copying is picked up by the next build
+    source_fingerprint, file_stats = fingerprint.get_fingerprint(
+        src_dir,
+        utils.get_ignore_matcher(ignore_patterns),
+    )
+    if not full and fingerprint.is_build_current(
+            src_dir,
+            dest_dir,
+            pkg_info,
+            version,
+            source_fingerprint,
+            file_stats):
+        print ("Build {0} {1} is up to date, skipping (use --full to "
+               "rebuild)".format(pkg_name, version), file=output)
+        return True
+
     success = utils.copy_package_directory(
         src_dir,
         dest_dir,
         pkg_name,
-        pkg_info.get(constants.IGNORE_PATTERNS_KEY, []),
+        ignore_patterns,
         dev_mode,
         force,
+        copy_function=functools.partial(
+            store.link_file,
+            store.get_store_dir(build_dir),
+        ),
+        incremental=incremental,
+        workers=workers,
+        output=output,
     )
     if not success:
         return False
@@ -149,10 +228,21 @@ def run_build(version, dev_mode, force):
     dest_pkg_info = utils.get_package_info_file(dest_dir)
     pkg_info[constants.BUILD_TIME_KEY] = str(datetime.now().replace(microsecond=0))
     pkg_info[constants.VERSION_KEY] = version
-    with open(dest_pkg_info, "w") as file_:
-        json.dump(pkg_info, file_, indent=4)
+    pkg_info[constants.SOURCE_FINGERPRINT_KEY] = source_fingerprint
+    # the built pkg-info is hardlinked into the store, so must be rewritten
+    # rather than written to in place
+    utils.write_package_info(dest_pkg_info, pkg_info)
+    manifest.write_manifest(
+        dest_dir,
+        manifest.create_manifest(
+            dest_dir,
+            workers,
+            manifest.read_manifest(dest_dir),
+        ),
+    )
+    registry.update_build(build_dir, pkg_name, version)
 
-    print (success_message)
+    print (success_message, file=output)
     return True
 
 
@@ -162,4 +252,4 @@ def main(args):
     Args:
         args (argparse.Namespace): arguments from commandline.
     """
-    run_build(args.version, args.d, args.f)
+    run_build(args.version, args.d, args.f, args.i, args.j, full=args.full)
@@ -0,0 +1,402 @@
+"""pkg-export and pkg-import commands for moving builds between hosts.
+
+A bundle is a compressed tar stream. Its first member is a manifest listing
+the size, mode and hash of every file in the build, followed by the build's
+pkg-info and version-info files and then the rest of its files. This means
+bundles can be written to and read from pipes, and each file can be
+verified as it's extracted.
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import stat
+import sys
+import tarfile
+import tempfile
+
+from pkg import constants, files, registry, store, utils
+
+
+def add_subparser_command(subparser):
+    """Add pkg-export and pkg-import subparser commands.
+
+    Args:
+        subparser (argparse.Parser): argparse object.
+    """
+    export_command = subparser.add_parser(
+        constants.EXPORT,
+        help="export a package build to a bundle",
+    )
+    export_command.add_argument(
+        "pkg_name",
+        type=str,
+        help="name of package to export",
+    )
+    export_command.add_argument(
+        "version",
+        type=str,
+        help="version of package to export",
+    )
+    export_command.add_argument(
+        "-o",
+        type=str,
+        default="-",
+        metavar="BUNDLE",
+        help="path to write bundle to. If not given, write to stdout",
+    )
+    export_command.add_argument(
+        "-d",
+        action="store_true",
+        help="export from develop builds",
+    )
+
+    import_command = subparser.add_parser(
+        constants.IMPORT,
+        help="import a package build from a bundle",
+    )
+    import_command.add_argument(
+        "bundle",
+        nargs="?",
+        type=str,
+        default="-",
+        help="path of bundle to import. If not given, read from stdin",
+    )
+    import_command.add_argument(
+        "-f",
+        action="store_true",
+        help="force import (don't ask for confirmation if overwriting)",
+    )
+    import_command.add_argument(
+        "-d",
+        action="store_true",
+        help="import to develop builds",
+    )
+
+
+def _get_manifest(pkg_version_dir, pkg_name, version):
+    """Get bundle manifest for build directory.
+
+    Args:
+        pkg_version_dir (str): path to build directory.
+        pkg_name (str): name of package.
+        version (str): version of package.
+
+    Returns:
+        (dict): manifest dictionary.
+        (list(str)): relative paths of files, in the order to bundle them.
+    """
+    dir_paths, file_paths = files.walk_tree(
+        pkg_version_dir,
+        utils.get_ignore_matcher([]),
+    )
+    # metadata files go first, so importers can read them straight away
+    metadata_files = [
+        constants.PKG_INFO_FILE_NAME,
+        constants.VERSION_INFO_FILE_NAME,
+    ]
+    file_paths = (
+        [path for path in metadata_files if path in file_paths]
+        + [path for path in file_paths if path not in metadata_files]
+    )
+    file_entries = []
+    for path in file_paths:
+        full_path = os.path.join(pkg_version_dir, path)
+        file_stat = os.stat(full_path)
+        file_entries.append({
+            "path": path,
+            "size": file_stat.st_size,
+            "mode": stat.S_IMODE(file_stat.st_mode),
+            "sha256": utils.hash_file(full_path),
+        })
+    manifest = {
+        constants.NAME_KEY: pkg_name,
+        constants.VERSION_KEY: version,
+        "dirs": dir_paths,
+        "files": file_entries,
+    }
+    return manifest, file_paths
+
+
+def run_export(pkg_name, version, dev_builds, output_file, output=None):
+    """Run export action.
+
+    Args:
+        pkg_name (str): name of package to export.
+        version (str): version to export.
+        dev_builds (bool): whether or not to export from dev-builds directory.
+        output_file (file): binary file object to stream bundle to.
+        output (file or None): stream to print errors to. If None, print to
+            stdout.
+
+    Returns:
+        (bool): whether export was successful.
+    """
+    if dev_builds:
+        build_dir = constants.DEV_PKG_BUILDS_DIR
+    else:
+        build_dir = constants.PKG_BUILDS_DIR
+    pkg_version_dir = os.path.join(build_dir, pkg_name, version)
+    if not os.path.isfile(utils.get_package_info_file(pkg_version_dir)):
+        utils.print_error(
+            "Package {0} has no version {1} built",
+            pkg_name,
+            version,
+            output=output,
+        )
+        return False
+
+    manifest, file_paths = _get_manifest(pkg_version_dir, pkg_name, version)
+    manifest_bytes = json.dumps(manifest, indent=4).encode("utf-8")
+    with tarfile.open(fileobj=output_file, mode="w|gz") as tar:
+        manifest_info = tarfile.TarInfo(constants.BUNDLE_MANIFEST_FILE_NAME)
+        manifest_info.size = len(manifest_bytes)
+        tar.addfile(manifest_info, io.BytesIO(manifest_bytes))
+        for path in file_paths:
+            full_path = os.path.join(pkg_version_dir, path)
+            # build files are hardlinks into the store, so files with the
+            # same contents share an inode, but every one is bundled as a
+            # regular file rather than a link to an earlier member
+            file_info = tar.gettarinfo(full_path, arcname=path)
+            file_info.type = tarfile.REGTYPE
+            file_info.linkname = ""
+            file_info.size = os.stat(full_path).st_size
+            with open(full_path, "rb") as file_:
+                tar.addfile(file_info, file_)
+    return True
+
+
+def _is_safe_path(path):
+    """Check that a bundle path stays inside the directory it's extracted to.
+
+    Args:
+        path (str): relative path from bundle.
+
+    Returns:
+        (bool): whether path is safe to extract.
+    """
+    path = os.path.normpath(path)
+    return not (os.path.isabs(path) or path.split(os.sep)[0] == os.pardir)
+
+
+def _is_safe_name(name):
+    """Check that a package name or version from a bundle is a single path
+    component, so it can't be used to write outside the builds directory.
+
+    Args:
+        name (str): name or version from bundle manifest.
+
+    Returns:
+        (bool): whether name is safe to use as a directory name.
+    """
+    if not isinstance(name, str) or name in ("", os.curdir, os.pardir):
+        return False
+    return not any(
+        separator and separator in name
+        for separator in (os.sep, os.altsep)
+    )
+
+
+def _extract_bundle(tar, staging_dir, manifest, store_dir):
+    """Extract files from bundle stream, verifying each one.
+
+    Each file is added to the object store and hardlinked into the staging
+    directory, as built files are.
+
+    Args:
+        tar (tarfile.TarFile): bundle stream, positioned after the manifest.
+        staging_dir (str): directory to extract to.
+        manifest (dict): bundle manifest.
+        store_dir (str): path to object store directory.
+
+    Raises:
+        (utils.PkgError): if the bundle doesn't match its manifest.
+    """
+    file_entries = {entry["path"]: entry for entry in manifest["files"]}
+    os.makedirs(staging_dir)
+    for dir_path in manifest.get("dirs", []):
+        if not _is_safe_path(dir_path):
+            utils.raise_error("Bundle contains unsafe path {0}", dir_path)
+        os.makedirs(os.path.join(staging_dir, dir_path), exist_ok=True)
+
+    extracted_paths = set()
+    # iterating the tarfile directly would restart from the manifest
+    for member in iter(tar.next, None):
+        entry = file_entries.get(member.name)
+        if (not _is_safe_path(member.name)
+                or not member.isfile()
+                or entry is None):
+            utils.raise_error(
+                "Bundle contains unexpected member {0}",
+                member.name,
+            )
+        dest_path = os.path.join(staging_dir, member.name)
+        parent_dir = os.path.dirname(dest_path)
+        if not os.path.isdir(parent_dir):
+            os.makedirs(parent_dir)
+
+        hasher = hashlib.sha256()
+        size = 0
+        src_file = tar.extractfile(member)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=parent_dir)
+        try:
+            with os.fdopen(file_descriptor, "wb") as dest_file:
+                for block in iter(lambda: src_file.read(1024 * 1024), b""):
+                    hasher.update(block)
+                    size += len(block)
+                    dest_file.write(block)
+            file_hash = hasher.hexdigest()
+            if size != entry["size"] or file_hash != entry["sha256"]:
+                utils.raise_error(
+                    "Checksum mismatch for {0} in bundle",
+                    member.name,
+                )
+            os.chmod(temp_path, entry["mode"])
+            os.utime(temp_path, (member.mtime, member.mtime))
+            store.link_file(store_dir, temp_path, dest_path, file_hash)
+        finally:
+            os.remove(temp_path)
+        extracted_paths.add(member.name)
+
+    missing_paths = set(file_entries) - extracted_paths
+    if missing_paths:
+        utils.raise_error(
+            "Bundle is missing files:\n\n\t{0}",
+            "\n\t".join(sorted(missing_paths)),
+        )
+
+
+def _check_package_info(staging_dir, pkg_name, version):
+    """Check that extracted pkg-info matches the bundle manifest.
+
+    Args:
+        staging_dir (str): directory the bundle was extracted to.
+        pkg_name (str): name of package in bundle manifest.
+        version (str): version of package in bundle manifest.
+
+    Raises:
+        (utils.PkgError): if the pkg-info is missing or has a different name
+            or version to the manifest.
+    """
+    _, pkg_info = utils.get_package_info(staging_dir, print_on_error=False)
+    if pkg_info is None:
+        utils.raise_error("Bundle has no readable pkg-info file")
+    info_name = pkg_info.get(constants.NAME_KEY)
+    info_version = pkg_info.get(constants.VERSION_KEY)
+    if info_name != pkg_name or info_version != version:
+        utils.raise_error(
+            "Bundle manifest is for {0} {1}, but its pkg-info is for {2} {3}",
+            pkg_name,
+            version,
+            info_name,
+            info_version,
+        )
+
+
+def run_import(input_file, dev_builds, force, interactive=True):
+    """Run import action.
+
+    Args:
+        input_file (file): binary file object to stream bundle from.
+        dev_builds (bool): whether or not to import to dev-builds directory.
+        force (bool): if True, don't ask for confirmation when rewriting.
+        interactive (bool): whether the user can be prompted for
+            confirmation. This is False when the bundle is read from stdin.
+
+    Returns:
+        (bool): whether import was successful.
+    """
+    if dev_builds:
+        build_dir = constants.DEV_PKG_BUILDS_DIR
+        success_message = "Dev Package Imported Successfully"
+    else:
+        build_dir = constants.PKG_BUILDS_DIR
+        success_message = "Package Imported Successfully"
+
+    with tarfile.open(fileobj=input_file, mode="r|*") as tar:
+        manifest_member = tar.next()
+        if (manifest_member is None
+                or manifest_member.name != constants.BUNDLE_MANIFEST_FILE_NAME):
+            utils.print_error("Input is not a pkg bundle")
+            return False
+        try:
+            manifest = json.load(tar.extractfile(manifest_member))
+        except ValueError:
+            utils.print_error("The bundle manifest is incorrectly formatted")
+            return False
+        pkg_name = manifest.get(constants.NAME_KEY)
+        version = manifest.get(constants.VERSION_KEY)
+        if not pkg_name or not version:
+            utils.print_error("The bundle manifest has no name or version")
+            return False
+        if not _is_safe_name(pkg_name) or not _is_safe_name(version):
+            utils.print_error(
+                "The bundle manifest has an invalid name or version: {0} {1}",
+                pkg_name,
+                version,
+            )
+            return False
+
+        pkg_build_dir = os.path.join(build_dir, pkg_name)
+        dest_dir = os.path.join(pkg_build_dir, version)
+        if os.path.isdir(dest_dir) and not force and not interactive:
+            utils.print_error(
+                "{0} version {1} is already built. Use -f to overwrite",
+                pkg_name,
+                version,
+            )
+            return False
+        if not utils.confirm_overwrite(dest_dir, pkg_name, dev_builds, force):
+            return False
+        if not os.path.isdir(pkg_build_dir):
+            os.mkdir(pkg_build_dir)
+
+        utils.clear_stale_staging_dirs(dest_dir)
+        staging_dir = utils.get_staging_dir(dest_dir)
+        try:
+            _extract_bundle(
+                tar,
+                staging_dir,
+                manifest,
+                store.get_store_dir(build_dir),
+            )
+            _check_package_info(staging_dir, pkg_name, version)
+            utils.swap_directory(staging_dir, dest_dir)
+            registry.update_build(build_dir, pkg_name, version)
+        except utils.PkgError as error:
+            utils.print_error(str(error))
+            return False
+        finally:
+            if os.path.isdir(staging_dir):
+                shutil.rmtree(staging_dir, onerror=utils.on_rmtree_error)
+
+    print (success_message)
+    return True
+
+
+def main(args):
+    """Export or import package based on commandline args.
+
+    Args:
+        args (argparse.Namespace): arguments from commandline.
+    """
+    if args.command == constants.EXPORT:
+        if args.o == "-":
+            # stdout is the bundle stream, so errors go to stderr
+            run_export(
+                args.pkg_name,
+                args.version,
+                args.d,
+                sys.stdout.buffer,
+                output=sys.stderr,
+            )
+        else:
+            with open(args.o, "wb") as file_:
+                run_export(args.pkg_name, args.version, args.d, file_)
+    elif args.bundle == "-":
+        run_import(sys.stdin.buffer, args.d, args.f, interactive=False)
+    else:
+        with open(args.bundle, "rb") as file_:
+            run_import(file_, args.d, args.f)
@@ -5,11 +5,17 @@ import os
 # commands
 BUILD = "build"
 CYCLE = "cycle"
+EXPORT = "export"
+GC = "gc"
+IMPORT = "import"
 INSTALL = "install"
 LIST = "list"
+PURGE = "purge"
 QUERY = "query"
+SERVE = "serve"
 UNBUILD = "unbuild"
 UNINSTALL = "uninstall"
+VERIFY = "verify"
 
 # directories
 PKGS_DIR = os.path.join(os.sep, "PythonPath", "my-pkgs")
@@ -20,6 +26,13 @@ DEV_PKG_BUILDS_DIR = os.path.join(os.sep, "PythonPath", "dev-builds")
 # filenames
 PKG_INFO_FILE_NAME = "pkg-info.json"
 VERSION_INFO_FILE_NAME = "version-info.yaml"
+MANIFEST_FILE_NAME = "pkg-manifest.json"
+STORE_DIR_NAME = ".pkg-store"
+TRASH_DIR_NAME = ".pkg-trash"
+BUILD_STATE_FILE_NAME = ".pkg-build-state.json"
+BUNDLE_MANIFEST_FILE_NAME = "pkg-bundle.json"
+REGISTRY_DIR_NAME = ".pkg-registry"
+REGISTRY_FILE_NAME = "registry.json"
 
 # pkg-info keys
 NAME_KEY = "name"
@@ -29,7 +42,27 @@ BUILD_TIME_KEY = "build_time"
 IGNORE_PATTERNS_KEY = "ignore_patterns"
 OWNER_KEY = "owner"
 DEPENDENCIES_KEY = "dependencies"
+SOURCE_FINGERPRINT_KEY = "source_fingerprint"
+LINK_MODE_KEY = "link_mode"
+
+# output formats
+TEXT = "text"
+JSON = "json"
+NDJSON = "ndjson"
+
+# install link modes
+HARDLINK = "hard"
+SYMLINK = "symlink"
 
 # other
 DEFAULT_DEV_VERSION = "dev-0.0.0"
 DEFAULT_DEV_COMMENT = "default dev version, used for testing"
+DEFAULT_COPY_WORKERS = 8
+DEFAULT_PACKAGE_WORKERS = 4
+DEFAULT_SCAN_WORKERS = 16
+DEFAULT_POLL_INTERVAL = 1.0
+WATCH_POLL_INTERVAL = 0.25
+WATCH_BATCH_DELAY = 0.05
+SERVE_CLIENT_TIMEOUT = 5.0
+SERVE_SOCKET_ENV_VAR = "PKG_SERVE_SOCKET"
+SHARED_BUILDS_ENV_VAR = "PKG_SHARED_BUILDS"
@@ -1,8 +1,9 @@
 """pkg-cycle command."""
 
 import os
+import time
 
-from pkg import build, constants, install, utils
+from pkg import build, constants, graph, install, utils, watch
 
 
 def add_subparser_command(subparser):
@@ -33,6 +34,291 @@ def add_subparser_command(subparser):
         action="store_true",
         help="install to develop mode",
     )
+    cycle_command.add_argument(
+        "-i",
+        action="store_true",
+        help="incremental build (only copy files changed since last build)",
+    )
+    cycle_command.add_argument(
+        "-j",
+        type=int,
+        default=None,
+        metavar="WORKERS",
+        help="number of threads to copy files with (default {0})".format(
+            constants.DEFAULT_COPY_WORKERS
+        ),
+    )
+    cycle_command.add_argument(
+        "--full",
+        action="store_true",
+        help=(
+            "build and install even if nothing has changed since the last "
+            "cycle"
+        ),
+    )
+    cycle_command.add_argument(
+        "--watch",
+        action="store_true",
+        help=(
+            "keep watching the package after cycling it, syncing changed "
+            "files straight into the dev build and install (requires -d)"
+        ),
+    )
+    cycle_command.add_argument(
+        "--poll",
+        action="store_true",
+        help="with --watch, poll for changes rather than using inotify",
+    )
+    cycle_command.add_argument(
+        "-r",
+        nargs="+",
+        type=str,
+        default=None,
+        metavar="ROOT",
+        help=(
+            "cycle multiple packages, in dependency order. Each root can be "
+            "a package directory or a directory containing packages"
+        ),
+    )
+    cycle_command.add_argument(
+        "-p",
+        type=int,
+        default=constants.DEFAULT_PACKAGE_WORKERS,
+        metavar="PACKAGES",
+        help="number of packages to cycle at once when using -r "
+        "(default {0})".format(constants.DEFAULT_PACKAGE_WORKERS),
+    )
+
+
+def run_cycle(
+        src_dir,
+        version,
+        dev_mode,
+        force,
+        incremental,
+        workers,
+        full=False):
+    """Build and install package.
+
+    Args:
+        src_dir (str): directory of package.
+        version (str or None): version to build. If None, use pkg-info.
+        dev_mode (bool): whether or not to build and install in dev mode.
+        force (bool): if True, don't ask for confirmation when rewriting.
+        incremental (bool): if True, only copy over files that have changed
+            since the last incremental build of this version.
+        workers (int or None): number of threads to copy files with.
+        full (bool): if True, build and install even if nothing has changed
+            since the last cycle.
+
+    Returns:
+        (bool): whether build and install were successful.
+    """
+    pkg_info_file, pkg_info = utils.get_package_info(src_dir)
+    if not pkg_info:
+        return False
+
+    pkg_name = pkg_info.get(constants.NAME_KEY)
+    if not pkg_name:
+        utils.print_error(
+            "The pkg-info file has no pkg name:\n\n\t{0}",
+            pkg_info_file,
+        )
+        return False
+
+    version = version or build.get_build_version(
+        pkg_info,
+        pkg_info_file,
+        dev_mode,
+    )
+    if not version:
+        return False
+
+    build_success = build.run_build(
+        version,
+        dev_mode,
+        force,
+        incremental,
+        workers,
+        src_dir=src_dir,
+        full=full,
+    )
+    if not build_success:
+        utils.print_error("Build failed - aborting.")
+        return False
+    return install.run_install(
+        pkg_name,
+        version,
+        dev_mode,
+        dev_mode,
+        force,
+        workers,
+        full=full,
+    )
+
+
+def run_watch(src_dir, version, force, workers, poll=False):
+    """Cycle package in dev mode, then sync changes to it until interrupted.
+
+    Changed files are copied straight into the dev build and install rather
+    than cycling the whole package again. If the pkg-info file changes, the
+    package is cycled again, since its ignore patterns may have changed.
+
+    Args:
+        src_dir (str): directory of package.
+        version (str or None): version to build. If None, use the default
+            dev version.
+        force (bool): if True, don't ask for confirmation when rewriting.
+        workers (int or None): number of threads to copy files with.
+        poll (bool): if True, poll for changes even if inotify is available.
+
+    Returns:
+        (bool): False if cycling failed, otherwise this only returns when
+            interrupted.
+    """
+    version = version or constants.DEFAULT_DEV_VERSION
+    # changes that failed to sync, to try again with the next batch
+    unsynced_changes = set()
+    while True:
+        _, pkg_info = utils.get_package_info(src_dir)
+        if not pkg_info:
+            return False
+        pkg_name = pkg_info.get(constants.NAME_KEY)
+        matcher = utils.get_ignore_matcher(
+            pkg_info.get(constants.IGNORE_PATTERNS_KEY, [])
+        )
+        # start watching before cycling, so that changes made while the
+        # package is being cycled are synced afterwards
+        watcher = watch.get_watcher(src_dir, matcher, poll)
+        try:
+            if not run_cycle(src_dir, version, True, force, False, workers):
+                return False
+            print ("Watching {0} for changes (ctrl-c to stop)".format(src_dir))
+            while True:
+                changes = watch.wait_for_changes(watcher) | unsynced_changes
+                unsynced_changes = set()
+                if constants.PKG_INFO_FILE_NAME in changes:
+                    print ("pkg-info changed, cycling again")
+                    break
+                start = time.perf_counter()
+                try:
+                    num_copied, num_removed = watch.sync_changes(
+                        src_dir,
+                        pkg_name,
+                        version,
+                        matcher,
+                        changes,
+                        workers,
+                    )
+                except (OSError, utils.PkgError) as error:
+                    utils.print_error("Failed to sync changes: {0}", error)
+                    unsynced_changes = {watch.WHOLE_TREE}
+                    continue
+                if num_copied or num_removed:
+                    print (
+                        "Synced {0} changed files, removed {1} "
+                        "({2:.1f}ms)".format(
+                            num_copied,
+                            num_removed,
+                            (time.perf_counter() - start) * 1000,
+                        )
+                    )
+        finally:
+            watcher.close()
+
+
+def find_packages(root_dirs):
+    """Find packages in given root directories.
+
+    Args:
+        root_dirs (list(str)): directories that are either packages or
+            contain packages.
+
+    Returns:
+        (dict(str, str)): source directory of each package, keyed by name.
+        (dict(str, list(str))): dependencies of each package, keyed by name.
+    """
+    src_dirs = {}
+    dependencies = {}
+    for root_dir in root_dirs:
+        root_dir = os.path.abspath(root_dir)
+        if os.path.isfile(utils.get_package_info_file(root_dir)):
+            package_dirs = [root_dir]
+        else:
+            package_dirs = sorted(
+                os.path.join(root_dir, name) for name in os.listdir(root_dir)
+                if os.path.isfile(
+                    utils.get_package_info_file(os.path.join(root_dir, name))
+                )
+            )
+        for package_dir in package_dirs:
+            pkg_info_file, pkg_info = utils.get_package_info(package_dir)
+            if not pkg_info:
+                continue
+            pkg_name = pkg_info.get(constants.NAME_KEY)
+            if not pkg_name:
+                utils.print_error(
+                    "The pkg-info file has no pkg name:\n\n\t{0}",
+                    pkg_info_file,
+                )
+                continue
+            if pkg_name in src_dirs:
+                utils.print_error(
+                    "Package {0} found in both {1} and {2}, skipping latter",
+                    pkg_name,
+                    src_dirs[pkg_name],
+                    package_dir,
+                )
+                continue
+            src_dirs[pkg_name] = package_dir
+            dependencies[pkg_name] = [
+                install.parse_dependency(dependency)[0]
+                for dependency in pkg_info.get(constants.DEPENDENCIES_KEY, [])
+            ]
+    return src_dirs, dependencies
+
+
+def run_multi_cycle(
+        root_dirs,
+        dev_mode,
+        force,
+        incremental,
+        workers,
+        package_workers,
+        full=False):
+    """Build and install multiple packages concurrently, in dependency order.
+
+    Args:
+        root_dirs (list(str)): directories that are either packages or
+            contain packages.
+        dev_mode (bool): whether or not to build and install in dev mode.
+        force (bool): if True, don't ask for confirmation when rewriting.
+        incremental (bool): if True, only copy over files that have changed
+            since the last incremental build of this version.
+        workers (int or None): number of threads to copy files with.
+        package_workers (int): number of packages to cycle at once.
+        full (bool): if True, build and install even if nothing has changed
+            since the last cycle.
+
+    Returns:
+        (dict(str, bool or None)): whether each package was cycled
+            successfully, or None if it was skipped because a dependency
+            failed.
+    """
+    src_dirs, dependencies = find_packages(root_dirs)
+    return graph.run_in_dependency_order(
+        dependencies,
+        lambda pkg_name: run_cycle(
+            src_dirs[pkg_name],
+            None,
+            dev_mode,
+            force,
+            incremental,
+            workers,
+            full,
+        ),
+        package_workers,
+    )
 
 
 def main(args):
@@ -41,6 +327,18 @@ def main(args):
     Args:
         args (argparse.Namespace): arguments from commandline.
     """
+    if args.r and args.version:
+        utils.print_error(
+            "A version can't be given when cycling multiple packages with -r"
+        )
+        return
+
+    if args.watch and (args.r or not args.d):
+        utils.print_error(
+            "--watch can only be used with -d, on a single package"
+        )
+        return
+
     if not args.d:
         keep_going = utils.prompt_user_confirmation(
             "[WARNING]: using pkg cycle outside of develop mode. "
@@ -53,29 +351,48 @@ def main(args):
             print ("Aborting.")
             return
 
-    src_dir = os.path.abspath(os.getcwd())
-    pkg_info_file, pkg_info = utils.get_package_info(src_dir)
-    if not pkg_info:
+    if args.watch:
+        try:
+            run_watch(
+                os.path.abspath(os.getcwd()),
+                args.version,
+                args.f,
+                args.j,
+                args.poll,
+            )
+        except KeyboardInterrupt:
+            print ("\nStopped watching")
         return
 
-    pkg_name = pkg_info.get(constants.NAME_KEY)
-    if not pkg_name:
-        utils.print_error(
-            "The pkg-info file has no pkg name:\n\n\t{0}",
-            pkg_info_file,
+    if not args.r:
+        run_cycle(
+            os.path.abspath(os.getcwd()),
+            args.version,
+            args.d,
+            args.f,
+            args.i,
+            args.j,
+            args.full,
         )
         return
 
-    version = args.version or build.get_build_version(
-        pkg_info,
-        pkg_info_file,
-        args.d,
-    )
-    if not version:
+    try:
+        results = run_multi_cycle(
+            args.r,
+            args.d,
+            args.f,
+            args.i,
+            args.j,
+            args.p,
+            args.full,
+        )
+    except utils.PkgError as error:
+        utils.print_error(str(error))
         return
-
-    build_success = build.run_build(version, args.d, args.f)
-    if build_success:
-        install.run_install(pkg_name, version, args.d, args.d, args.f)
-    else:
-        utils.print_error("Build failed - aborting.")
+    print ("\n Cycle Results\n -------------")
+    for pkg_name, result in sorted(results.items()):
+        if result is None:
+            status = "skipped (dependency failed)"
+        else:
+            status = "OK" if result else "FAILED"
+        print (" {0}    {1}".format(pkg_name, status))
@@ -0,0 +1,335 @@
+"""File copying functions for pkg scripts.
+
+All copy functions here have the same signature as shutil.copy2, but return
+the name of the strategy used to copy the file rather than its destination.
+"""
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import os
+import shutil
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from pkg import constants, timings
+
+
+# copy strategies, in order of preference
+REFLINK = "reflink"
+COPY_FILE_RANGE = "copy_file_range"
+SENDFILE = "sendfile"
+READ_WRITE = "read_write"
+HARDLINK = "hardlink"
+
+# ioctl request to clone a file's extents (linux/fs.h)
+_FICLONE = 0x40049409
+
+# errors that mean a strategy isn't supported for these files
+_UNSUPPORTED_ERRNOS = (
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EBADF,
+    errno.EPERM,
+)
+
+
+def copy_file(src_path, dest_path, strategies=None):
+    """Copy file contents and stats, using kernel-side copies if possible.
+
+    The file is reflinked if the filesystem supports it, otherwise copied
+    with copy_file_range or sendfile so data never passes through userspace,
+    falling back to a plain read/write copy if neither is available.
+
+    Args:
+        src_path (str): path of file to copy.
+        dest_path (str): path to copy to.
+        strategies (list(str) or None): strategies to try, in order. If None,
+            try all of them.
+
+    Returns:
+        (str): name of strategy used to copy the file.
+    """
+    strategies = strategies or (REFLINK, COPY_FILE_RANGE, SENDFILE, READ_WRITE)
+    with open(src_path, "rb") as src_file, open(dest_path, "wb") as dest_file:
+        size = os.fstat(src_file.fileno()).st_size
+        for strategy in strategies:
+            if _copy_file_contents(src_file, dest_file, size, strategy):
+                break
+            # clear anything partially copied before the next attempt
+            dest_file.seek(0)
+            dest_file.truncate()
+        else:
+            strategy = READ_WRITE
+            shutil.copyfileobj(src_file, dest_file)
+    shutil.copystat(src_path, dest_path)
+    timings.count("files_copied")
+    timings.count("bytes_copied", size)
+    return strategy
+
+
+def _copy_file_contents(src_file, dest_file, size, strategy):
+    """Copy contents of one open file to another using given strategy.
+
+    Args:
+        src_file (file): source file, opened for binary reading.
+        dest_file (file): destination file, opened for binary writing.
+        size (int): size of source file.
+        strategy (str): name of strategy to use.
+
+    Returns:
+        (bool): whether the strategy was supported and the copy succeeded.
+    """
+    src_fd = src_file.fileno()
+    dest_fd = dest_file.fileno()
+    try:
+        if strategy == REFLINK:
+            if fcntl is None or not size:
+                return False
+            fcntl.ioctl(dest_fd, _FICLONE, src_fd)
+        elif strategy == COPY_FILE_RANGE:
+            if not hasattr(os, "copy_file_range"):
+                return False
+            offset = 0
+            while offset < size:
+                num_bytes = os.copy_file_range(
+                    src_fd, dest_fd, size - offset, offset, offset
+                )
+                if not num_bytes:
+                    return False
+                offset += num_bytes
+        elif strategy == SENDFILE:
+            if not hasattr(os, "sendfile"):
+                return False
+            offset = 0
+            while offset < size:
+                num_bytes = os.sendfile(dest_fd, src_fd, offset, size - offset)
+                if not num_bytes:
+                    return False
+                offset += num_bytes
+        elif strategy == READ_WRITE:
+            shutil.copyfileobj(src_file, dest_file)
+        else:
+            return False
+    except OSError as error:
+        if error.errno in _UNSUPPORTED_ERRNOS:
+            return False
+        raise
+    return True
+
+
+def summarise_strategies(results):
+    """Get summary of strategies used to copy files.
+
+    Args:
+        results (list(str)): strategies returned by copy functions.
+
+    Returns:
+        (str): summary string, eg. "copy_file_range: 10, hardlink: 2".
+    """
+    return ", ".join(
+        "{0}: {1}".format(strategy, count)
+        for strategy, count in sorted(Counter(results).items())
+    )
+
+
+@timings.timed("walk_tree")
+def walk_tree(src_dir, matcher=None):
+    """Walk directory tree, skipping ignored files and directories.
+
+    Ignored directories are pruned before they're walked, so nothing inside
+    them is ever listed.
+
+    Args:
+        src_dir (str): path to directory to walk.
+        matcher (ignore.IgnoreMatcher or None): matcher for paths to ignore.
+
+    Returns:
+        (list(str)): paths of all subdirectories, relative to src_dir, with
+            parent directories always preceding their children.
+        (list(str)): paths of all files, relative to src_dir.
+    """
+    if matcher is not None and timings.is_enabled():
+        matcher = _TimedMatcher(matcher)
+    dir_paths = []
+    file_paths = []
+    rel_dirs_to_walk = [""]
+    while rel_dirs_to_walk:
+        rel_root = rel_dirs_to_walk.pop()
+        with os.scandir(os.path.join(src_dir, rel_root)) as entries:
+            for entry in entries:
+                rel_path = rel_root + "/" + entry.name if rel_root else entry.name
+                # follow symlinks, to match shutil.copytree
+                is_dir = entry.is_dir()
+                if matcher is not None and matcher.match(rel_path, is_dir):
+                    continue
+                if is_dir:
+                    dir_paths.append(rel_path)
+                    rel_dirs_to_walk.append(rel_path)
+                else:
+                    file_paths.append(rel_path)
+    if isinstance(matcher, _TimedMatcher):
+        timings.add_total("ignore_match", matcher.duration_ns, matcher.calls)
+    return dir_paths, file_paths
+
+
+class _TimedMatcher(object):
+    """Ignore matcher wrapper that totals the time spent matching.
+
+    Matching is timed in total rather than as a span per path, since there's
+    a call for every entry of every tree walked.
+    """
+
+    def __init__(self, matcher):
+        """Initialise wrapper.
+
+        Args:
+            matcher (ignore.IgnoreMatcher): matcher to time.
+        """
+        self._matcher = matcher
+        self.duration_ns = 0
+        self.calls = 0
+
+    def match(self, rel_path, is_dir=False):
+        """Check whether path is ignored, adding to the time taken.
+
+        Args:
+            rel_path (str): path relative to the package root.
+            is_dir (bool): whether the path is a directory.
+
+        Returns:
+            (bool): whether path is ignored.
+        """
+        start = time.perf_counter_ns()
+        result = self._matcher.match(rel_path, is_dir)
+        self.duration_ns += time.perf_counter_ns() - start
+        self.calls += 1
+        return result
+
+
+@timings.timed("copy_files")
+def copy_files(file_pairs, copy_function=copy_file, workers=None):
+    """Copy files concurrently on a thread pool.
+
+    Args:
+        file_pairs (list(tuple(str, str))): source and destination paths of
+            each file to copy. The destination directories must exist.
+        copy_function (function): function used to copy each file.
+        workers (int or None): number of threads to copy with. If None, use
+            the default number.
+
+    Returns:
+        (list(str)): strategies used to copy each file.
+    """
+    workers = workers or constants.DEFAULT_COPY_WORKERS
+    if workers == 1 or len(file_pairs) <= 1:
+        return [copy_function(src, dest) for src, dest in file_pairs]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(
+            lambda file_pair: copy_function(*file_pair),
+            file_pairs,
+        ))
+
+
+@timings.timed("copy_tree")
+def copy_tree(
+        src_dir,
+        dest_dir,
+        matcher=None,
+        copy_function=copy_file,
+        workers=None):
+    """Copy directory tree, copying files concurrently.
+
+    The tree is walked once and all directories are created before any
+    files are copied, so the file copies can all be run in parallel.
+
+    Args:
+        src_dir (str): path to source directory.
+        dest_dir (str): path to destination directory. This must not exist.
+        matcher (ignore.IgnoreMatcher or None): matcher for paths to ignore.
+        copy_function (function): function used to copy each file.
+        workers (int or None): number of threads to copy with. If None, use
+            the default number.
+
+    Returns:
+        (list(str)): strategies used to copy each file.
+    """
+    dir_paths, file_paths = walk_tree(src_dir, matcher)
+    os.makedirs(dest_dir)
+    for dir_path in dir_paths:
+        os.mkdir(os.path.join(dest_dir, dir_path))
+    results = copy_files(
+        [
+            (os.path.join(src_dir, path), os.path.join(dest_dir, path))
+            for path in file_paths
+        ],
+        copy_function,
+        workers,
+    )
+    # match shutil.copytree by copying directory stats once files are in
+    for dir_path in reversed(dir_paths):
+        shutil.copystat(
+            os.path.join(src_dir, dir_path),
+            os.path.join(dest_dir, dir_path),
+        )
+    shutil.copystat(src_dir, dest_dir)
+    return results
+
+
+def link_file(src_path, dest_path):
+    """Reflink file to destination, or hardlink it if it can't be reflinked.
+
+    A reflink shares the file's data copy-on-write, so later edits to either
+    file don't show through the other, whereas a hardlink is the same file.
+    If neither is supported the file is copied.
+
+    Args:
+        src_path (str): path of file to link.
+        dest_path (str): path to create link at.
+
+    Returns:
+        (str): name of strategy used to copy the file.
+    """
+    with open(src_path, "rb") as src_file, open(dest_path, "wb") as dest_file:
+        size = os.fstat(src_file.fileno()).st_size
+        is_reflinked = _copy_file_contents(src_file, dest_file, size, REFLINK)
+    if is_reflinked or not size:
+        shutil.copystat(src_path, dest_path)
+        timings.count("files_copied")
+        return REFLINK if is_reflinked else READ_WRITE
+    os.remove(dest_path)
+    try:
+        os.link(src_path, dest_path)
+    except OSError:
+        return copy_file(src_path, dest_path)
+    timings.count("files_hardlinked")
+    return HARDLINK
+
+
+def symlink_entries(src_dir, dest_dir, matcher=None, exclude=()):
+    """Create directory whose top-level entries are symlinks into another.
+
+    Args:
+        src_dir (str): path to source directory.
+        dest_dir (str): path to destination directory. This must not exist.
+        matcher (ignore.IgnoreMatcher or None): matcher for paths to ignore.
+        exclude (iterable(str)): names of entries not to link.
+    """
+    os.makedirs(dest_dir)
+    with os.scandir(src_dir) as entries:
+        for entry in entries:
+            if entry.name in exclude:
+                continue
+            if matcher is not None and matcher.match(entry.name, entry.is_dir()):
+                continue
+            os.symlink(
+                os.path.abspath(entry.path),
+                os.path.join(dest_dir, entry.name),
+            )
@@ -0,0 +1,216 @@
+"""Fingerprints of package source trees, for skipping no-op builds.
+
+A build records the fingerprint of the source tree it was built from in its
+pkg-info. The fingerprint is a hash of the path, size, mtime and mode of
+every file that would be copied into the build, so checking whether a build
+is up to date only needs the source tree walking and statting, not reading.
+
+If the fingerprints differ (eg. files have been touched or checked out
+again without changing), source files are compared against the build's
+manifest instead, and only files whose stats differ have their contents
+hashed. If everything matches, the build's fingerprint is updated, so the
+next check is back to stats only.
+
+Either way, the build itself is checked against its manifest in the same
+way, so a build that's been edited or had files removed is rebuilt.
+"""
+
+import hashlib
+import os
+import stat
+
+from pkg import constants, manifest, registry, utils
+
+
+# pkg-info keys that are added to the source pkg-info when building
+_BUILD_KEYS = (constants.BUILD_TIME_KEY, constants.SOURCE_FINGERPRINT_KEY)
+
+
+def get_fingerprint(src_dir, matcher):
+    """Get stat fingerprint of package source tree.
+
+    Args:
+        src_dir (str): directory of package.
+        matcher (ignore.IgnoreMatcher): matcher for paths that aren't copied
+            into builds.
+
+    Returns:
+        (str): fingerprint of source tree.
+        (dict(str, os.stat_result)): stats of each source file, keyed by
+            path relative to src_dir.
+    """
+    from pkg import files
+
+    _, file_paths = files.walk_tree(src_dir, matcher)
+    file_stats = {}
+    hasher = hashlib.sha256()
+    for path in sorted(file_paths):
+        file_stat = os.stat(os.path.join(src_dir, path))
+        file_stats[path] = file_stat
+        hasher.update("{0}\0{1}\0{2}\0{3:o}\n".format(
+            path,
+            file_stat.st_size,
+            file_stat.st_mtime_ns,
+            stat.S_IMODE(file_stat.st_mode),
+        ).encode("utf-8"))
+    return hasher.hexdigest(), file_stats
+
+
+def _strip_build_keys(pkg_info):
+    """Get pkg-info without the keys added to it when building.
+
+    Args:
+        pkg_info (dict): pkg-info dictionary.
+
+    Returns:
+        (dict): pkg-info without build keys.
+    """
+    return dict(
+        (key, value) for key, value in pkg_info.items()
+        if key not in _BUILD_KEYS
+    )
+
+
+def _matches_manifest(src_dir, file_stats, build_manifest):
+    """Check whether source files have the same contents as a build.
+
+    Args:
+        src_dir (str): directory of package.
+        file_stats (dict(str, os.stat_result)): stats of each source file.
+        build_manifest (dict): manifest of build.
+
+    Returns:
+        (bool): whether every file matches the manifest.
+    """
+    src_paths = set(file_stats) - set([
+        constants.PKG_INFO_FILE_NAME,
+        constants.MANIFEST_FILE_NAME,
+    ])
+    if src_paths != set(build_manifest):
+        return False
+    for path in src_paths:
+        file_stat = file_stats[path]
+        entry = build_manifest[path]
+        if (file_stat.st_size != entry["size"]
+                or stat.S_IMODE(file_stat.st_mode) != entry["mode"]):
+            return False
+        if file_stat.st_mtime_ns == entry["mtime_ns"]:
+            continue
+        file_hash = utils.hash_file(os.path.join(src_dir, path))
+        if file_hash != entry.get("sha256"):
+            return False
+    return True
+
+
+def _is_build_intact(build_dir, build_manifest):
+    """Check whether build files still match the build's manifest.
+
+    Args:
+        build_dir (str): directory of build.
+        build_manifest (dict): manifest of build.
+
+    Returns:
+        (bool): whether no files are missing, added or changed.
+    """
+    (
+        missing_paths,
+        extra_paths,
+        modified_paths,
+        unknown_paths,
+    ) = manifest.compare_stats(build_dir, build_manifest)
+    if missing_paths or extra_paths or modified_paths:
+        return False
+    return all(
+        utils.hash_file(os.path.join(build_dir, path))
+        == build_manifest[path].get("sha256")
+        for path in unknown_paths
+    )
+
+
+def is_build_current(
+        src_dir,
+        build_dir,
+        pkg_info,
+        version,
+        fingerprint,
+        file_stats):
+    """Check whether build is up to date with package source.
+
+    Args:
+        src_dir (str): directory of package.
+        build_dir (str): directory of build.
+        pkg_info (dict): pkg-info of package source.
+        version (str): version being built.
+        fingerprint (str): current fingerprint of source tree.
+        file_stats (dict(str, os.stat_result)): stats of each source file,
+            as returned with the fingerprint.
+
+    Returns:
+        (bool): whether building again would give the same build, and the
+            build hasn't been changed since it was made.
+    """
+    build_pkg_info_file, build_pkg_info = utils.get_package_info(
+        build_dir,
+        print_on_error=False,
+    )
+    if not build_pkg_info:
+        return False
+    build_fingerprint = build_pkg_info.get(constants.SOURCE_FINGERPRINT_KEY)
+    if not build_fingerprint:
+        # built before fingerprints were recorded
+        return False
+    build_manifest = manifest.read_manifest(build_dir)
+    if build_manifest is None or not _is_build_intact(
+            build_dir, build_manifest):
+        return False
+    if build_fingerprint == fingerprint:
+        return True
+
+    expected_pkg_info = _strip_build_keys(pkg_info)
+    expected_pkg_info[constants.VERSION_KEY] = version
+    if (_strip_build_keys(build_pkg_info) != expected_pkg_info
+            or not _matches_manifest(src_dir, file_stats, build_manifest)):
+        return False
+
+    build_pkg_info[constants.SOURCE_FINGERPRINT_KEY] = fingerprint
+    utils.write_package_info(build_pkg_info_file, build_pkg_info)
+    registry.update_build(
+        os.path.dirname(os.path.dirname(build_dir)),
+        build_pkg_info.get(constants.NAME_KEY),
+        version,
+    )
+    return True
+
+
+def is_install_current(install_dir, build_pkg_info, link_mode=None):
+    """Check whether install was made from the given build.
+
+    Args:
+        install_dir (str): directory of install.
+        build_pkg_info (dict): pkg-info of build.
+        link_mode (str or None): how the install would be linked to the
+            build, if at all.
+
+    Returns:
+        (bool): whether installing the build again would give the same
+            install.
+    """
+    build_fingerprint = build_pkg_info.get(constants.SOURCE_FINGERPRINT_KEY)
+    if not build_fingerprint:
+        return False
+    _, installed_pkg_info = utils.get_package_info(
+        install_dir,
+        print_on_error=False,
+    )
+    if not installed_pkg_info:
+        return False
+    if installed_pkg_info.get(constants.LINK_MODE_KEY) != link_mode:
+        return False
+    return all(
+        installed_pkg_info.get(key) == build_pkg_info.get(key)
+        for key in (
+            constants.VERSION_KEY,
+            constants.BUILD_TIME_KEY,
+            constants.SOURCE_FINGERPRINT_KEY,
+        )
+    )
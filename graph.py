@@ -0,0 +1,131 @@
+"""Dependency graph scheduling for running actions on multiple packages."""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from pkg import utils
+
+
+def _get_internal_dependencies(dependencies):
+    """Restrict dependencies to those within the graph.
+
+    Args:
+        dependencies (dict(str, iterable(str))): dict mapping each name to
+            the names it depends on.
+
+    Returns:
+        (dict(str, set(str))): dict mapping each name to the names it depends
+            on that are also keys of the dict.
+    """
+    return {
+        name: set(
+            dependency for dependency in name_dependencies
+            if dependency in dependencies and dependency != name
+        )
+        for name, name_dependencies in dependencies.items()
+    }
+
+
+def get_topological_order(dependencies):
+    """Get order to process names in, so dependencies always come first.
+
+    Dependencies on names that aren't keys of the dict are ignored.
+
+    Args:
+        dependencies (dict(str, iterable(str))): dict mapping each name to
+            the names it depends on.
+
+    Raises:
+        (utils.PkgError): if the dependencies contain a cycle.
+
+    Returns:
+        (list(str)): ordered names.
+    """
+    dependencies = _get_internal_dependencies(dependencies)
+    order = []
+    remaining = dict(dependencies)
+    while remaining:
+        ready = sorted(
+            name for name, name_dependencies in remaining.items()
+            if not name_dependencies - set(order)
+        )
+        if not ready:
+            utils.raise_error(
+                "Dependency cycle found between packages: {0}",
+                ", ".join(sorted(remaining)),
+            )
+        order.extend(ready)
+        for name in ready:
+            del remaining[name]
+    return order
+
+
+def run_in_dependency_order(dependencies, function, workers=None):
+    """Run function on each name concurrently, in dependency order.
+
+    Each name is started as soon as all of its dependencies have finished,
+    so independent names run at the same time. If the function fails for a
+    name, including by raising an exception, the error is printed and
+    anything depending on it is skipped, while other names carry on.
+
+    Args:
+        dependencies (dict(str, iterable(str))): dict mapping each name to
+            the names it depends on. Dependencies on names that aren't keys
+            of the dict are ignored.
+        function (function): function to run, which takes a name and returns
+            whether it succeeded.
+        workers (int or None): maximum number of names to run at once.
+
+    Raises:
+        (utils.PkgError): if the dependencies contain a cycle.
+
+    Returns:
+        (dict(str, bool or None)): whether function succeeded for each name,
+            or None if it was skipped because a dependency failed.
+    """
+    # check for cycles up front, so nothing runs if the graph is invalid
+    get_topological_order(dependencies)
+    dependencies = _get_internal_dependencies(dependencies)
+    dependents = {name: [] for name in dependencies}
+    for name, name_dependencies in dependencies.items():
+        for dependency in name_dependencies:
+            dependents[dependency].append(name)
+    num_unfinished = {
+        name: len(name_dependencies)
+        for name, name_dependencies in dependencies.items()
+    }
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {}
+
+        def finish(name, result):
+            """Record result and start any dependents that are now ready."""
+            results[name] = result
+            for dependent in dependents[name]:
+                num_unfinished[dependent] -= 1
+                if num_unfinished[dependent]:
+                    continue
+                if all(results[dep] for dep in dependencies[dependent]):
+                    running[executor.submit(function, dependent)] = dependent
+                else:
+                    finish(dependent, None)
+
+        for name in sorted(dependencies):
+            if not dependencies[name]:
+                running[executor.submit(function, name)] = name
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    result = bool(future.result())
+                except Exception as error:
+                    utils.print_error(
+                        "{0} failed: {1}: {2}",
+                        name,
+                        type(error).__name__,
+                        error,
+                    )
+                    result = False
+                finish(name, result)
+    return results
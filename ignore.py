@@ -0,0 +1,167 @@
+"""Gitignore-style pattern matching for files ignored when copying packages.
+
+Patterns follow the same rules as gitignore files:
+    - blank lines and lines starting with # are skipped.
+    - a leading ! negates the pattern, re-including anything it matches.
+    - a trailing / means the pattern only matches directories.
+    - patterns containing a / (other than a trailing one) are anchored to
+        the package root, other patterns match names at any depth.
+    - * and ? match anything except /, and ** matches across directories.
+    - later patterns take precedence over earlier ones.
+"""
+
+import re
+
+
+class IgnoreMatcher(object):
+    """Compiled matcher for a list of ignore patterns.
+
+    Consecutive patterns of the same polarity are combined into a single
+    regex, so each path is checked against one regex per run of negated or
+    non-negated patterns rather than once per pattern.
+    """
+
+    def __init__(self, patterns):
+        """Initialise matcher.
+
+        Args:
+            patterns (iterable(str)): gitignore-style patterns.
+        """
+        segments = []
+        for pattern in patterns:
+            compiled_pattern = _compile_pattern(pattern)
+            if compiled_pattern is None:
+                continue
+            regex, negated, dir_only = compiled_pattern
+            if not segments or segments[-1][0] != negated:
+                segments.append((negated, [], []))
+            _, dir_regexes, file_regexes = segments[-1]
+            dir_regexes.append(regex)
+            if not dir_only:
+                file_regexes.append(regex)
+
+        # segments are checked last first, since later patterns take
+        # precedence
+        self._compiled_segments = [
+            (
+                negated,
+                _combine_regexes(dir_regexes),
+                _combine_regexes(file_regexes),
+            )
+            for negated, dir_regexes, file_regexes in reversed(segments)
+        ]
+
+    def match(self, rel_path, is_dir=False):
+        """Check whether path is ignored.
+
+        Args:
+            rel_path (str): path relative to the package root, using / as
+                separator.
+            is_dir (bool): whether the path is a directory.
+
+        Returns:
+            (bool): whether the path is ignored.
+        """
+        for negated, dir_regex, file_regex in self._compiled_segments:
+            regex = dir_regex if is_dir else file_regex
+            if regex is not None and regex.match(rel_path):
+                return not negated
+        return False
+
+
+def _combine_regexes(regexes):
+    """Combine regexes into a single compiled alternation.
+
+    Args:
+        regexes (list(str)): regex strings.
+
+    Returns:
+        (re.Pattern or None): compiled regex, or None if no regexes given.
+    """
+    if not regexes:
+        return None
+    return re.compile("|".join("(?:{0})".format(regex) for regex in regexes))
+
+
+def _compile_pattern(pattern):
+    """Convert gitignore-style pattern to a regex string.
+
+    Args:
+        pattern (str): pattern to convert.
+
+    Returns:
+        (tuple(str, bool, bool) or None): regex matching the full relative
+            path, whether the pattern is negated, and whether it only
+            matches directories. None if the line isn't a pattern.
+    """
+    pattern = pattern.strip()
+    if not pattern or pattern.startswith("#"):
+        return None
+    negated = pattern.startswith("!")
+    if negated:
+        pattern = pattern[1:]
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    if not pattern:
+        return None
+
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    regex = _translate(pattern)
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+    return "^" + regex + "$", negated, dir_only
+
+
+def _translate(pattern):
+    """Translate glob pattern to regex, with gitignore handling of **.
+
+    Args:
+        pattern (str): glob pattern, with no leading or trailing /.
+
+    Returns:
+        (str): regex string.
+    """
+    regex = ""
+    i = 0
+    length = len(pattern)
+    while i < length:
+        char = pattern[i]
+        if pattern.startswith("**", i):
+            at_start = (i == 0 or pattern[i - 1] == "/")
+            if at_start and pattern.startswith("**/", i):
+                # leading or middle **/ matches zero or more directories
+                regex += "(?:.*/)?"
+                i += 3
+                continue
+            if at_start and i + 2 == length:
+                # trailing /** matches everything inside
+                regex += ".*"
+                i += 2
+                continue
+            regex += "[^/]*"
+            i += 2
+        elif char == "*":
+            regex += "[^/]*"
+            i += 1
+        elif char == "?":
+            regex += "[^/]"
+            i += 1
+        elif char == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                regex += re.escape(char)
+                i += 1
+                continue
+            contents = pattern[i + 1:end]
+            if contents.startswith("!"):
+                contents = "^" + contents[1:]
+            regex += "[" + contents.replace("\\", "\\\\") + "]"
+            i = end + 1
+        elif char == "\\" and i + 1 < length:
+            regex += re.escape(pattern[i + 1])
+            i += 2
+        else:
+            regex += re.escape(char)
+            i += 1
+    return regex
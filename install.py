@@ -1,11 +1,12 @@
 """pkg-install command."""
 
 from datetime import datetime
-import json
 import os
+import re
 import shutil
 
-from pkg import constants, utils
+from pkg import constants, files, fingerprint, graph, layers, registry
+from pkg import utils, version_spec
 
 
 def add_subparser_command(subparser):
@@ -27,7 +28,11 @@ def add_subparser_command(subparser):
     install_command.add_argument(
         "version",
         type=str,
-        help="Version of package to install",
+        help=(
+            "Version of package to install. This can also be a version spec, "
+            "eg. 'latest', '>=1.2,<2' or '~1.2', to install the highest "
+            "matching build"
+        ),
     )
     install_command.add_argument(
         "-f",
@@ -44,18 +49,78 @@ def add_subparser_command(subparser):
         action="store_true",
         help="install to develop mode, but using pkg builds",
     )
+    install_command.add_argument(
+        "-j",
+        type=int,
+        default=None,
+        metavar="WORKERS",
+        help="number of threads to copy files with (default {0})".format(
+            constants.DEFAULT_COPY_WORKERS
+        ),
+    )
+    install_command.add_argument(
+        "--link",
+        nargs="?",
+        const=constants.HARDLINK,
+        default=None,
+        choices=[constants.HARDLINK, constants.SYMLINK],
+        help=(
+            "link install to the build rather than copying it, either by "
+            "hardlinking every file (the default) or by symlinking each "
+            "top-level entry. Hardlinked files are reflinked instead where "
+            "the filesystem supports it. Otherwise, editing a linked file "
+            "changes it in the build and in every other build and install "
+            "sharing the same content"
+        ),
+    )
+    install_command.add_argument(
+        "--full",
+        action="store_true",
+        help="install even if the build is already installed",
+    )
+    install_command.add_argument(
+        "--with-deps",
+        action="store_true",
+        help=(
+            "also install all dependencies of the package that are built but "
+            "not installed at the required version"
+        ),
+    )
 
 
-def run_install(pkg_name, version, dev_builds, dev_installs, force):
+def run_install(
+        pkg_name,
+        version,
+        dev_builds,
+        dev_installs,
+        force,
+        workers=None,
+        link_mode=None,
+        full=False,
+        output=None):
     """Run build action.
 
+    If the install was already made from the same build, nothing is copied.
+    Builds that are only in a shared build store are pulled into the local
+    builds directory first.
+
     Args:
         pkg_name (str): name of package to build.
-        version (str): version to build.
+        version (str): version to build, or version spec to resolve.
         dev_builds (bool): whether or not to get builds from dev-builds
             directory.
         dev_installs (bool): whether or not to install to dev directory.
         force (bool): if True, don't ask for confirmation when rewriting.
+        workers (int or None): number of threads to copy files with.
+        link_mode (str or None): if given, link install to the build instead
+            of copying it. This can be either HARDLINK or SYMLINK.
+        full (bool): if True, install even if the build is already
+            installed.
+        output (file or None): stream to print progress to. If None, print
+            to stdout.
+
+    Returns:
+        (bool): if install was successful.
     """
     if dev_builds:
         build_dir = constants.DEV_PKG_BUILDS_DIR
@@ -69,19 +134,53 @@ def run_install(pkg_name, version, dev_builds, dev_installs, force):
         pkgs_dir = constants.PKGS_DIR
         success_message = "Package Installed Successfully"
 
-    pkg_build_dir = os.path.join(build_dir, pkg_name)
-    if not os.path.isdir(pkg_build_dir):
+    builds_dirs = layers.get_builds_dirs(build_dir)
+    if not layers.has_package(builds_dirs, pkg_name):
         utils.print_error("Package {0} does not exits", pkg_name)
-        return
+        return False
 
-    pkg_version_dir = os.path.join(pkg_build_dir, version)
-    if not os.path.isdir(pkg_version_dir):
+    try:
+        resolved_version = layers.resolve_version(
+            builds_dirs,
+            pkg_name,
+            version,
+        )
+    except utils.PkgError as error:
+        utils.print_error(str(error))
+        return False
+    if resolved_version is None:
+        utils.print_error(
+            "Package {0} has no build matching version {1}",
+            pkg_name,
+            version,
+        )
+        return False
+    if resolved_version != version:
+        print ("Resolved {0} {1} to version {2}".format(
+            pkg_name,
+            version,
+            resolved_version,
+        ), file=output)
+        version = resolved_version
+
+    try:
+        pkg_version_dir = layers.get_local_build(
+            build_dir,
+            pkg_name,
+            version,
+            workers,
+            output,
+        )
+    except utils.PkgError as error:
+        utils.print_error(str(error))
+        return False
+    if pkg_version_dir is None:
         utils.print_error(
             "Package {0} has no version {1} built",
             pkg_name,
             version
         )
-        return
+        return False
 
     pkg_info_file, pkg_info = utils.get_package_info(pkg_version_dir)
     if (pkg_info.get(constants.NAME_KEY) != pkg_name
@@ -90,26 +189,303 @@ def run_install(pkg_name, version, dev_builds, dev_installs, force):
             "The pkg-info file name or version is incorrect:\n\n\t{0}",
             pkg_info_file,
         )
-        return
+        return False
 
     dest_dir = os.path.join(pkgs_dir, pkg_name)
-    success = utils.copy_package_directory(
-        pkg_version_dir,
-        dest_dir,
+    if not full and fingerprint.is_install_current(
+            dest_dir, pkg_info, link_mode):
+        print ("{0} {1} is already installed from this build, skipping (use "
+               "--full to reinstall)".format(pkg_name, version), file=output)
+        return True
+
+    if not utils.confirm_overwrite(
+            dest_dir, pkg_name, dev_installs, force, output):
+        return False
+
+    root_mtime = registry.get_root_mtime(pkgs_dir)
+    # install to a staging directory and then swap it in, so that the live
+    # install is never missing or partially copied
+    utils.clear_stale_staging_dirs(dest_dir)
+    staging_dir = utils.get_staging_dir(dest_dir)
+    ignore_patterns = pkg_info.get(constants.IGNORE_PATTERNS_KEY, [])
+    try:
+        if link_mode == constants.SYMLINK:
+            # pkg-info is always written as a real file, below
+            files.symlink_entries(
+                pkg_version_dir,
+                staging_dir,
+                utils.get_ignore_matcher(ignore_patterns),
+                exclude=[constants.PKG_INFO_FILE_NAME],
+            )
+        else:
+            success = utils.copy_package_directory(
+                pkg_version_dir,
+                staging_dir,
+                pkg_name,
+                ignore_patterns,
+                dev_installs,
+                True,
+                copy_function=(
+                    files.link_file if link_mode == constants.HARDLINK
+                    else files.copy_file
+                ),
+                workers=workers,
+                output=output,
+            )
+            if not success:
+                return False
+
+        staging_pkg_info = utils.get_package_info_file(staging_dir)
+        pkg_info[constants.INSTALL_TIME_KEY] = str(
+            datetime.now().replace(microsecond=0)
+        )
+        if link_mode:
+            pkg_info[constants.LINK_MODE_KEY] = link_mode
+        utils.write_package_info(staging_pkg_info, pkg_info)
+        utils.swap_directory(staging_dir, dest_dir)
+        registry.update_install(pkgs_dir, pkg_name, root_mtime)
+    finally:
+        if os.path.isdir(staging_dir):
+            shutil.rmtree(staging_dir, onerror=utils.on_rmtree_error)
+
+    print (success_message, file=output)
+    return True
+
+
+def parse_dependency(dependency):
+    """Parse dependency string from pkg-info.
+
+    Args:
+        dependency (str): dependency, either a package name, of the form
+            name==version, or a name followed by a version spec, eg.
+            name>=1.2,<2 or name~1.2.
+
+    Returns:
+        (str): name of dependency.
+        (str or None): required version or version spec, if given.
+    """
+    match = re.match(r"\s*([^<>=!~\s]+)\s*(.*)", dependency)
+    pkg_name, spec = match.group(1), match.group(2).strip()
+    if spec.startswith("==") and not version_spec.is_spec(spec[2:]):
+        spec = spec[2:].strip()
+    return pkg_name, spec or None
+
+
+def get_installed_version(pkgs_dir, pkg_name):
+    """Get currently installed version of package.
+
+    Args:
+        pkgs_dir (str): install directory.
+        pkg_name (str): name of package.
+
+    Returns:
+        (str or None): installed version, if package is installed.
+    """
+    pkg_info = registry.get_install(pkgs_dir, pkg_name)
+    if not pkg_info:
+        return None
+    return pkg_info.get(constants.VERSION_KEY)
+
+
+def resolve_dependencies(pkg_name, version, build_dir, pkgs_dir, output=None):
+    """Resolve transitive dependencies of package against available builds.
+
+    Dependencies given without a version, or with a version spec, resolve
+    to the installed version if there is one that matches, and otherwise to
+    the highest matching build. A dependency required by several packages
+    resolves to a version matching all of their specs, with a warning if
+    there isn't one.
+
+    Args:
+        pkg_name (str): name of package.
+        version (str): version or version spec of package.
+        build_dir (str): builds directory to resolve against, along with
+            any shared build stores behind it.
+        pkgs_dir (str): install directory.
+        output (file or None): stream to print warnings to. If None, print
+            to stdout.
+
+    Raises:
+        (utils.PkgError): if a version spec is invalid, or the package has
+            no build matching the given version spec.
+
+    Returns:
+        (dict(str, str)): version to install of each package that needs
+            installing, including the given package.
+        (dict(str, list(str))): dependency names of each package to install.
+    """
+    builds_dirs = layers.get_builds_dirs(build_dir)
+    versions = {}
+    dependencies = {}
+    # installed dependencies that are kept, and have had their own
+    # dependencies queued
+    installed_versions = {}
+    # version specs that dependents require of each dependency
+    requirements = {}
+    to_resolve = [(pkg_name, version, None)]
+    while to_resolve:
+        name, required_version, parent_name = to_resolve.pop()
+        if parent_name is not None:
+            requirements.setdefault(name, []).append(
+                (required_version, parent_name)
+            )
+        current_version = versions.get(name) or installed_versions.get(name)
+        if current_version is not None:
+            if version_spec.matches(current_version, required_version):
+                continue
+            if name == pkg_name:
+                print (
+                    "[WARNING] {0} requires {1} version {2}, but version {3} "
+                    "is already required".format(
+                        parent_name,
+                        name,
+                        required_version,
+                        versions[name],
+                    ),
+                    file=output,
+                )
+                continue
+        if parent_name is None:
+            resolved_version = layers.resolve_version(
+                builds_dirs,
+                name,
+                required_version,
+            )
+            if resolved_version is None:
+                utils.raise_error(
+                    "Package {0} has no build matching version {1}",
+                    name,
+                    required_version,
+                )
+            required_version = resolved_version
+        else:
+            specs = [spec for spec, _ in requirements[name]]
+            installed_info = registry.get_install(pkgs_dir, name) or {}
+            installed_version = installed_info.get(constants.VERSION_KEY)
+            if installed_version and all(
+                    version_spec.matches(installed_version, spec)
+                    for spec in specs):
+                # installed dependencies aren't reinstalled, but any of their
+                # own dependencies may still be missing
+                if name not in installed_versions:
+                    installed_versions[name] = installed_version
+                    for dependency in installed_info.get(
+                            constants.DEPENDENCIES_KEY, []):
+                        dependency_name, dependency_version = (
+                            parse_dependency(dependency)
+                        )
+                        to_resolve.append(
+                            (dependency_name, dependency_version, name)
+                        )
+                continue
+            required_version = layers.resolve_all(builds_dirs, name, specs)
+            if not required_version:
+                if current_version is not None:
+                    # keep the version chosen for the earlier dependents
+                    print (
+                        "[WARNING] No build of {0} matches every version "
+                        "required of it, keeping version {1}:\n\n\t{2}"
+                        "\n".format(
+                            name,
+                            current_version,
+                            "\n\t".join(
+                                "{0} requires {1}".format(
+                                    dependent,
+                                    spec or version_spec.LATEST,
+                                )
+                                for spec, dependent in requirements[name]
+                            ),
+                        ),
+                        file=output,
+                    )
+                else:
+                    print (
+                        "[WARNING] Dependency {0} of {1} has no matching "
+                        "builds in {2}, skipping".format(
+                            name,
+                            parent_name,
+                            build_dir,
+                        ),
+                        file=output,
+                    )
+                continue
+            # a newer version replaces an installed one that's been kept
+            installed_versions.pop(name, None)
+
+        _, pkg_info = utils.get_package_info(
+            os.path.join(
+                layers.find_build(builds_dirs, name, required_version)
+                or build_dir,
+                name,
+                required_version,
+            ),
+            print_on_error=False,
+        )
+        versions[name] = required_version
+        dependencies[name] = []
+        for dependency in (pkg_info or {}).get(constants.DEPENDENCIES_KEY, []):
+            dependency_name, dependency_version = parse_dependency(dependency)
+            dependencies[name].append(dependency_name)
+            to_resolve.append((dependency_name, dependency_version, name))
+    return versions, dependencies
+
+
+def run_install_with_dependencies(
         pkg_name,
-        pkg_info.get(constants.IGNORE_PATTERNS_KEY, []),
+        version,
+        dev_builds,
         dev_installs,
         force,
-    )
-    if not success:
-        return
+        workers=None,
+        link_mode=None,
+        full=False):
+    """Install package along with any dependencies that aren't installed.
 
-    dest_pkg_info = utils.get_package_info_file(dest_dir)
-    pkg_info[constants.INSTALL_TIME_KEY] = str(datetime.now().replace(microsecond=0))
-    with open(dest_pkg_info, "w") as file_:
-        json.dump(pkg_info, file_, indent=4)
+    Dependencies are installed concurrently, with each package starting as
+    soon as its own dependencies have been installed.
 
-    print (success_message)
+    Args:
+        pkg_name (str): name of package to build.
+        version (str): version to build.
+        dev_builds (bool): whether or not to get builds from dev-builds
+            directory.
+        dev_installs (bool): whether or not to install to dev directory.
+        force (bool): if True, don't ask for confirmation when rewriting.
+        workers (int or None): number of threads to copy files with.
+        link_mode (str or None): if given, link installs to the builds
+            instead of copying them. This can be either HARDLINK or SYMLINK.
+        full (bool): if True, install packages even if their builds are
+            already installed.
+
+    Returns:
+        (dict(str, bool or None)): whether each package was installed
+            successfully, or None if it was skipped because a dependency
+            failed.
+    """
+    build_dir = constants.DEV_PKG_BUILDS_DIR if dev_builds else (
+        constants.PKG_BUILDS_DIR
+    )
+    pkgs_dir = constants.DEV_PKGS_DIR if dev_installs else constants.PKGS_DIR
+    versions, dependencies = resolve_dependencies(
+        pkg_name,
+        version,
+        build_dir,
+        pkgs_dir,
+    )
+    return graph.run_in_dependency_order(
+        dependencies,
+        lambda name: run_install(
+            name,
+            versions[name],
+            dev_builds,
+            dev_installs,
+            force,
+            workers,
+            link_mode,
+            full,
+        ),
+        constants.DEFAULT_PACKAGE_WORKERS,
+    )
 
 
 def main(args):
@@ -120,10 +496,37 @@ def main(args):
     """
     dev_builds = args.d and not args.pd
     dev_installs = args.d or args.pd
-    run_install(
-        args.pkg_name,
-        args.version,
-        dev_builds,
-        dev_installs,
-        args.f,
-    )
+    if not args.with_deps:
+        run_install(
+            args.pkg_name,
+            args.version,
+            dev_builds,
+            dev_installs,
+            args.f,
+            args.j,
+            args.link,
+            args.full,
+        )
+        return
+
+    try:
+        results = run_install_with_dependencies(
+            args.pkg_name,
+            args.version,
+            dev_builds,
+            dev_installs,
+            args.f,
+            args.j,
+            args.link,
+            args.full,
+        )
+    except utils.PkgError as error:
+        utils.print_error(str(error))
+        return
+    print ("\n Install Results\n ---------------")
+    for pkg_name, result in sorted(results.items()):
+        if result is None:
+            status = "skipped (dependency failed)"
+        else:
+            status = "OK" if result else "FAILED"
+        print (" {0}    {1}".format(pkg_name, status))
@@ -0,0 +1,321 @@
+"""Layered build roots, with shared build stores behind the local one.
+
+Builds are only ever made in the local builds directory, but packages can
+also be installed from shared, read-only build stores, given as a search
+path in the PKG_SHARED_BUILDS environment variable. The local builds
+directory acts as a cache in front of them: the first time a build is
+installed from a shared store it's pulled into the local builds directory
+and verified against its manifest, and every later install uses the local
+copy without reading the shared store again.
+"""
+
+import functools
+import os
+import shutil
+
+from pkg import constants, files, manifest, registry, store, utils
+from pkg import version_spec
+
+
+def get_shared_builds_dirs():
+    """Get shared build stores, in the order they're searched.
+
+    Returns:
+        (list(str)): shared build directories.
+    """
+    return [
+        os.path.abspath(path)
+        for path in os.environ.get(
+            constants.SHARED_BUILDS_ENV_VAR,
+            "",
+        ).split(os.pathsep)
+        if path
+    ]
+
+
+def get_builds_dirs(builds_dir):
+    """Get search path of build directories, starting from given one.
+
+    Shared build stores are only searched behind the local pkg builds
+    directory, since dev builds are never shared.
+
+    Args:
+        builds_dir (str): local build directory.
+
+    Returns:
+        (list(str)): build directories, in the order they're searched.
+    """
+    builds_dirs = [builds_dir]
+    if os.path.normpath(builds_dir) != os.path.normpath(
+            constants.PKG_BUILDS_DIR):
+        return builds_dirs
+    for shared_builds_dir in get_shared_builds_dirs():
+        if os.path.normpath(shared_builds_dir) not in [
+                os.path.normpath(path) for path in builds_dirs]:
+            builds_dirs.append(shared_builds_dir)
+    return builds_dirs
+
+
+def has_package(builds_dirs, pkg_name):
+    """Check whether any build directory has builds of package.
+
+    Args:
+        builds_dirs (list(str)): build directories.
+        pkg_name (str): name of package.
+
+    Returns:
+        (bool): whether package has builds.
+    """
+    return any(
+        os.path.isdir(os.path.join(builds_dir, pkg_name))
+        for builds_dir in builds_dirs
+    )
+
+
+def find_build(builds_dirs, pkg_name, version):
+    """Get first build directory that has given build.
+
+    Args:
+        builds_dirs (list(str)): build directories, in search order.
+        pkg_name (str): name of package.
+        version (str): version of build.
+
+    Returns:
+        (str or None): build directory with the build, if any.
+    """
+    for builds_dir in builds_dirs:
+        if os.path.isdir(os.path.join(builds_dir, pkg_name, version)):
+            return builds_dir
+    return None
+
+
+def resolve_version(builds_dirs, pkg_name, spec):
+    """Get highest version of package matching version spec in any layer.
+
+    Exact versions are returned unchanged, without checking for a build, so
+    they never need the shared stores to be read. Registries of shared
+    stores are read but never saved, since other users may own them.
+
+    Args:
+        builds_dirs (list(str)): build directories.
+        pkg_name (str): name of package.
+        spec (str): version spec, eg. latest, >=1.2,<2 or ~1.2.
+
+    Raises:
+        (utils.PkgError): if the spec is invalid.
+
+    Returns:
+        (str or None): matching version, if there is one.
+    """
+    if not version_spec.is_spec(spec):
+        return spec
+    versions = set()
+    for index, builds_dir in enumerate(builds_dirs):
+        if not os.path.isdir(os.path.join(builds_dir, pkg_name)):
+            continue
+        version = registry.resolve_version(
+            builds_dir,
+            pkg_name,
+            spec,
+            save=index == 0,
+        )
+        if version is not None:
+            versions.add(version)
+    if not versions:
+        return None
+    return max(versions, key=version_spec.get_version_key)
+
+
+def resolve_all(builds_dirs, pkg_name, specs):
+    """Get highest version of package matching all of the given specs.
+
+    Args:
+        builds_dirs (list(str)): build directories.
+        pkg_name (str): name of package.
+        specs (list(str or None)): version specs. None matches any version.
+
+    Raises:
+        (utils.PkgError): if a spec is invalid.
+
+    Returns:
+        (str or None): matching version, if there is one.
+    """
+    specs = [
+        spec for spec in specs
+        if spec is not None and spec.strip() != version_spec.LATEST
+    ]
+    if len(specs) < 2:
+        return resolve_version(
+            builds_dirs,
+            pkg_name,
+            specs[0] if specs else version_spec.LATEST,
+        )
+    exact_versions = [spec for spec in specs if not version_spec.is_spec(spec)]
+    if exact_versions:
+        candidates = set(exact_versions[:1])
+    else:
+        candidates = set()
+        for index, builds_dir in enumerate(builds_dirs):
+            if os.path.isdir(os.path.join(builds_dir, pkg_name)):
+                candidates.update(registry.get_version_index(
+                    builds_dir,
+                    pkg_name,
+                    save=index == 0,
+                )[1])
+    versions = [
+        version for version in candidates
+        if all(version_spec.matches(version, spec) for spec in specs)
+    ]
+    if not versions:
+        return None
+    return max(versions, key=version_spec.get_version_key)
+
+
+def _get_mismatched_paths(package_dir, build_manifest, workers=None):
+    """Get paths in package directory that don't match a manifest.
+
+    Every file is hashed, since files added to the object store keep the
+    mtime of whichever build first stored them.
+
+    Args:
+        package_dir (str): directory of package build.
+        build_manifest (dict): manifest to check against.
+        workers (int or None): number of threads to hash files with.
+
+    Returns:
+        (list(str)): paths that are missing, unexpected, or whose size, mode
+            or contents differ.
+    """
+    package_manifest = manifest.create_manifest(package_dir, workers)
+    return sorted(
+        path for path in set(build_manifest) | set(package_manifest)
+        if path not in build_manifest
+        or path not in package_manifest
+        or any(
+            package_manifest[path][key] != build_manifest[path].get(key)
+            for key in ("size", "mode", "sha256")
+        )
+    )
+
+
+def pull_build(
+        shared_builds_dir,
+        pkg_name,
+        version,
+        workers=None,
+        output=None):
+    """Copy build from shared store into the local pkg builds directory.
+
+    Files are added to the local object store, so they're shared with any
+    other local builds. The copy is verified against the shared build's
+    manifest before it's moved into place, so a partial or corrupt pull is
+    never cached.
+
+    Args:
+        shared_builds_dir (str): shared build directory with the build.
+        pkg_name (str): name of package.
+        version (str): version of build.
+        workers (int or None): number of threads to copy files with.
+        output (file or None): stream to print progress to. If None, print
+            to stdout.
+
+    Raises:
+        (utils.PkgError): if the build has no manifest, or the copy doesn't
+            match it.
+
+    Returns:
+        (str): path to local build.
+    """
+    builds_dir = constants.PKG_BUILDS_DIR
+    src_dir = os.path.join(shared_builds_dir, pkg_name, version)
+    build_manifest = manifest.read_manifest(src_dir)
+    if build_manifest is None:
+        utils.raise_error(
+            "Build {0} {1} has no manifest, so can't be pulled from:\n\n\t{2}",
+            pkg_name,
+            version,
+            shared_builds_dir,
+        )
+
+    pkg_build_dir = os.path.join(builds_dir, pkg_name)
+    if not os.path.isdir(pkg_build_dir):
+        os.makedirs(pkg_build_dir, exist_ok=True)
+    dest_dir = os.path.join(pkg_build_dir, version)
+    utils.clear_stale_staging_dirs(dest_dir)
+    staging_dir = utils.get_staging_dir(dest_dir)
+    try:
+        # pkg-info and manifest files are rewritten in place by later
+        # commands, so are copied rather than stored
+        strategies = files.copy_tree(
+            src_dir,
+            staging_dir,
+            matcher=manifest.get_matcher(),
+            copy_function=functools.partial(
+                store.link_file,
+                store.get_store_dir(builds_dir),
+            ),
+            workers=workers,
+        )
+        for file_name in (
+                constants.PKG_INFO_FILE_NAME, constants.MANIFEST_FILE_NAME):
+            src_path = os.path.join(src_dir, file_name)
+            if os.path.isfile(src_path):
+                files.copy_file(src_path, os.path.join(staging_dir, file_name))
+
+        mismatched_paths = _get_mismatched_paths(
+            staging_dir,
+            build_manifest,
+            workers,
+        )
+        if mismatched_paths:
+            utils.raise_error(
+                "Build {0} {1} pulled from {2} doesn't match its manifest:"
+                "\n\n\t{3}",
+                pkg_name,
+                version,
+                shared_builds_dir,
+                "\n\t".join(mismatched_paths),
+            )
+        utils.swap_directory(staging_dir, dest_dir)
+        registry.update_build(builds_dir, pkg_name, version)
+    finally:
+        if os.path.isdir(staging_dir):
+            shutil.rmtree(staging_dir, onerror=utils.on_rmtree_error)
+
+    print ("Pulled {0} {1} from {2} ({3})".format(
+        pkg_name,
+        version,
+        shared_builds_dir,
+        files.summarise_strategies(strategies) or "no files",
+    ), file=output)
+    return dest_dir
+
+
+def get_local_build(builds_dir, pkg_name, version, workers=None, output=None):
+    """Get local build directory, pulling it from a shared store if needed.
+
+    Args:
+        builds_dir (str): local build directory.
+        pkg_name (str): name of package.
+        version (str): version of build.
+        workers (int or None): number of threads to copy files with.
+        output (file or None): stream to print progress to. If None, print
+            to stdout.
+
+    Raises:
+        (utils.PkgError): if the build couldn't be pulled.
+
+    Returns:
+        (str or None): path to local build, if the build was found.
+    """
+    pkg_version_dir = os.path.join(builds_dir, pkg_name, version)
+    if os.path.isdir(pkg_version_dir):
+        return pkg_version_dir
+    shared_builds_dir = find_build(
+        get_builds_dirs(builds_dir)[1:],
+        pkg_name,
+        version,
+    )
+    if shared_builds_dir is None:
+        return None
+    return pull_build(shared_builds_dir, pkg_name, version, workers, output)
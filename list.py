@@ -1,10 +1,8 @@
 """pkg-list command."""
 
-import json
-import os
-from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-from pkg import constants, utils
+from pkg import constants, output, registry, utils, version_spec
 
 
 def add_subparser_command(subparser):
@@ -25,6 +23,16 @@ def add_subparser_command(subparser):
         default="",
         help="Package name to list. If not given, perform global list.",
     )
+    list_command.add_argument(
+        "version",
+        nargs="?",
+        type=str,
+        default="",
+        help=(
+            "Version spec to filter builds by, eg. 'latest', '>=1.2,<2' or "
+            "'~1.2'"
+        ),
+    )
     list_command.add_argument(
         "-p",
         action="store_true",
@@ -35,6 +43,7 @@ def add_subparser_command(subparser):
         action="store_true",
         help="List develop installs only",
     )
+    output.add_format_argument(list_command)
 
 
 def _format_strings_in_columns(row_tuples, num_cols, min_col_lengths=None):
@@ -59,13 +68,13 @@ def _format_strings_in_columns(row_tuples, num_cols, min_col_lengths=None):
     for tuple in row_tuples:
         for i in range(num_cols):
             column_lengths[i] = max(column_lengths[i], len(tuple[i]))
-    output = ""
+    lines = []
     for tuple in row_tuples:
-        row_output = " "
-        for string, length in zip(tuple, column_lengths):
-            row_output += string + " " * (length - len(string) + 4)
-        output += row_output + "\n"
-    return output
+        lines.append(" " + "".join(
+            string + " " * (length - len(string) + 4)
+            for string, length in zip(tuple, column_lengths)
+        ) + "\n")
+    return "".join(lines)
 
 
 def _get_all_packages_info(directory):
@@ -78,23 +87,10 @@ def _get_all_packages_info(directory):
         (str): formatted info.
     """
     package_infos = []
-    for pkg in os.listdir(directory):
-        pkg_info_file = os.path.join(
-            directory, pkg, constants.PKG_INFO_FILE_NAME
-        )
-        if os.path.isfile(pkg_info_file):
-            with open(pkg_info_file) as file_:
-                try:
-                    pkg_info = json.load(file_)
-                except json.decoder.JSONDecodeError:
-                    utils.print_error(
-                        "The pkg-info file is incorrectly formatted:\n\n\t{0}",
-                        pkg_info_file,
-                    )
-                    return
-            version = pkg_info.get(constants.VERSION_KEY, "")
-            install_time = pkg_info.get(constants.INSTALL_TIME_KEY, "")
-            package_infos.append((pkg, version, install_time))
+    for pkg, pkg_info in registry.get_installs(directory).items():
+        version = pkg_info.get(constants.VERSION_KEY, "")
+        install_time = pkg_info.get(constants.INSTALL_TIME_KEY, "")
+        package_infos.append((pkg, version, install_time))
     return _format_strings_in_columns(package_infos, 3)
 
 
@@ -108,11 +104,7 @@ def _get_package_install_info(directory, pkg_name):
     Returns:
         (str or None): info string for package install, if found.
     """
-    pkg_dir = os.path.join(directory, pkg_name)
-    if not os.path.isdir(pkg_dir):
-        return None
-    # note that this will print out errors if pkg_info not found:
-    _, pkg_info = utils.get_package_info(pkg_dir)
+    pkg_info = registry.get_install(directory, pkg_name)
     if not pkg_info:
         return None
     version = pkg_info.get(constants.VERSION_KEY, "[no_version]")
@@ -120,49 +112,126 @@ def _get_package_install_info(directory, pkg_name):
     return _format_strings_in_columns([(version, time)], 2)
 
 
-def _get_package_build_info(directory, pkg_name):
+def _iter_builds(directory, pkg_name, spec=None):
+    """Iterate over builds of package, highest version first.
+
+    Args:
+        directory (str): build directory.
+        pkg_name (str): name of package.
+        spec (str or None): if given, only include builds matching this
+            version spec.
+
+    Yields:
+        (str): version of build.
+        (dict): registry info for build.
+    """
+    builds = registry.get_builds(directory, pkg_name)
+    versions = list(builds)
+    if spec:
+        keys, versions = registry.get_version_index(directory, pkg_name)
+        versions = version_spec.filter_versions(spec, keys, versions)
+    for version in reversed(versions):
+        yield version, builds[version]
+
+
+def _get_package_build_info(directory, pkg_name, spec=None):
     """Get info for given built package in given build directory.
 
     Args:
         directory (str): directory to search for packages in.
         pkg_name (str): name of package to print info for.
+        spec (str or None): if given, only include builds matching this
+            version spec.
 
     Returns:
-        (str or None): info string for package builds, if found.
+        (str or None): info string for package builds, if found, with the
+            highest version first.
     """
-    pkg_build_dir = os.path.join(directory, pkg_name)
-    if not os.path.isdir(pkg_build_dir):
-        return None
     details = []
-    for version in reversed(os.listdir(pkg_build_dir)):
-        pkg_version_dir = os.path.join(pkg_build_dir, version)
-        if not os.path.isdir(pkg_version_dir):
-            continue
-        # note that this will print out errors if pkg_info not found:
-        _, pkg_info = utils.get_package_info(pkg_version_dir)
-        if not pkg_info:
-            continue
-        _, version_info = utils.get_version_info(pkg_version_dir)
-        version_comment = version_info.get(version, "")
-        if not version_comment and version == constants.DEFAULT_DEV_VERSION:
-            version_comment = constants.DEFAULT_DEV_COMMENT
-        # allow multiple comments, and only display top one
-        if isinstance(version_comment, (list, tuple)):
-            version_comment = next(iter(version_comment), "")
-        # allow header with subcomments and only display header
-        if isinstance(version_comment, (dict, OrderedDict)):
-            version_comment = next(iter(version_comment.keys()), "")
-        version_comment = "  " + version_comment
+    for version, build_info in _iter_builds(directory, pkg_name, spec):
         details.append((
             version,
-            pkg_info.get(constants.BUILD_TIME_KEY, ""),
-            version_comment
+            build_info["pkg_info"].get(constants.BUILD_TIME_KEY, ""),
+            "  " + build_info["comment"],
         ))
     if details:
         return _format_strings_in_columns(details, 3)
     return None
 
 
+def _get_install_record(pkg_name, pkg_info, dev):
+    """Get machine-readable record for install.
+
+    Args:
+        pkg_name (str): name of package.
+        pkg_info (dict): pkg-info of install.
+        dev (bool): whether this is a dev install.
+
+    Returns:
+        (dict): install record.
+    """
+    return {
+        "type": "install",
+        "name": pkg_name,
+        "dev": dev,
+        "version": pkg_info.get(constants.VERSION_KEY),
+        "install_time": pkg_info.get(constants.INSTALL_TIME_KEY),
+    }
+
+
+def _get_build_record(pkg_name, version, build_info, dev):
+    """Get machine-readable record for build.
+
+    Args:
+        pkg_name (str): name of package.
+        version (str): version of build.
+        build_info (dict): registry info for build.
+        dev (bool): whether this is a dev build.
+
+    Returns:
+        (dict): build record.
+    """
+    return {
+        "type": "build",
+        "name": pkg_name,
+        "dev": dev,
+        "version": version,
+        "build_time": build_info["pkg_info"].get(constants.BUILD_TIME_KEY),
+        "comment": build_info["comment"],
+    }
+
+
+def _iter_records(pkg_name, spec, include_pkgs, include_dev):
+    """Iterate over machine-readable records for pkg list.
+
+    Args:
+        pkg_name (str): name of package to list. If empty, list all installs.
+        spec (str): if given, only include builds matching this version spec.
+        include_pkgs (bool): whether to include pkg installs and builds.
+        include_dev (bool): whether to include dev installs and builds.
+
+    Yields:
+        (dict): install and build records, as each is found.
+    """
+    roots = []
+    if include_pkgs:
+        roots.append((constants.PKGS_DIR, constants.PKG_BUILDS_DIR, False))
+    if include_dev:
+        roots.append(
+            (constants.DEV_PKGS_DIR, constants.DEV_PKG_BUILDS_DIR, True)
+        )
+    for pkgs_dir, builds_dir, dev in roots:
+        if not pkg_name:
+            for name, pkg_info in registry.get_installs(pkgs_dir).items():
+                yield _get_install_record(name, pkg_info, dev)
+            continue
+        pkg_info = registry.get_install(pkgs_dir, pkg_name)
+        if pkg_info:
+            yield _get_install_record(pkg_name, pkg_info, dev)
+        for version, build_info in _iter_builds(builds_dir, pkg_name, spec):
+            yield _get_build_record(pkg_name, version, build_info, dev)
+
+
 def main(args):
     """List all installed packages, or details for specified package.
 
@@ -175,35 +244,77 @@ def main(args):
         )
 
     pkg_name = args.pkg_name
+    if args.version and not pkg_name:
+        utils.print_error(
+            "A version spec can only be given when listing a single package"
+        )
+        return
+    if args.version:
+        try:
+            version_spec.parse_spec(args.version)
+        except utils.PkgError as error:
+            utils.print_error(str(error))
+            return
+    if args.format != constants.TEXT:
+        output.write_records(
+            _iter_records(pkg_name, args.version, not args.d, not args.p),
+            args.format,
+        )
+        return
+
     if not pkg_name:
-        # Print out details for all packages
+        # Print out details for all packages, scanning both roots at once
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            if not args.d:
+                info_future = executor.submit(
+                    _get_all_packages_info,
+                    constants.PKGS_DIR,
+                )
+            if not args.p:
+                dev_info_future = executor.submit(
+                    _get_all_packages_info,
+                    constants.DEV_PKGS_DIR,
+                )
         if not args.d:
             print ("\n Packages\n --------")
-            print (_get_all_packages_info(constants.PKGS_DIR))
+            print (info_future.result())
         if not args.p:
             print ("\n Dev Packages\n ------------")
-            print (_get_all_packages_info(constants.DEV_PKGS_DIR))
+            print (dev_info_future.result())
         return
 
     # otherwise print out details for specific package
     print ("\n " + pkg_name + "\n " + "=" * len(pkg_name))
-    
-    install_info = _get_package_install_info(
-        constants.PKGS_DIR,
-        pkg_name
-    )
-    build_info = _get_package_build_info(
-        constants.PKG_BUILDS_DIR,
-        pkg_name
-    )
-    dev_install_info = _get_package_install_info(
-        constants.DEV_PKGS_DIR,
-        pkg_name
-    )
-    dev_build_info = _get_package_build_info(
-        constants.DEV_PKG_BUILDS_DIR,
-        pkg_name
-    )
+
+    # scan all four roots at once
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(
+                _get_package_install_info,
+                constants.PKGS_DIR,
+                pkg_name,
+            ),
+            executor.submit(
+                _get_package_build_info,
+                constants.PKG_BUILDS_DIR,
+                pkg_name,
+                args.version,
+            ),
+            executor.submit(
+                _get_package_install_info,
+                constants.DEV_PKGS_DIR,
+                pkg_name,
+            ),
+            executor.submit(
+                _get_package_build_info,
+                constants.DEV_PKG_BUILDS_DIR,
+                pkg_name,
+                args.version,
+            ),
+        ]
+    install_info, build_info, dev_install_info, dev_build_info = [
+        future.result() for future in futures
+    ]
     if not (install_info or build_info or dev_install_info or dev_build_info):
         print ("\n No package of name " + pkg_name + " found\n")
         return
@@ -0,0 +1,163 @@
+"""Manifests recording the contents of package builds.
+
+Each build has a manifest next to its pkg-info file, recording the size,
+mode, mtime and hash of every file in the build. The manifest is copied
+into installs along with the rest of the build, so installs can be
+checked against it.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import stat
+
+from pkg import constants, files, timings, utils
+
+
+def get_manifest_file(package_dir):
+    """Get manifest file for given package directory.
+
+    Args:
+        package_dir (str): directory of package build or install.
+
+    Returns:
+        (str): path of manifest file.
+    """
+    return os.path.join(package_dir, constants.MANIFEST_FILE_NAME)
+
+
+def get_matcher():
+    """Get matcher for files that aren't recorded in manifests.
+
+    The pkg-info file is excluded since it's rewritten for every build and
+    install, as are python caches since they're created when using installs.
+
+    Returns:
+        (ignore.IgnoreMatcher): matcher for paths to exclude.
+    """
+    return utils.get_ignore_matcher([
+        "/" + constants.PKG_INFO_FILE_NAME,
+        "/" + constants.MANIFEST_FILE_NAME,
+    ])
+
+
+def get_file_stats(path):
+    """Get stats recorded in manifest for file.
+
+    Args:
+        path (str): path to file.
+
+    Returns:
+        (dict): size, mode and mtime of file.
+    """
+    file_stat = os.stat(path)
+    return {
+        "size": file_stat.st_size,
+        "mode": stat.S_IMODE(file_stat.st_mode),
+        "mtime_ns": file_stat.st_mtime_ns,
+    }
+
+
+@timings.timed("create_manifest")
+def create_manifest(package_dir, workers=None, previous_manifest=None):
+    """Create manifest for package directory, hashing files concurrently.
+
+    Args:
+        package_dir (str): directory of package build.
+        workers (int or None): number of threads to hash files with. If None,
+            use the default number.
+        previous_manifest (dict or None): if given, reuse hashes from this
+            manifest for files whose stats haven't changed since.
+
+    Returns:
+        (dict): manifest dictionary, mapping relative file paths to their
+            size, mode, mtime and hash.
+    """
+    previous_manifest = previous_manifest or {}
+    _, file_paths = files.walk_tree(package_dir, get_matcher())
+    manifest = {}
+    paths_to_hash = []
+    for path in file_paths:
+        manifest[path] = get_file_stats(os.path.join(package_dir, path))
+        previous_entry = previous_manifest.get(path, {})
+        if all(previous_entry.get(key) == value
+               for key, value in manifest[path].items()):
+            manifest[path]["sha256"] = previous_entry.get("sha256")
+        else:
+            paths_to_hash.append(path)
+
+    with ThreadPoolExecutor(
+            max_workers=workers or constants.DEFAULT_COPY_WORKERS) as executor:
+        hashes = executor.map(
+            utils.hash_file,
+            [os.path.join(package_dir, path) for path in paths_to_hash],
+        )
+        for path, file_hash in zip(paths_to_hash, hashes):
+            manifest[path]["sha256"] = file_hash
+    return manifest
+
+
+def write_manifest(package_dir, manifest):
+    """Write manifest to package directory.
+
+    Args:
+        package_dir (str): directory of package build.
+        manifest (dict): manifest dictionary.
+    """
+    manifest_file = get_manifest_file(package_dir)
+    # remove rather than overwrite, in case it's hardlinked into an install
+    if os.path.isfile(manifest_file):
+        os.remove(manifest_file)
+    with open(manifest_file, "w") as file_:
+        json.dump(manifest, file_, indent=4, sort_keys=True)
+
+
+def read_manifest(package_dir):
+    """Read manifest from package directory.
+
+    Args:
+        package_dir (str): directory of package build or install.
+
+    Returns:
+        (dict or None): manifest dictionary, or None if the file couldn't be
+            read or doesn't exist.
+    """
+    manifest_file = get_manifest_file(package_dir)
+    if not os.path.isfile(manifest_file):
+        return None
+    with open(manifest_file, "r") as file_:
+        try:
+            return json.load(file_)
+        except json.decoder.JSONDecodeError:
+            return None
+
+
+def compare_stats(package_dir, manifest):
+    """Compare package directory against manifest without reading files.
+
+    Args:
+        package_dir (str): directory of package build or install.
+        manifest (dict): manifest dictionary.
+
+    Returns:
+        (list(str)): paths in manifest that are missing from directory.
+        (list(str)): paths in directory that aren't in manifest.
+        (list(str)): paths whose size or mode differ from the manifest.
+        (list(str)): paths whose mtime differs from the manifest, so need
+            their contents hashing to check.
+    """
+    _, file_paths = files.walk_tree(package_dir, get_matcher())
+    extra_paths = [path for path in file_paths if path not in manifest]
+    missing_paths = sorted(set(manifest) - set(file_paths))
+    modified_paths = []
+    unknown_paths = []
+    for path in file_paths:
+        entry = manifest.get(path)
+        if entry is None:
+            continue
+        stats = get_file_stats(os.path.join(package_dir, path))
+        if stats["size"] != entry["size"] or stats["mode"] != entry["mode"]:
+            modified_paths.append(path)
+        elif stats["mtime_ns"] != entry["mtime_ns"]:
+            unknown_paths.append(path)
+    return missing_paths, extra_paths, modified_paths, unknown_paths
@@ -0,0 +1,54 @@
+"""Machine-readable output for pkg commands.
+
+Commands that support it take a --format argument. Records are written as
+soon as they're produced rather than collected first, so consumers of
+ndjson output can process each record while the command is still running.
+"""
+
+import json
+import sys
+
+from pkg import constants
+
+
+def add_format_argument(command):
+    """Add --format argument to subcommand parser.
+
+    Args:
+        command (argparse.ArgumentParser): subcommand parser.
+    """
+    command.add_argument(
+        "--format",
+        choices=[constants.TEXT, constants.JSON, constants.NDJSON],
+        default=constants.TEXT,
+        help=(
+            "output format (default {0}). json writes a single array of "
+            "records, and ndjson writes one record per line as each is "
+            "found".format(constants.TEXT)
+        ),
+    )
+
+
+def write_records(records, output_format, stream=None):
+    """Write records in given machine-readable format.
+
+    Args:
+        records (iterable(dict)): records to write.
+        output_format (str): either JSON or NDJSON.
+        stream (file or None): stream to write to. If None, use stdout.
+    """
+    stream = stream or sys.stdout
+    if output_format == constants.NDJSON:
+        for record in records:
+            stream.write(json.dumps(record) + "\n")
+            # flush each line, so records reach pipes as soon as they're found
+            stream.flush()
+        return
+
+    stream.write("[")
+    separator = "\n    "
+    for record in records:
+        stream.write(separator + json.dumps(record))
+        separator = ",\n    "
+    # empty arrays are written on one line
+    stream.write("]\n" if separator == "\n    " else "\n]\n")
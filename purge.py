@@ -0,0 +1,60 @@
+"""pkg-purge command to delete trashed package trees."""
+
+import os
+
+from pkg import constants, store, trash
+
+
+def add_subparser_command(subparser):
+    """Add pkg-purge subparser commands.
+
+    Args:
+        subparser (argparse.Parser): argparse object.
+    """
+    purge_command = subparser.add_parser(
+        constants.PURGE,
+        help=(
+            "delete uninstalled and unbuilt packages that are waiting to be "
+            "deleted in the background"
+        ),
+    )
+    purge_command.add_argument(
+        "root_dirs",
+        nargs="*",
+        help="pkg roots to empty the trash of, defaults to all of them",
+    )
+
+
+def run_purge(root_dirs=None):
+    """Empty trash directories of pkg roots.
+
+    Objects in the build stores that are no longer used by any build are
+    removed once their builds' trees have been deleted.
+
+    Args:
+        root_dirs (list(str) or None): pkg roots to empty the trash of. If
+            None, empty all of them.
+
+    Returns:
+        (int): number of trees deleted.
+    """
+    builds_dirs = [
+        os.path.abspath(builds_dir) for builds_dir in (
+            constants.PKG_BUILDS_DIR, constants.DEV_PKG_BUILDS_DIR)
+    ]
+    num_deleted = 0
+    for root_dir in root_dirs or trash.get_root_dirs():
+        num_deleted_from_root = trash.empty_trash(root_dir)
+        if num_deleted_from_root and os.path.abspath(root_dir) in builds_dirs:
+            store.prune(store.get_store_dir(root_dir))
+        num_deleted += num_deleted_from_root
+    return num_deleted
+
+
+def main(args):
+    """Purge trash based on commandline args.
+
+    Args:
+        args (argparse.Namespace): arguments from commandline.
+    """
+    print ("Purged {0} trees".format(run_purge(args.root_dirs)))
@@ -1,8 +1,6 @@
 """pkg-query command for querying info."""
 
-import os
-
-from pkg import constants, utils
+from pkg import constants, output, registry, utils
 
 
 def add_subparser_command(subparser):
@@ -20,6 +18,16 @@ def add_subparser_command(subparser):
         type=str,
         help="Package name to query",
     )
+    query_command.add_argument(
+        "version",
+        nargs="?",
+        type=str,
+        default="",
+        help=(
+            "Version spec to resolve, eg. 'latest', '>=1.2,<2' or '~1.2'. If "
+            "given, query the highest matching build instead of the install"
+        ),
+    )
     query_command.add_argument(
         "-v",
         action="store_true",
@@ -28,8 +36,9 @@ def add_subparser_command(subparser):
     query_command.add_argument(
         "-d",
         action="store_true",
-        help="Restrict query to develop installs",
+        help="Restrict query to develop installs (or builds)",
     )
+    output.add_format_argument(query_command)
 
 
 def main(args):
@@ -45,10 +54,47 @@ def main(args):
             "Query command must use exactly one of the following query "
             "flags: -v"
         )
-    pkgs_dir = constants.DEV_PKGS_DIR if args.d else constants.PKGS_DIR
-    pkg_dir = os.path.join(pkgs_dir, args.pkg_name)
-    _, pkg_info = utils.get_package_info(pkg_dir)
-    if pkg_info is None:
-        return
-    if args.v:
+    if args.version:
+        build_dir = (
+            constants.DEV_PKG_BUILDS_DIR if args.d else constants.PKG_BUILDS_DIR
+        )
+        try:
+            version = registry.resolve_version(
+                build_dir,
+                args.pkg_name,
+                args.version,
+            )
+        except utils.PkgError as error:
+            utils.print_error(str(error))
+            return
+        pkg_info = registry.get_builds(build_dir, args.pkg_name).get(
+            version,
+            {},
+        ).get("pkg_info")
+        if pkg_info is None:
+            utils.print_error(
+                "The given package {0} has no build matching version {1} "
+                "in {2}",
+                args.pkg_name,
+                args.version,
+                build_dir,
+            )
+            return
+    else:
+        pkgs_dir = constants.DEV_PKGS_DIR if args.d else constants.PKGS_DIR
+        pkg_info = registry.get_install(pkgs_dir, args.pkg_name)
+        if pkg_info is None:
+            utils.print_error(
+                "The given package {0} is not currently installed in {1}",
+                args.pkg_name,
+                pkgs_dir,
+            )
+            return
+
+    if args.format != constants.TEXT:
+        record = {"name": args.pkg_name}
+        if args.v:
+            record["version"] = pkg_info.get(constants.VERSION_KEY)
+        output.write_records([record], args.format)
+    elif args.v:
         print (pkg_info.get(constants.VERSION_KEY))
@@ -0,0 +1,652 @@
+"""Persistent index of the installs and builds in each pkg root.
+
+Each install root has a registry file recording the parsed pkg-info of
+every install in it, and each build root has a registry file for each
+package recording the parsed pkg-info of each of its builds, so listing and
+querying packages doesn't need to read every pkg-info and version-info file.
+Commands that change a root update its registry as part of their writes.
+The mtimes of each entry's directory and of the info files read into it are
+recorded with the entry, so that any out-of-band changes are picked up, even
+to files rewritten in place, and only the entries that have changed are
+re-read.
+
+The registry is kept in its own subdirectory so that writing it doesn't
+change the mtime of the root itself. Roots are scanned with os.scandir, and
+entries that need re-reading are read concurrently, so that refreshing the
+registry on a network mount doesn't wait on one round-trip at a time.
+
+Build registries also hold a version index of each package's builds, sorted
+by parsed version, so version specs can be resolved without re-listing the
+package's build directory.
+"""
+
+from collections import OrderedDict
+import json
+import os
+import threading
+
+from pkg import constants, timings, utils, version_spec
+
+
+# locks and cache of registries already read by this process, keyed by root
+_LOCKS = {}
+_LOCKS_LOCK = threading.Lock()
+_CACHE = {}
+
+# files read into the registry entries of installs and builds, which can be
+# rewritten in place without changing the mtime of the directory they're in
+_INSTALL_INFO_FILE_NAMES = (constants.PKG_INFO_FILE_NAME,)
+_BUILD_INFO_FILE_NAMES = (
+    constants.PKG_INFO_FILE_NAME,
+    constants.VERSION_INFO_FILE_NAME,
+)
+
+
+def _get_lock(root_dir):
+    """Get lock for reading and updating registry of given pkg root.
+
+    Args:
+        root_dir (str): install or build directory.
+
+    Returns:
+        (threading.RLock): lock for root.
+    """
+    with _LOCKS_LOCK:
+        return _LOCKS.setdefault(root_dir, threading.RLock())
+
+
+def get_registry_file(root_dir, pkg_name=None):
+    """Get registry file for given pkg root.
+
+    Args:
+        root_dir (str): install or build directory.
+        pkg_name (str or None): name of package, for build directories.
+
+    Returns:
+        (str): path to registry file.
+    """
+    registry_dir = os.path.join(root_dir, constants.REGISTRY_DIR_NAME)
+    if pkg_name is None:
+        return os.path.join(registry_dir, constants.REGISTRY_FILE_NAME)
+    return os.path.join(registry_dir, "builds", pkg_name + ".json")
+
+
+def _get_mtime(path):
+    """Get mtime of path.
+
+    Args:
+        path (str): path to get mtime of.
+
+    Returns:
+        (int or None): mtime in nanoseconds, or None if path doesn't exist.
+    """
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _get_entry_mtimes(package_dir, info_file_names, dir_mtime=None):
+    """Get mtimes that registry entry of install or build is checked against.
+
+    Args:
+        package_dir (str): directory of install or build.
+        info_file_names (tuple(str)): names of files read into the entry.
+        dir_mtime (int or None): mtime of directory, if already known.
+
+    Returns:
+        (list(int or None)): mtimes in nanoseconds of directory and of each
+            file, or None for any that don't exist.
+    """
+    if dir_mtime is None:
+        dir_mtime = _get_mtime(package_dir)
+    # joined by hand, as os.path.join is slow when called for every install
+    return [dir_mtime] + [
+        _get_mtime(package_dir + os.sep + file_name)
+        for file_name in info_file_names
+    ]
+
+
+def _scan_dirs(directory):
+    """Get mtimes of all subdirectories of directory.
+
+    Hidden directories (eg. staged installs and builds) are skipped.
+
+    Args:
+        directory (str): directory to scan.
+
+    Returns:
+        (OrderedDict(str, int)): mtime in nanoseconds of each subdirectory,
+            keyed by name, in directory listing order.
+    """
+    dir_mtimes = OrderedDict()
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    if entry.is_dir():
+                        dir_mtimes[entry.name] = entry.stat().st_mtime_ns
+                except OSError:
+                    # eg. entry was removed while scanning
+                    continue
+    except OSError:
+        pass
+    return dir_mtimes
+
+
+def _map_concurrently(function, items):
+    """Call function on each item using a thread pool.
+
+    Items are split into one chunk per worker, to avoid the overhead of
+    submitting each item to the pool separately.
+
+    Args:
+        function (function): function to call.
+        items (list): items to call function on.
+
+    Returns:
+        (list): results of function for each item.
+    """
+    workers = min(len(items), constants.DEFAULT_SCAN_WORKERS)
+    if workers <= 1:
+        return [function(item) for item in items]
+    # imported here as it's slow to import, and not needed by pkg query
+    from concurrent.futures import ThreadPoolExecutor
+
+    chunks = [items[i::workers] for i in range(workers)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        chunk_results = list(executor.map(
+            lambda chunk: [function(item) for item in chunk],
+            chunks,
+        ))
+    # interleave chunk results back into the original order
+    results = [None] * len(items)
+    for i, chunk_result in enumerate(chunk_results):
+        results[i::workers] = chunk_result
+    return results
+
+
+def _load(registry_file):
+    """Load registry file.
+
+    Args:
+        registry_file (str): path to registry file.
+
+    Returns:
+        (dict or None): registry dictionary, or None if the file doesn't
+            exist or couldn't be read.
+    """
+    registry_mtime = _get_mtime(registry_file)
+    cached_mtime, registry = _CACHE.get(registry_file, (None, None))
+    if registry is not None and cached_mtime == registry_mtime:
+        return registry
+    registry = None
+    if registry_mtime is not None:
+        with open(registry_file, "r") as file_:
+            try:
+                registry = json.load(file_)
+            except ValueError:
+                pass
+    _CACHE[registry_file] = (registry_mtime, registry)
+    return registry
+
+
+def _save(registry_file, registry):
+    """Save registry file.
+
+    The registry is written to a temp file and renamed into place, so
+    readers never see a partially-written registry. Roots that the user
+    can't write to are left unchanged.
+
+    Args:
+        registry_file (str): path to registry file.
+        registry (dict or None): registry dictionary. If None, the registry
+            file is removed.
+    """
+    import tempfile
+
+    registry_dir = os.path.dirname(registry_file)
+    try:
+        if registry is None:
+            if os.path.isfile(registry_file):
+                os.remove(registry_file)
+        else:
+            if not os.path.isdir(registry_dir):
+                os.makedirs(registry_dir, exist_ok=True)
+            file_descriptor, temp_path = tempfile.mkstemp(dir=registry_dir)
+            with os.fdopen(file_descriptor, "w") as file_:
+                # encode in one go, which is much faster than json.dump
+                file_.write(json.dumps(registry))
+            os.replace(temp_path, registry_file)
+    except OSError:
+        return
+    _CACHE[registry_file] = (_get_mtime(registry_file), registry)
+
+
+def _load_installs(pkgs_dir):
+    """Load registry of installs for given install directory.
+
+    Args:
+        pkgs_dir (str): install directory.
+
+    Returns:
+        (dict): registry dictionary.
+    """
+    return _load(get_registry_file(pkgs_dir)) or {
+        "root_mtime_ns": None,
+        "packages": {},
+    }
+
+
+def get_version_comment(version_info, version):
+    """Get comment to display for version from version-info dict.
+
+    Args:
+        version_info (dict or None): version-info dictionary.
+        version (str): version to get comment for.
+
+    Returns:
+        (str): version comment.
+    """
+    version_comment = (version_info or {}).get(version, "")
+    if not version_comment and version == constants.DEFAULT_DEV_VERSION:
+        version_comment = constants.DEFAULT_DEV_COMMENT
+    # allow multiple comments, and only display top one
+    if isinstance(version_comment, (list, tuple)):
+        version_comment = next(iter(version_comment), "")
+    # allow header with subcomments and only display header
+    if isinstance(version_comment, (dict, OrderedDict)):
+        version_comment = next(iter(version_comment.keys()), "")
+    return str(version_comment)
+
+
+def _read_install_entry(pkgs_dir, pkg_name, mtimes=None):
+    """Read registry entry for install from disk.
+
+    Args:
+        pkgs_dir (str): install directory.
+        pkg_name (str): name of package.
+        mtimes (list(int or None) or None): mtimes of package directory and
+            pkg-info file, if already known.
+
+    Returns:
+        (dict or None): registry entry, or None if package isn't installed.
+    """
+    pkg_dir = os.path.join(pkgs_dir, pkg_name)
+    if mtimes is None:
+        mtimes = _get_entry_mtimes(pkg_dir, _INSTALL_INFO_FILE_NAMES)
+    if mtimes[0] is None:
+        return None
+    _, pkg_info = utils.get_package_info(pkg_dir, print_on_error=False)
+    return {"mtime_ns": mtimes, "pkg_info": pkg_info}
+
+
+def _read_version_entry(pkg_version_dir, mtimes):
+    """Read registry entry for single build from disk.
+
+    Args:
+        pkg_version_dir (str): directory of build.
+        mtimes (list(int or None)): mtimes of build directory and its
+            pkg-info and version-info files.
+
+    Returns:
+        (dict): registry entry.
+    """
+    _, pkg_info = utils.get_package_info(
+        pkg_version_dir,
+        print_on_error=False,
+    )
+    _, version_info = utils.get_version_info(pkg_version_dir)
+    return {
+        "mtime_ns": mtimes,
+        "pkg_info": pkg_info,
+        "comment": get_version_comment(
+            version_info,
+            os.path.basename(pkg_version_dir),
+        ),
+    }
+
+
+def _read_build_entry(builds_dir, pkg_name, old_entry=None):
+    """Read registry entry for package builds from disk.
+
+    Args:
+        builds_dir (str): build directory.
+        pkg_name (str): name of package.
+        old_entry (dict or None): previous entry for package. Versions whose
+            directories and info files haven't changed since are reused from
+            this.
+
+    Returns:
+        (dict or None): registry entry, or None if package has no builds.
+    """
+    pkg_build_dir = os.path.join(builds_dir, pkg_name)
+    mtime = _get_mtime(pkg_build_dir)
+    if mtime is None or not os.path.isdir(pkg_build_dir):
+        return None
+    old_versions = (old_entry or {}).get("versions", {})
+    dir_mtimes = list(_scan_dirs(pkg_build_dir).items())
+    all_mtimes = _map_concurrently(
+        lambda item: _get_entry_mtimes(
+            os.path.join(pkg_build_dir, item[0]),
+            _BUILD_INFO_FILE_NAMES,
+            item[1],
+        ),
+        dir_mtimes,
+    )
+    versions = OrderedDict()
+    versions_to_read = []
+    for (version, _), version_mtimes in zip(dir_mtimes, all_mtimes):
+        old_version_entry = old_versions.get(version)
+        if (old_version_entry is not None
+                and old_version_entry["mtime_ns"] == version_mtimes):
+            versions[version] = old_version_entry
+        else:
+            # placeholder, so versions stay in directory listing order
+            versions[version] = None
+            versions_to_read.append((version, version_mtimes))
+    new_entries = _map_concurrently(
+        lambda item: _read_version_entry(
+            os.path.join(pkg_build_dir, item[0]),
+            item[1],
+        ),
+        versions_to_read,
+    )
+    for (version, _), version_entry in zip(versions_to_read, new_entries):
+        versions[version] = version_entry
+    index = sorted(
+        (version_spec.get_version_key(version), version)
+        for version, version_entry in versions.items()
+        if version_entry["pkg_info"]
+    )
+    return {
+        "mtime_ns": mtime,
+        "versions": versions,
+        "index": {
+            "key_format": version_spec.KEY_FORMAT,
+            "keys": [key for key, _ in index],
+            "versions": [version for _, version in index],
+        },
+    }
+
+
+def get_installs(pkgs_dir):
+    """Get pkg-info of all packages installed in given directory.
+
+    If the root directory has changed since the registry was last updated,
+    it's re-scanned. Any packages whose directories or pkg-info files have
+    changed are re-read, then the registry is updated.
+
+    Args:
+        pkgs_dir (str): install directory.
+
+    Returns:
+        (OrderedDict(str, dict)): pkg-info of each install, keyed by name.
+            Packages with missing or unreadable pkg-info files are skipped.
+    """
+    with _get_lock(pkgs_dir):
+        registry = _load_installs(pkgs_dir)
+        root_mtime = _get_mtime(pkgs_dir)
+        if root_mtime == registry["root_mtime_ns"]:
+            dir_mtimes = [
+                (pkg_name, None) for pkg_name in registry["packages"]
+            ]
+        else:
+            dir_mtimes = list(_scan_dirs(pkgs_dir).items())
+        # pkg-info files can be rewritten without changing the root's mtime,
+        # so every entry is checked even if the root hasn't changed
+        all_mtimes = _map_concurrently(
+            lambda item: _get_entry_mtimes(
+                os.path.join(pkgs_dir, item[0]),
+                _INSTALL_INFO_FILE_NAMES,
+                item[1],
+            ),
+            dir_mtimes,
+        )
+        packages = OrderedDict()
+        packages_to_read = []
+        for (pkg_name, _), mtimes in zip(dir_mtimes, all_mtimes):
+            entry = registry["packages"].get(pkg_name)
+            if entry is None or entry["mtime_ns"] != mtimes:
+                # placeholder, so packages stay in directory listing order
+                entry = None
+                packages_to_read.append((pkg_name, mtimes))
+            packages[pkg_name] = entry
+        new_entries = _map_concurrently(
+            lambda item: _read_install_entry(pkgs_dir, *item),
+            packages_to_read,
+        )
+        for (pkg_name, _), entry in zip(packages_to_read, new_entries):
+            if entry is None:
+                # eg. removed since the registry was last updated
+                del packages[pkg_name]
+            else:
+                packages[pkg_name] = entry
+        if packages_to_read or root_mtime != registry["root_mtime_ns"]:
+            _save(
+                get_registry_file(pkgs_dir),
+                {"root_mtime_ns": root_mtime, "packages": packages},
+            )
+        return OrderedDict(
+            (pkg_name, entry["pkg_info"])
+            for pkg_name, entry in packages.items()
+            if entry["pkg_info"]
+        )
+
+
+def get_install(pkgs_dir, pkg_name):
+    """Get pkg-info of package installed in given directory.
+
+    Parsing the whole registry takes far longer than reading a single
+    pkg-info file, so the registry is only used if this process has already
+    loaded it, eg. in pkg serve or through the API.
+
+    Args:
+        pkgs_dir (str): install directory.
+        pkg_name (str): name of package.
+
+    Returns:
+        (dict or None): pkg-info of install, if it's installed and readable.
+    """
+    mtimes = _get_entry_mtimes(
+        os.path.join(pkgs_dir, pkg_name),
+        _INSTALL_INFO_FILE_NAMES,
+    )
+    if mtimes[0] is None:
+        return None
+    registry_file = get_registry_file(pkgs_dir)
+    with _get_lock(pkgs_dir):
+        cached_mtime, registry = _CACHE.get(registry_file, (None, None))
+        if registry is not None and cached_mtime == _get_mtime(registry_file):
+            entry = registry["packages"].get(pkg_name)
+            if entry is None or entry["mtime_ns"] != mtimes:
+                entry = update_install(pkgs_dir, pkg_name)
+            return entry["pkg_info"] if entry else None
+    return _read_install_entry(pkgs_dir, pkg_name, mtimes)["pkg_info"]
+
+
+def get_root_mtime(root_dir):
+    """Get mtime of pkg root, to pass to update_install once it's changed.
+
+    Args:
+        root_dir (str): install or build directory.
+
+    Returns:
+        (int or None): mtime in nanoseconds, or None if root doesn't exist.
+    """
+    return _get_mtime(root_dir)
+
+
+@timings.timed("update_registry")
+def update_install(pkgs_dir, pkg_name, root_mtime=None):
+    """Update registry entry for install, after it's changed on disk.
+
+    Args:
+        pkgs_dir (str): install directory.
+        pkg_name (str): name of package.
+        root_mtime (int or None): mtime of pkgs_dir from before the install
+            was changed, from get_root_mtime. If None, the install is
+            assumed to have changed without the root changing.
+
+    Returns:
+        (dict or None): new registry entry, if package is installed.
+    """
+    with _get_lock(pkgs_dir):
+        registry = _load_installs(pkgs_dir)
+        entry = _read_install_entry(pkgs_dir, pkg_name)
+        if entry is None:
+            registry["packages"].pop(pkg_name, None)
+        else:
+            registry["packages"][pkg_name] = entry
+        if root_mtime is None:
+            root_mtime = _get_mtime(pkgs_dir)
+        # only bring the root mtime up to date if the rest of the registry
+        # was up to date before this change, otherwise leave it to be
+        # re-scanned, as something else has changed the root since
+        if (registry["root_mtime_ns"] is not None
+                and registry["root_mtime_ns"] == root_mtime):
+            registry["root_mtime_ns"] = _get_mtime(pkgs_dir)
+        else:
+            registry["root_mtime_ns"] = None
+        _save(get_registry_file(pkgs_dir), registry)
+        return entry
+
+
+def _is_build_entry_current(builds_dir, pkg_name, entry):
+    """Check whether registry entry for package builds is up to date.
+
+    Args:
+        builds_dir (str): build directory.
+        pkg_name (str): name of package.
+        entry (dict or None): registry entry for package.
+
+    Returns:
+        (bool): whether no builds have been added or removed, and none of
+            their directories or info files have changed, since the entry
+            was read.
+    """
+    # entries written before version indexes were added, or whose version
+    # keys were made differently, are refreshed
+    if (entry is None or "index" not in entry
+            or entry["index"].get("key_format") != version_spec.KEY_FORMAT):
+        return False
+    pkg_build_dir = os.path.join(builds_dir, pkg_name)
+    if entry["mtime_ns"] != _get_mtime(pkg_build_dir):
+        return False
+    return all(
+        version_entry["mtime_ns"] == _get_entry_mtimes(
+            os.path.join(pkg_build_dir, version),
+            _BUILD_INFO_FILE_NAMES,
+        )
+        for version, version_entry in entry["versions"].items()
+    )
+
+
+def _get_build_entry(builds_dir, pkg_name, save=True):
+    """Get up to date registry entry for package builds.
+
+    Args:
+        builds_dir (str): build directory.
+        pkg_name (str): name of package.
+        save (bool): if False, an out of date entry is re-read without being
+            saved, so the build directory is never written to.
+
+    Returns:
+        (dict or None): registry entry, if package has builds.
+    """
+    with _get_lock(builds_dir):
+        entry = _load(get_registry_file(builds_dir, pkg_name))
+        if not _is_build_entry_current(builds_dir, pkg_name, entry):
+            if not save:
+                return _read_build_entry(builds_dir, pkg_name, entry)
+            entry = update_build(builds_dir, pkg_name)
+        return entry
+
+
+def get_builds(builds_dir, pkg_name):
+    """Get info on all builds of package in given build directory.
+
+    Args:
+        builds_dir (str): build directory.
+        pkg_name (str): name of package.
+
+    Returns:
+        (OrderedDict(str, dict)): dicts with the pkg-info and version comment
+            of each build, keyed by version, in ascending version order.
+            Builds with missing or unreadable pkg-info files are skipped.
+    """
+    entry = _get_build_entry(builds_dir, pkg_name)
+    if not entry:
+        return OrderedDict()
+    return OrderedDict(
+        (version, entry["versions"][version])
+        for version in entry["index"]["versions"]
+    )
+
+
+def get_version_index(builds_dir, pkg_name, save=True):
+    """Get sorted version index of package builds in given build directory.
+
+    Args:
+        builds_dir (str): build directory.
+        pkg_name (str): name of package.
+        save (bool): if False, don't save the registry entry if it has to be
+            refreshed, eg. for shared build stores.
+
+    Returns:
+        (list(list)): version keys of builds, in ascending order.
+        (list(str)): versions corresponding to keys.
+    """
+    entry = _get_build_entry(builds_dir, pkg_name, save)
+    if not entry:
+        return [], []
+    return entry["index"]["keys"], entry["index"]["versions"]
+
+
+def resolve_version(builds_dir, pkg_name, spec, save=True):
+    """Get highest built version of package matching version spec.
+
+    Exact versions are returned unchanged, without checking for a build.
+
+    Args:
+        builds_dir (str): build directory.
+        pkg_name (str): name of package.
+        spec (str): version spec, eg. latest, >=1.2,<2 or ~1.2.
+        save (bool): if False, don't save the registry entry if it has to be
+            refreshed, eg. for shared build stores.
+
+    Raises:
+        (utils.PkgError): if the spec is invalid.
+
+    Returns:
+        (str or None): matching version, if there is one.
+    """
+    if not version_spec.is_spec(spec):
+        return spec
+    keys, versions = get_version_index(builds_dir, pkg_name, save)
+    return version_spec.resolve(spec, keys, versions)
+
+
+@timings.timed("update_registry")
+def update_build(builds_dir, pkg_name, version=None):
+    """Update registry entry for package builds, after they've changed.
+
+    Args:
+        builds_dir (str): build directory.
+        pkg_name (str): name of package.
+        version (str or None): version that has changed. This will be
+            re-read even if its directory and info files haven't changed.
+
+    Returns:
+        (dict or None): new registry entry, if package has builds.
+    """
+    with _get_lock(builds_dir):
+        registry_file = get_registry_file(builds_dir, pkg_name)
+        old_entry = _load(registry_file)
+        if old_entry is not None and version is not None:
+            old_entry["versions"].pop(version, None)
+        entry = _read_build_entry(builds_dir, pkg_name, old_entry)
+        _save(registry_file, entry)
+        return entry
@@ -0,0 +1,388 @@
+"""pkg-gc command to remove old builds according to retention policies."""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
+import stat
+
+from pkg import constants, registry, store, trash, unbuild, utils
+from pkg import version_spec
+
+
+# formats accepted for --keep-newer-than, and used for build_time
+_DATE_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d")
+
+
+def add_subparser_command(subparser):
+    """Add pkg-gc subparser commands.
+
+    Args:
+        subparser (argparse.Parser): argparse object.
+    """
+    gc_command = subparser.add_parser(
+        constants.GC,
+        help=(
+            "remove old builds that fall outside the given retention "
+            "policies. Installed versions are always kept"
+        ),
+    )
+    gc_command.add_argument(
+        "pkg_names",
+        nargs="*",
+        type=str,
+        help="packages to remove builds of (default all packages)",
+    )
+    gc_command.add_argument(
+        "--keep-last",
+        type=int,
+        default=None,
+        metavar="N",
+        help="keep the N most recently built versions of each package",
+    )
+    gc_command.add_argument(
+        "--keep-newer-than",
+        type=_parse_date_argument,
+        default=None,
+        metavar="DATE",
+        help=(
+            "keep builds whose build_time is on or after DATE, given as "
+            "YYYY-MM-DD or 'YYYY-MM-DD HH:MM:SS'"
+        ),
+    )
+    gc_command.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only report what would be removed",
+    )
+    gc_command.add_argument(
+        "-f",
+        action="store_true",
+        help="force removal (don't ask for confirmation)",
+    )
+    gc_command.add_argument(
+        "-d",
+        action="store_true",
+        help="remove from dev builds",
+    )
+    gc_command.add_argument(
+        "-j",
+        type=int,
+        default=None,
+        metavar="WORKERS",
+        help="number of threads to delete builds with (default {0})".format(
+            constants.DEFAULT_COPY_WORKERS
+        ),
+    )
+
+
+def _parse_date(date_string):
+    """Parse date given on commandline or in a pkg-info build_time.
+
+    Args:
+        date_string (str): date, in one of the accepted formats.
+
+    Raises:
+        (ValueError): if the date isn't in an accepted format.
+
+    Returns:
+        (datetime): parsed date.
+    """
+    for date_format in _DATE_FORMATS:
+        try:
+            return datetime.strptime(date_string, date_format)
+        except ValueError:
+            continue
+    raise ValueError("invalid date: {0}".format(date_string))
+
+
+def _parse_date_argument(date_string):
+    """Parse date given on commandline.
+
+    Args:
+        date_string (str): date, in one of the accepted formats.
+
+    Raises:
+        (argparse.ArgumentTypeError): if the date isn't in an accepted format.
+
+    Returns:
+        (datetime): parsed date.
+    """
+    try:
+        return _parse_date(date_string)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "invalid date {0!r}, expected YYYY-MM-DD or "
+            "'YYYY-MM-DD HH:MM:SS'".format(date_string)
+        )
+
+
+def _get_build_time(pkg_info):
+    """Get build time of build from its pkg-info.
+
+    Args:
+        pkg_info (dict): pkg-info of build.
+
+    Returns:
+        (datetime or None): build time, if recorded and valid.
+    """
+    try:
+        return _parse_date(pkg_info.get(constants.BUILD_TIME_KEY) or "")
+    except ValueError:
+        return None
+
+
+def get_builds_to_remove(
+        builds_dir,
+        pkg_name,
+        keep_last=None,
+        keep_newer_than=None):
+    """Get versions of package outside the retention policies.
+
+    A build is kept if any policy keeps it. Builds with no valid build_time
+    are always kept, as their age isn't known, and so are builds of versions
+    installed to either install directory.
+
+    Args:
+        builds_dir (str): build directory.
+        pkg_name (str): name of package.
+        keep_last (int or None): if given, keep this many of the most
+            recently built versions.
+        keep_newer_than (datetime or None): if given, keep builds built on
+            or after this time.
+
+    Returns:
+        (list(str)): versions to remove, oldest first.
+    """
+    builds = [
+        (_get_build_time(build_info["pkg_info"]), version)
+        for version, build_info in registry.get_builds(
+            builds_dir,
+            pkg_name,
+        ).items()
+    ]
+    # builds with no build_time are always kept, so they don't count
+    # towards keep_last either
+    builds = [build for build in builds if build[0] is not None]
+    # most recent first, falling back to version order for equal times
+    builds.sort(
+        key=lambda build: (build[0], version_spec.get_version_key(build[1])),
+        reverse=True,
+    )
+    versions_to_remove = []
+    for index, (build_time, version) in enumerate(builds):
+        if keep_last is not None and index < keep_last:
+            continue
+        if keep_newer_than is not None and build_time >= keep_newer_than:
+            continue
+        if any(
+                unbuild.is_installed_version(pkgs_dir, pkg_name, version)
+                for pkgs_dir in (constants.PKGS_DIR, constants.DEV_PKGS_DIR)):
+            continue
+        versions_to_remove.append(version)
+    return versions_to_remove[::-1]
+
+
+def _get_store_inodes(builds_dir):
+    """Get inodes of all objects in the store of a build directory.
+
+    Args:
+        builds_dir (str): build directory.
+
+    Returns:
+        (set(tuple(int, int))): device and inode of each stored object.
+    """
+    inodes = set()
+    for root, _, file_names in os.walk(store.get_store_dir(builds_dir)):
+        for file_name in file_names:
+            try:
+                object_stat = os.lstat(os.path.join(root, file_name))
+            except OSError:
+                continue
+            inodes.add((object_stat.st_dev, object_stat.st_ino))
+    return inodes
+
+
+def get_reclaimable_bytes(builds_dir, build_dirs):
+    """Get number of bytes that removing build directories would free.
+
+    Build files are hardlinked to the store and may be linked to other
+    builds and installs, so a file's bytes are only counted if every link
+    to it other than its store object is being removed.
+
+    Args:
+        builds_dir (str): build directory.
+        build_dirs (list(str)): build directories to be removed.
+
+    Returns:
+        (int): number of bytes that would be freed.
+    """
+    # links being removed to each inode, with its size and total links
+    inodes = {}
+    for build_dir in build_dirs:
+        for root, _, file_names in os.walk(build_dir):
+            for file_name in file_names:
+                try:
+                    file_stat = os.lstat(os.path.join(root, file_name))
+                except OSError:
+                    continue
+                inode = (file_stat.st_dev, file_stat.st_ino)
+                num_removed, _, _ = inodes.get(inode, (0, 0, 0))
+                inodes[inode] = (
+                    num_removed + 1,
+                    file_stat.st_size,
+                    file_stat.st_nlink,
+                )
+    store_inodes = _get_store_inodes(builds_dir) if inodes else set()
+    return sum(
+        size for inode, (num_removed, size, num_links) in inodes.items()
+        if num_removed + (inode in store_inodes) >= num_links
+    )
+
+
+def _format_bytes(num_bytes):
+    """Format number of bytes for display.
+
+    Args:
+        num_bytes (int): number of bytes.
+
+    Returns:
+        (str): formatted size, eg. "1.5 MB".
+    """
+    if num_bytes < 1024:
+        return "{0} B".format(num_bytes)
+    size = float(num_bytes)
+    for unit in ("KB", "MB", "GB", "TB"):
+        size /= 1024
+        if size < 1024:
+            break
+    return "{0:.1f} {1}".format(size, unit)
+
+
+def _delete_build(build_dir):
+    """Delete build directory.
+
+    Args:
+        build_dir (str): build directory to delete.
+
+    Returns:
+        (int): number of bytes freed by deleting files that nothing else
+            links to. Files that are still linked to a store object are
+            only freed once the store is pruned.
+    """
+    freed_bytes = 0
+    for root, _, file_names in os.walk(build_dir):
+        for file_name in file_names:
+            try:
+                file_stat = os.lstat(os.path.join(root, file_name))
+            except OSError:
+                continue
+            if stat.S_ISREG(file_stat.st_mode) and file_stat.st_nlink == 1:
+                freed_bytes += file_stat.st_size
+    trash.delete_tree(build_dir)
+    return freed_bytes
+
+
+def remove_builds(builds_dir, builds_to_remove, workers=None):
+    """Remove builds, deleting them concurrently.
+
+    Every build is moved to the trash first, so none are left partially
+    deleted in the build directory, then the trashed trees are deleted on a
+    thread pool and unused store objects are pruned.
+
+    Args:
+        builds_dir (str): build directory.
+        builds_to_remove (dict(str, list(str))): versions to remove of each
+            package.
+        workers (int or None): number of threads to delete with.
+
+    Returns:
+        (int): number of bytes freed.
+    """
+    paths_to_delete = []
+    for pkg_name, versions in builds_to_remove.items():
+        for version in versions:
+            build_dir = os.path.join(builds_dir, pkg_name, version)
+            paths_to_delete.append(trash.move_to_trash(build_dir) or build_dir)
+        registry.update_build(builds_dir, pkg_name)
+    with ThreadPoolExecutor(
+            max_workers=workers or constants.DEFAULT_COPY_WORKERS) as executor:
+        freed_bytes = sum(executor.map(_delete_build, paths_to_delete))
+    return freed_bytes + store.prune(store.get_store_dir(builds_dir))
+
+
+def main(args):
+    """Remove old builds based on commandline args.
+
+    Args:
+        args (argparse.Namespace): arguments from commandline.
+    """
+    if args.keep_last is None and args.keep_newer_than is None:
+        utils.print_error(
+            "At least one retention policy must be given: --keep-last or "
+            "--keep-newer-than"
+        )
+        return
+    if args.keep_last is not None and args.keep_last < 0:
+        utils.print_error("--keep-last can't be negative")
+        return
+
+    builds_dir = (
+        constants.DEV_PKG_BUILDS_DIR if args.d else constants.PKG_BUILDS_DIR
+    )
+    if not args.pkg_names and not os.path.isdir(builds_dir):
+        print ("No builds to remove")
+        return
+    pkg_names = args.pkg_names or sorted(
+        name for name in os.listdir(builds_dir)
+        if not name.startswith(".")
+        and os.path.isdir(os.path.join(builds_dir, name))
+    )
+
+    builds_to_remove = {}
+    for pkg_name in pkg_names:
+        versions = get_builds_to_remove(
+            builds_dir,
+            pkg_name,
+            args.keep_last,
+            args.keep_newer_than,
+        )
+        if versions:
+            builds_to_remove[pkg_name] = versions
+    if not builds_to_remove:
+        print ("No builds to remove")
+        return
+
+    num_builds = sum(len(versions) for versions in builds_to_remove.values())
+    reclaimable_bytes = get_reclaimable_bytes(
+        builds_dir,
+        [
+            os.path.join(builds_dir, pkg_name, version)
+            for pkg_name, versions in builds_to_remove.items()
+            for version in versions
+        ],
+    )
+    print ("\n Builds to remove\n ----------------")
+    for pkg_name, versions in sorted(builds_to_remove.items()):
+        print (" {0}    {1}".format(pkg_name, ", ".join(versions)))
+    print ("\n{0} builds, {1} to reclaim".format(
+        num_builds,
+        _format_bytes(reclaimable_bytes),
+    ))
+    if args.dry_run:
+        return
+
+    continue_gc = args.f or utils.prompt_user_confirmation(
+        "Remove {0} builds from {1}? [y|N]".format(num_builds, builds_dir),
+        confirmation_chars=['y'],
+        accepted_chars=['y', 'n', ''],
+    )
+    if not continue_gc:
+        print ("Aborting.")
+        return
+
+    freed_bytes = remove_builds(builds_dir, builds_to_remove, args.j)
+    print ("Removed {0} builds, reclaimed {1}".format(
+        num_builds,
+        _format_bytes(freed_bytes),
+    ))
@@ -0,0 +1,382 @@
+"""pkg-serve command to answer pkg queries from a long-lived process.
+
+The daemon keeps the registries of all pkg roots loaded in memory, and
+refreshes them by polling directory mtimes in the background, so requests
+don't have to start a new interpreter or re-read anything from disk. It
+listens on a Unix socket, and read-only commands (pkg list and pkg query)
+are sent to it when it's running, falling back to running directly when
+it isn't.
+
+Each request holds the commandline arguments separated by null bytes, ended
+by the client shutting down its side of the connection. The command's output
+is streamed back, followed by a null byte and its exit status, then the
+daemon closes the connection. If the daemon doesn't respond in time, the
+client runs the command itself.
+"""
+
+import contextlib
+import os
+import signal
+import socket
+import stat
+import sys
+import threading
+import time
+
+from pkg import constants, registry, utils
+
+
+# commands are run one at a time, as their output is captured by replacing
+# stdout for the whole process
+_COMMAND_LOCK = threading.Lock()
+
+
+def add_subparser_command(subparser):
+    """Add pkg-serve subparser commands.
+
+    Args:
+        subparser (argparse.Parser): argparse object.
+    """
+    serve_command = subparser.add_parser(
+        constants.SERVE,
+        help=(
+            "run daemon that answers pkg list and pkg query from memory, "
+            "which the pkg command uses whenever it's running"
+        ),
+    )
+    serve_command.add_argument(
+        "--socket",
+        type=str,
+        default=None,
+        help="path of Unix socket to listen on (default {0})".format(
+            get_socket_path()
+        ),
+    )
+    serve_command.add_argument(
+        "--poll-interval",
+        type=float,
+        default=constants.DEFAULT_POLL_INTERVAL,
+        metavar="SECONDS",
+        help="how often to check pkg roots for changes (default {0})".format(
+            constants.DEFAULT_POLL_INTERVAL
+        ),
+    )
+
+
+def get_socket_path():
+    """Get path of daemon socket.
+
+    This can be overridden with the PKG_SERVE_SOCKET environment variable.
+
+    Returns:
+        (str): path to socket.
+    """
+    socket_path = os.environ.get(constants.SERVE_SOCKET_ENV_VAR)
+    if socket_path:
+        return socket_path
+    return os.path.join(
+        os.environ.get("XDG_RUNTIME_DIR") or "/tmp",
+        "pkg-serve-{0}.sock".format(os.getuid()),
+    )
+
+
+def _is_own_socket(socket_path):
+    """Check whether path is a socket owned by the current user.
+
+    Anything else at the socket path may have been put there by another
+    user, so is never connected to or removed.
+
+    Args:
+        socket_path (str): path to daemon socket.
+
+    Returns:
+        (bool): whether path is a socket owned by the current user.
+    """
+    try:
+        socket_stat = os.lstat(socket_path)
+    except OSError:
+        return False
+    return (
+        stat.S_ISSOCK(socket_stat.st_mode)
+        and socket_stat.st_uid == os.getuid()
+    )
+
+
+def _get_exit_status(error):
+    """Get exit status of command that exited with SystemExit.
+
+    Args:
+        error (SystemExit): exception raised by the command.
+
+    Returns:
+        (int): exit status, as the interpreter would exit with.
+    """
+    if error.code is None:
+        return 0
+    if isinstance(error.code, int):
+        return error.code
+    return 1
+
+
+def run_client(argv, socket_path=None, timeout=None):
+    """Run command through daemon, if it's running.
+
+    Args:
+        argv (list(str)): commandline arguments, excluding the program name.
+        socket_path (str or None): path to daemon socket. If None, use the
+            default path.
+        timeout (float or None): seconds to wait for the daemon to respond.
+            If None, use the default timeout.
+
+    Returns:
+        (int or None): exit status of the command, or None if the daemon
+            didn't run it, so it should be run directly.
+    """
+    socket_path = socket_path or get_socket_path()
+    if not _is_own_socket(socket_path):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout or constants.SERVE_CLIENT_TIMEOUT)
+    try:
+        client.connect(socket_path)
+        client.sendall("\0".join(argv).encode("utf-8"))
+        client.shutdown(socket.SHUT_WR)
+    except OSError:
+        # eg. daemon has stopped without removing its socket, or is hung
+        client.close()
+        return None
+
+    # output never contains null bytes, so the first one starts the status
+    status = None
+    has_output = False
+    with client:
+        stdout = os.fdopen(os.dup(1), "wb")
+        with stdout:
+            try:
+                for block in iter(lambda: client.recv(65536), b""):
+                    if status is None:
+                        block, separator, status = block.partition(b"\0")
+                        if not separator:
+                            status = None
+                        if block:
+                            has_output = True
+                            stdout.write(block)
+                            stdout.flush()
+                    else:
+                        status += block
+            except socket.timeout:
+                if not has_output:
+                    # nothing was written, so it's safe to run directly
+                    return None
+                utils.print_error(
+                    "pkg serve stopped responding",
+                    output=sys.stderr,
+                )
+                return 1
+    if status is None or not status.isdigit():
+        utils.print_error(
+            "pkg serve closed the connection without an exit status",
+            output=sys.stderr,
+        )
+        return 1
+    return int(status)
+
+
+def _is_running(socket_path):
+    """Check whether a daemon is listening on given socket.
+
+    Args:
+        socket_path (str): path to daemon socket.
+
+    Returns:
+        (bool): whether daemon accepted a connection.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with client:
+        try:
+            client.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+
+class _SocketWriter(object):
+    """Text stream that sends everything written to it over a socket."""
+
+    def __init__(self, connection):
+        """Initialise writer.
+
+        Args:
+            connection (socket.socket): connection to write to.
+        """
+        self._connection = connection
+
+    def write(self, text):
+        """Send text over connection.
+
+        Args:
+            text (str): text to send.
+
+        Returns:
+            (int): number of characters written.
+        """
+        self._connection.sendall(text.encode("utf-8"))
+        return len(text)
+
+    def flush(self):
+        """Flush stream. Text is sent as soon as it's written."""
+
+
+def _handle_connection(connection):
+    """Run pkg command sent over connection and stream back its output.
+
+    Args:
+        connection (socket.socket): accepted client connection.
+    """
+    # imported here so the daemon uses the same parser as the pkg command
+    from pkg import __main__ as pkg_main
+
+    with connection:
+        try:
+            with connection.makefile("rb") as reader:
+                request = reader.read().decode("utf-8")
+        except (OSError, UnicodeDecodeError):
+            return
+        if not request:
+            # connection made only to check the daemon is running
+            return
+        argv = request.split("\0")
+        writer = _SocketWriter(connection)
+        with _COMMAND_LOCK, contextlib.redirect_stdout(writer), \
+                contextlib.redirect_stderr(writer):
+            try:
+                if pkg_main.get_command_name(argv) not in (
+                        constants.LIST, constants.QUERY):
+                    utils.print_error(
+                        "pkg serve can only run pkg list and pkg query"
+                    )
+                    status = 1
+                else:
+                    args, module = pkg_main.get_args(argv)
+                    module.main(args)
+                    status = 0
+            except SystemExit as error:
+                # eg. from argparse on invalid arguments or --help
+                status = _get_exit_status(error)
+            except OSError:
+                # client has disconnected
+                return
+        try:
+            connection.sendall("\0{0}".format(status).encode("utf-8"))
+        except OSError:
+            pass
+
+
+def refresh_registries():
+    """Bring registries of all pkg roots up to date.
+
+    Only directories whose mtimes have changed are re-read.
+    """
+    for pkgs_dir in (constants.PKGS_DIR, constants.DEV_PKGS_DIR):
+        registry.get_installs(pkgs_dir)
+    for builds_dir in (constants.PKG_BUILDS_DIR, constants.DEV_PKG_BUILDS_DIR):
+        if not os.path.isdir(builds_dir):
+            continue
+        for pkg_name in os.listdir(builds_dir):
+            if not pkg_name.startswith("."):
+                registry.get_builds(builds_dir, pkg_name)
+
+
+def _poll_registries(poll_interval, stop_event):
+    """Refresh registries until stopped.
+
+    Args:
+        poll_interval (float): seconds to wait between refreshes.
+        stop_event (threading.Event): event set to stop polling.
+    """
+    while not stop_event.wait(poll_interval):
+        try:
+            refresh_registries()
+        except OSError as error:
+            # eg. a directory was removed while being scanned
+            utils.print_error("Failed to refresh registries: {0}", error)
+
+
+def run_serve(socket_path=None, poll_interval=None):
+    """Run daemon until interrupted.
+
+    Args:
+        socket_path (str or None): path of socket to listen on. If None, use
+            the default path.
+        poll_interval (float or None): seconds to wait between refreshing
+            registries. If None, use the default interval.
+
+    Returns:
+        (bool): whether daemon started successfully.
+    """
+    socket_path = socket_path or get_socket_path()
+    poll_interval = poll_interval or constants.DEFAULT_POLL_INTERVAL
+    if os.path.lexists(socket_path):
+        if not _is_own_socket(socket_path):
+            utils.print_error(
+                "Path isn't a socket owned by the current user, so can't be "
+                "replaced:\n\n\t{0}",
+                socket_path,
+            )
+            return False
+        if _is_running(socket_path):
+            utils.print_error(
+                "pkg serve is already running on {0}",
+                socket_path,
+            )
+            return False
+        # left behind by a daemon that didn't shut down cleanly
+        os.remove(socket_path)
+
+    start_time = time.time()
+    refresh_registries()
+    print ("Loaded registries in {0:.2f}s".format(time.time() - start_time))
+
+    # only the user running the daemon can connect to it
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    server.listen(socket.SOMAXCONN)
+    stop_event = threading.Event()
+    poll_thread = threading.Thread(
+        target=_poll_registries,
+        args=(poll_interval, stop_event),
+        daemon=True,
+    )
+    poll_thread.start()
+    # let the socket be removed when the daemon is stopped with kill
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    print ("Serving on {0}".format(socket_path))
+    try:
+        while True:
+            connection, _ = server.accept()
+            threading.Thread(
+                target=_handle_connection,
+                args=(connection,),
+                daemon=True,
+            ).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        server.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+    return True
+
+
+def main(args):
+    """Run daemon based on commandline args.
+
+    Args:
+        args (argparse.Namespace): arguments from commandline.
+    """
+    run_serve(args.socket, args.poll_interval)
@@ -0,0 +1,186 @@
+"""Content-addressed object store for package builds.
+
+Each builds directory has a store in which file contents are kept once,
+keyed by their hash and permissions. Build version directories are then
+made up of hardlinks to the stored objects, so unchanged files are shared
+between all versions of a package.
+
+Objects that no build links to any more are pruned, which may happen in a
+background purge while a build is adding files. Adding and linking an
+object holds a shared lock on the store, and pruning holds it exclusively,
+so objects are never pruned between being added and being linked.
+"""
+
+import contextlib
+import os
+import stat
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from pkg import constants, files, timings, utils
+
+
+# lock file in the top level of each store
+_LOCK_FILE_NAME = ".lock"
+
+
+def get_store_dir(builds_dir):
+    """Get object store directory for given builds directory.
+
+    Args:
+        builds_dir (str): builds directory (eg. PKG_BUILDS_DIR).
+
+    Returns:
+        (str): path to object store directory.
+    """
+    return os.path.join(builds_dir, constants.STORE_DIR_NAME)
+
+
+def get_object_path(store_dir, file_hash, mode):
+    """Get path of object in store.
+
+    Args:
+        store_dir (str): path to object store directory.
+        file_hash (str): hash of file contents.
+        mode (int): file mode. Only the permission bits are used, since all
+            hardlinks to an object share its permissions.
+
+    Returns:
+        (str): path to object.
+    """
+    return os.path.join(
+        store_dir,
+        file_hash[:2],
+        "{0}-{1:o}".format(file_hash, stat.S_IMODE(mode)),
+    )
+
+
+@contextlib.contextmanager
+def _lock_store(store_dir, exclusive=False):
+    """Lock store, while adding files or pruning objects.
+
+    Locks aren't taken where fcntl isn't available.
+
+    Args:
+        store_dir (str): path to object store directory.
+        exclusive (bool): if True, take an exclusive lock for pruning,
+            otherwise take a lock shared with everything else adding files.
+    """
+    if fcntl is None:
+        yield
+        return
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, _LOCK_FILE_NAME), "a") as lock_file:
+        # the lock is released when the file is closed
+        fcntl.flock(
+            lock_file.fileno(),
+            fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH,
+        )
+        yield
+
+
+def add_file(store_dir, src_path, file_hash=None):
+    """Add file to store, if its contents aren't already stored.
+
+    The object may be pruned as soon as it's added unless the caller holds
+    the store lock until it's linked, as link_file does. An existing object
+    whose size no longer matches its name was edited in place through one
+    of its links, so it's replaced rather than linked to again.
+
+    Args:
+        store_dir (str): path to object store directory.
+        src_path (str): path of file to add.
+        file_hash (str or None): hash of file contents, if already known.
+
+    Returns:
+        (str): path to stored object.
+    """
+    src_stats = os.stat(src_path)
+    object_path = get_object_path(
+        store_dir, file_hash or utils.hash_file(src_path), src_stats.st_mode
+    )
+    try:
+        object_size = os.stat(object_path).st_size
+    except FileNotFoundError:
+        object_size = None
+    if object_size != src_stats.st_size:
+        object_dir = os.path.dirname(object_path)
+        if not os.path.isdir(object_dir):
+            os.makedirs(object_dir, exist_ok=True)
+        # copy to a temp file first so partially-written objects are never
+        # visible under their final name
+        file_descriptor, temp_path = tempfile.mkstemp(dir=object_dir)
+        os.close(file_descriptor)
+        files.copy_file(src_path, temp_path)
+        if object_size is None:
+            try:
+                os.link(temp_path, object_path)
+            except FileExistsError:
+                # added by another thread or process since, and may already
+                # be linked to, so it's kept rather than replaced
+                pass
+            finally:
+                os.remove(temp_path)
+        else:
+            os.replace(temp_path, object_path)
+        timings.count("store_objects_added")
+    return object_path
+
+
+def link_file(store_dir, src_path, dest_path, file_hash=None):
+    """Add file to store and hardlink it into destination.
+
+    This can be used as the copy_function of files.copy_tree, once the
+    store_dir arg is given. If the object can't be hardlinked (eg. the
+    filesystem doesn't support it) the file is copied instead.
+
+    Args:
+        store_dir (str): path to object store directory.
+        src_path (str): path of file to copy.
+        dest_path (str): path to link file to.
+        file_hash (str or None): hash of file contents, if already known.
+
+    Returns:
+        (str): name of strategy used to copy the file.
+    """
+    try:
+        with _lock_store(store_dir):
+            object_path = add_file(store_dir, src_path, file_hash)
+            os.link(object_path, dest_path)
+    except OSError:
+        return files.copy_file(src_path, dest_path)
+    timings.count("files_hardlinked")
+    return files.HARDLINK
+
+
+def prune(store_dir):
+    """Remove any objects that are no longer linked to by a build.
+
+    Args:
+        store_dir (str): path to object store directory.
+
+    Returns:
+        (int): number of bytes reclaimed.
+    """
+    reclaimed_bytes = 0
+    if not os.path.isdir(store_dir):
+        return reclaimed_bytes
+    with _lock_store(store_dir, exclusive=True):
+        for root, _, file_names in os.walk(store_dir):
+            for file_name in file_names:
+                if root == store_dir and file_name == _LOCK_FILE_NAME:
+                    continue
+                object_path = os.path.join(root, file_name)
+                try:
+                    object_stat = os.lstat(object_path)
+                    if object_stat.st_nlink == 1:
+                        os.remove(object_path)
+                        reclaimed_bytes += object_stat.st_size
+                except OSError:
+                    continue
+    return reclaimed_bytes
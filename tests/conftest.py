@@ -0,0 +1,75 @@
+"""Fixtures shared by the pkg tests.
+
+Run with the pkg package on the PYTHONPATH, eg. from the directory holding
+the package:
+
+    python -m pytest pkg/tests
+"""
+
+import json
+import os
+
+import pytest
+
+from pkg import constants, registry, trash
+
+
+@pytest.fixture
+def roots(tmp_path, monkeypatch):
+    """Point every pkg root at a fresh temp directory.
+
+    Registries cached by earlier tests are dropped, background deletes are
+    left disabled and no shared build stores are searched.
+
+    Returns:
+        (dict(str, str)): path of each root, keyed by its constants name.
+    """
+    root_dirs = {}
+    for name, dir_name in (
+            ("PKGS_DIR", "pkgs"),
+            ("PKG_BUILDS_DIR", "builds"),
+            ("DEV_PKGS_DIR", "dev-pkgs"),
+            ("DEV_PKG_BUILDS_DIR", "dev-builds")):
+        root_dir = str(tmp_path / dir_name)
+        os.makedirs(root_dir)
+        monkeypatch.setattr(constants, name, root_dir)
+        root_dirs[name] = root_dir
+    monkeypatch.delenv(constants.SHARED_BUILDS_ENV_VAR, raising=False)
+    monkeypatch.setattr(registry, "_CACHE", {})
+    monkeypatch.setattr(
+        trash,
+        "_BACKGROUND_STATE",
+        {"enabled": False, "root_dirs": set()},
+    )
+    return root_dirs
+
+
+@pytest.fixture
+def make_package(tmp_path):
+    """Get function that writes a package source tree.
+
+    Returns:
+        (function): function taking the package name, and optionally its
+            version, files and dependencies, that returns its directory.
+    """
+    def make(name, version="1.0", files=None, dependencies=None):
+        src_dir = tmp_path / "src" / name
+        src_dir.mkdir(parents=True, exist_ok=True)
+        pkg_info = {constants.NAME_KEY: name, constants.VERSION_KEY: version}
+        if dependencies:
+            pkg_info[constants.DEPENDENCIES_KEY] = dependencies
+        (src_dir / constants.PKG_INFO_FILE_NAME).write_text(
+            json.dumps(pkg_info)
+        )
+        (src_dir / constants.VERSION_INFO_FILE_NAME).write_text(
+            "'{0}': release\n".format(version)
+        )
+        if files is None:
+            files = {"__init__.py": "", "sub/mod.py": "x = 1\n"}
+        for rel_path, contents in files.items():
+            path = src_dir / rel_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(contents)
+        return str(src_dir)
+
+    return make
@@ -0,0 +1,95 @@
+"""Tests for exporting and importing build bundles."""
+
+import os
+import threading
+
+from pkg import build, bundle, constants, manifest, store
+
+
+def _export_through_pipe(pkg_name, version):
+    """Export build into a pipe from another thread.
+
+    Returns:
+        (file): read end of the pipe.
+        (threading.Thread): thread writing the bundle.
+        (list(bool)): list the export's result is added to.
+    """
+    read_fd, write_fd = os.pipe()
+    results = []
+
+    def export():
+        with os.fdopen(write_fd, "wb") as write_file:
+            results.append(
+                bundle.run_export(pkg_name, version, False, write_file)
+            )
+
+    thread = threading.Thread(target=export)
+    thread.start()
+    return os.fdopen(read_fd, "rb"), thread, results
+
+
+def test_round_trip_through_pipe(roots, make_package):
+    """A bundle streamed through a pipe recreates the build."""
+    assert build.run_build("1.0", False, True, src_dir=make_package("foo"))
+    builds_dir = roots["PKG_BUILDS_DIR"]
+    build_dir = os.path.join(builds_dir, "foo", "1.0")
+    old_manifest = manifest.read_manifest(build_dir)
+
+    read_file, thread, results = _export_through_pipe("foo", "1.0")
+    # import to dev builds, so the build is recreated from the pipe
+    import_builds_dir = roots["DEV_PKG_BUILDS_DIR"]
+    with read_file:
+        assert bundle.run_import(read_file, True, True, interactive=False)
+    thread.join()
+    assert results == [True]
+
+    imported_dir = os.path.join(import_builds_dir, "foo", "1.0")
+    imported_manifest = manifest.create_manifest(imported_dir)
+    for path, entry in old_manifest.items():
+        assert imported_manifest[path]["sha256"] == entry["sha256"]
+        assert imported_manifest[path]["mode"] == entry["mode"]
+    assert sorted(imported_manifest) == sorted(old_manifest)
+
+    # imported files are stored objects, shared like built files
+    mod_path = os.path.join(imported_dir, "sub", "mod.py")
+    assert os.stat(mod_path).st_nlink == 2
+    store_dir = store.get_store_dir(import_builds_dir)
+    assert any(
+        os.path.samefile(os.path.join(root, file_name), mod_path)
+        for root, _, file_names in os.walk(store_dir)
+        for file_name in file_names
+    )
+
+
+def test_import_rejects_mismatched_pkg_info(roots, make_package):
+    """A bundle whose manifest version disagrees with pkg-info is refused."""
+    assert build.run_build("1.0", False, True, src_dir=make_package("foo"))
+    builds_dir = roots["PKG_BUILDS_DIR"]
+    pkg_info_file = os.path.join(
+        builds_dir,
+        "foo",
+        "1.0",
+        constants.PKG_INFO_FILE_NAME,
+    )
+    with open(pkg_info_file) as file_:
+        pkg_info = file_.read()
+    with open(pkg_info_file, "w") as file_:
+        file_.write(pkg_info.replace('"1.0"', '"9.9"'))
+
+    read_file, thread, _ = _export_through_pipe("foo", "1.0")
+    with read_file:
+        assert not bundle.run_import(read_file, True, True, interactive=False)
+    thread.join()
+    assert not os.path.exists(
+        os.path.join(roots["DEV_PKG_BUILDS_DIR"], "foo", "1.0")
+    )
+
+
+def test_export_missing_build_fails(roots, capsys):
+    """Exporting a build that doesn't exist writes nothing to the bundle."""
+    read_fd, write_fd = os.pipe()
+    with os.fdopen(write_fd, "wb") as write_file:
+        assert not bundle.run_export("foo", "1.0", False, write_file)
+    with os.fdopen(read_fd, "rb") as read_file:
+        assert read_file.read() == b""
+    assert "no version 1.0 built" in capsys.readouterr().out
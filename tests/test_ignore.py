@@ -0,0 +1,45 @@
+"""Tests for gitignore-style ignore patterns."""
+
+import pytest
+
+from pkg import files, ignore
+
+
+@pytest.mark.parametrize("patterns, path, is_dir, expected", [
+    (["*.pyc"], "a.pyc", False, True),
+    (["*.pyc"], "sub/deep/a.pyc", False, True),
+    (["*.pyc"], "a.py", False, False),
+    (["build/"], "build", True, True),
+    (["build/"], "build", False, False),
+    (["/top.txt"], "top.txt", False, True),
+    (["/top.txt"], "sub/top.txt", False, False),
+    (["docs/*.md"], "docs/a.md", False, True),
+    (["docs/*.md"], "docs/sub/a.md", False, False),
+    (["docs/**/*.md"], "docs/sub/a.md", False, True),
+    (["a?c"], "abc", False, True),
+    (["a?c"], "a/c", False, False),
+    (["*.log", "!keep.log"], "keep.log", False, False),
+    (["*.log", "!keep.log"], "other.log", False, True),
+    (["!keep.log", "*.log"], "keep.log", False, True),
+    (["# comment", "", "*.tmp"], "# comment", False, False),
+    (["# comment", "", "*.tmp"], "a.tmp", False, True),
+])
+def test_match(patterns, path, is_dir, expected):
+    """Paths are matched with gitignore rules."""
+    assert ignore.IgnoreMatcher(patterns).match(path, is_dir) == expected
+
+
+def test_walk_tree_skips_ignored_directories(tmp_path):
+    """Nothing under an ignored directory is walked."""
+    for rel_path in ("keep.py", "cache/a.py", "sub/b.pyc", "sub/c.py"):
+        path = tmp_path / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+
+    dir_paths, file_paths = files.walk_tree(
+        str(tmp_path),
+        ignore.IgnoreMatcher(["cache/", "*.pyc"]),
+    )
+
+    assert sorted(dir_paths) == ["sub"]
+    assert sorted(file_paths) == ["keep.py", "sub/c.py"]
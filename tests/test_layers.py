@@ -0,0 +1,103 @@
+"""Tests for installing from shared build stores behind the local root."""
+
+import os
+
+from pkg import build, constants, install, layers, registry, store
+
+
+def _use_root(monkeypatch, root_dir):
+    """Point the pkg roots at the given user's directory."""
+    for name, dir_name in (
+            ("PKGS_DIR", "pkgs"),
+            ("PKG_BUILDS_DIR", "builds"),
+            ("DEV_PKGS_DIR", "dev-pkgs"),
+            ("DEV_PKG_BUILDS_DIR", "dev-builds")):
+        path = os.path.join(root_dir, dir_name)
+        os.makedirs(path, exist_ok=True)
+        monkeypatch.setattr(constants, name, path)
+
+
+def test_install_pulls_build_from_other_root(
+        roots, make_package, monkeypatch, tmp_path):
+    """A build made in one root is pulled into another and shared there."""
+    _use_root(monkeypatch, str(tmp_path / "alice"))
+    for version in ("1.0", "1.1"):
+        assert build.run_build(
+            version,
+            False,
+            True,
+            src_dir=make_package("foo", version=version),
+        )
+    shared_builds_dir = constants.PKG_BUILDS_DIR
+
+    _use_root(monkeypatch, str(tmp_path / "bob"))
+    monkeypatch.setenv(constants.SHARED_BUILDS_ENV_VAR, shared_builds_dir)
+    builds_dir = constants.PKG_BUILDS_DIR
+    assert layers.get_builds_dirs(builds_dir) == [
+        builds_dir,
+        shared_builds_dir,
+    ]
+
+    versions, _ = install.resolve_dependencies(
+        "foo",
+        "latest",
+        builds_dir,
+        constants.PKGS_DIR,
+    )
+    assert versions == {"foo": "1.1"}
+    assert install.run_install("foo", "1.1", False, False, True)
+
+    local_build_dir = os.path.join(builds_dir, "foo", "1.1")
+    assert os.path.isdir(local_build_dir)
+    assert registry.get_install(constants.PKGS_DIR, "foo")["version"] == (
+        "1.1"
+    )
+    # pulled files are stored in the local store, not linked to the shared
+    # one, which may belong to another user
+    mod_path = os.path.join(local_build_dir, "sub", "mod.py")
+    shared_mod_path = os.path.join(shared_builds_dir, "foo", "1.1", "sub",
+                                   "mod.py")
+    assert not os.path.samefile(mod_path, shared_mod_path)
+    store_dir = store.get_store_dir(builds_dir)
+    assert any(
+        os.path.samefile(os.path.join(root, file_name), mod_path)
+        for root, _, file_names in os.walk(store_dir)
+        for file_name in file_names
+    )
+
+
+def test_shared_registry_is_not_written(
+        roots, make_package, monkeypatch, tmp_path):
+    """Resolving against a shared store never writes to it."""
+    _use_root(monkeypatch, str(tmp_path / "alice"))
+    assert build.run_build("1.0", False, True, src_dir=make_package("foo"))
+    shared_builds_dir = constants.PKG_BUILDS_DIR
+    registry_dir = os.path.join(shared_builds_dir, constants.REGISTRY_DIR_NAME)
+    for root, _, file_names in os.walk(registry_dir):
+        for file_name in file_names:
+            os.remove(os.path.join(root, file_name))
+
+    _use_root(monkeypatch, str(tmp_path / "bob"))
+    monkeypatch.setenv(constants.SHARED_BUILDS_ENV_VAR, shared_builds_dir)
+    assert layers.resolve_version(
+        layers.get_builds_dirs(constants.PKG_BUILDS_DIR),
+        "foo",
+        ">=1",
+    ) == "1.0"
+
+    assert [
+        file_name
+        for _, _, file_names in os.walk(registry_dir)
+        for file_name in file_names
+    ] == []
+
+
+def test_dev_builds_are_not_shared(roots, monkeypatch, tmp_path):
+    """Shared stores are only searched behind the pkg builds directory."""
+    monkeypatch.setenv(
+        constants.SHARED_BUILDS_ENV_VAR,
+        str(tmp_path / "shared"),
+    )
+    assert layers.get_builds_dirs(constants.DEV_PKG_BUILDS_DIR) == [
+        constants.DEV_PKG_BUILDS_DIR,
+    ]
@@ -0,0 +1,87 @@
+"""Tests for the registries of installs and builds."""
+
+import json
+import os
+
+from pkg import build, install, registry, utils
+
+
+def _rewrite_pkg_info(package_dir, **changes):
+    """Rewrite pkg-info in place, keeping its directory's mtime."""
+    dir_stat = os.stat(package_dir)
+    pkg_info_file, pkg_info = utils.get_package_info(package_dir)
+    pkg_info.update(changes)
+    with open(pkg_info_file, "w") as file_:
+        json.dump(pkg_info, file_)
+    os.utime(package_dir, ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+
+
+def test_installs_pick_up_pkg_info_rewritten_in_place(roots, make_package):
+    """Entries are re-read when pkg-info changes but its directory doesn't."""
+    assert build.run_build("1.0", False, True, src_dir=make_package("foo"))
+    assert install.run_install("foo", "1.0", False, False, True)
+    pkgs_dir = roots["PKGS_DIR"]
+    assert registry.get_installs(pkgs_dir)["foo"]["version"] == "1.0"
+
+    _rewrite_pkg_info(os.path.join(pkgs_dir, "foo"), owner="someone")
+
+    assert registry.get_installs(pkgs_dir)["foo"]["owner"] == "someone"
+    assert registry.get_install(pkgs_dir, "foo")["owner"] == "someone"
+
+
+def test_installs_pick_up_added_and_removed_packages(roots, make_package):
+    """Installs made or removed behind the registry's back are noticed."""
+    for name in ("foo", "bar"):
+        assert build.run_build("1.0", False, True, src_dir=make_package(name))
+    assert install.run_install("foo", "1.0", False, False, True)
+    pkgs_dir = roots["PKGS_DIR"]
+    assert list(registry.get_installs(pkgs_dir)) == ["foo"]
+
+    assert install.run_install("bar", "1.0", False, False, True)
+    assert sorted(registry.get_installs(pkgs_dir)) == ["bar", "foo"]
+
+    os.rename(os.path.join(pkgs_dir, "foo"), pkgs_dir + "-removed-foo")
+    assert list(registry.get_installs(pkgs_dir)) == ["bar"]
+    assert registry.get_install(pkgs_dir, "foo") is None
+
+
+def test_version_index_picks_up_version_info_changes(roots, make_package):
+    """Build entries are refreshed when version-info is edited in place."""
+    src_dir = make_package("foo")
+    assert build.run_build("1.0", False, True, src_dir=src_dir)
+    builds_dir = roots["PKG_BUILDS_DIR"]
+    build_dir = os.path.join(builds_dir, "foo", "1.0")
+    assert registry.get_builds(builds_dir, "foo")["1.0"]["comment"] == (
+        "release"
+    )
+
+    dir_stat = os.stat(build_dir)
+    version_info_file = utils.get_version_info_file(build_dir)
+    with open(version_info_file, "w") as file_:
+        file_.write("'1.0': patched\n")
+    os.utime(build_dir, ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+
+    assert registry.get_builds(builds_dir, "foo")["1.0"]["comment"] == (
+        "patched"
+    )
+
+
+def test_version_index_is_sorted_by_version(roots, make_package):
+    """Builds are indexed in version order, not directory order."""
+    for version in ("1.10", "1.2.0-rc1", "1.2", "1.9"):
+        assert build.run_build(
+            version,
+            False,
+            True,
+            src_dir=make_package("foo", version=version),
+        )
+    _, versions = registry.get_version_index(
+        roots["PKG_BUILDS_DIR"],
+        "foo",
+    )
+    assert versions == ["1.2.0-rc1", "1.2", "1.9", "1.10"]
+    assert registry.resolve_version(
+        roots["PKG_BUILDS_DIR"],
+        "foo",
+        "~1.2",
+    ) == "1.2"
@@ -0,0 +1,108 @@
+"""Tests for choosing and removing old builds with pkg gc."""
+
+from datetime import datetime
+import os
+
+from pkg import build, constants, install, registry, retention, utils
+
+
+def _build_at(make_package, version, build_time):
+    """Build version of foo, then record the given build time in it."""
+    assert build.run_build(
+        version,
+        False,
+        True,
+        src_dir=make_package("foo", version=version),
+    )
+    pkg_info_file, pkg_info = utils.get_package_info(
+        os.path.join(constants.PKG_BUILDS_DIR, "foo", version)
+    )
+    if build_time is None:
+        del pkg_info[constants.BUILD_TIME_KEY]
+    else:
+        pkg_info[constants.BUILD_TIME_KEY] = build_time
+    utils.write_package_info(pkg_info_file, pkg_info)
+
+
+def _make_builds(make_package):
+    """Build versions of foo at known times, oldest first."""
+    for version, build_time in (
+            ("1.0", "2020-01-01 00:00:00"),
+            ("1.1", "2020-06-01 00:00:00"),
+            ("2.0", "2021-01-01 00:00:00"),
+            ("2.1", "2021-06-01 00:00:00"),
+            ("0.1", None)):
+        _build_at(make_package, version, build_time)
+
+
+def test_keep_last(roots, make_package):
+    """The most recently built versions are kept."""
+    _make_builds(make_package)
+    assert retention.get_builds_to_remove(
+        roots["PKG_BUILDS_DIR"],
+        "foo",
+        keep_last=2,
+    ) == ["1.0", "1.1"]
+
+
+def test_keep_newer_than(roots, make_package):
+    """Builds on or after the date are kept."""
+    _make_builds(make_package)
+    assert retention.get_builds_to_remove(
+        roots["PKG_BUILDS_DIR"],
+        "foo",
+        keep_newer_than=datetime(2020, 6, 1),
+    ) == ["1.0"]
+
+
+def test_policies_keep_anything_either_keeps(roots, make_package):
+    """A build is only removed if no policy keeps it."""
+    _make_builds(make_package)
+    assert retention.get_builds_to_remove(
+        roots["PKG_BUILDS_DIR"],
+        "foo",
+        keep_last=1,
+        keep_newer_than=datetime(2021, 1, 1),
+    ) == ["1.0", "1.1"]
+
+
+def test_installed_versions_are_kept(roots, make_package):
+    """Builds of installed versions are never removed."""
+    _make_builds(make_package)
+    assert install.run_install("foo", "1.0", False, False, True)
+    assert retention.get_builds_to_remove(
+        roots["PKG_BUILDS_DIR"],
+        "foo",
+        keep_last=1,
+    ) == ["1.1", "2.0"]
+
+
+def test_equal_build_times_fall_back_to_version_order(roots, make_package):
+    """Higher versions count as more recent when built at the same time."""
+    for version in ("1.10", "1.9", "1.2.0-rc1", "1.2"):
+        _build_at(make_package, version, "2020-01-01 00:00:00")
+    assert retention.get_builds_to_remove(
+        roots["PKG_BUILDS_DIR"],
+        "foo",
+        keep_last=2,
+    ) == ["1.2.0-rc1", "1.2"]
+
+
+def test_remove_builds_updates_registry(roots, make_package):
+    """Removed builds are gone from disk and the registry."""
+    _make_builds(make_package)
+    builds_dir = roots["PKG_BUILDS_DIR"]
+
+    freed_bytes = retention.remove_builds(builds_dir, {"foo": ["1.0", "1.1"]})
+
+    assert freed_bytes > 0
+    assert sorted(os.listdir(os.path.join(builds_dir, "foo"))) == [
+        "0.1",
+        "2.0",
+        "2.1",
+    ]
+    assert sorted(registry.get_builds(builds_dir, "foo")) == [
+        "0.1",
+        "2.0",
+        "2.1",
+    ]
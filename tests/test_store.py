@@ -0,0 +1,89 @@
+"""Tests for the content-addressed object store."""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from pkg import store
+
+
+def _get_objects(store_dir):
+    """Get paths of all objects in store, excluding its lock file."""
+    return sorted(
+        os.path.join(root, file_name)
+        for root, _, file_names in os.walk(store_dir)
+        for file_name in file_names
+        if root != store_dir
+    )
+
+
+def test_link_file_shares_identical_contents(tmp_path):
+    """Files with the same contents and mode are linked to one object."""
+    store_dir = str(tmp_path / "store")
+    (tmp_path / "a").write_text("same")
+    (tmp_path / "b").write_text("same")
+    store.link_file(store_dir, str(tmp_path / "a"), str(tmp_path / "a2"))
+    store.link_file(store_dir, str(tmp_path / "b"), str(tmp_path / "b2"))
+
+    assert len(_get_objects(store_dir)) == 1
+    assert os.path.samefile(str(tmp_path / "a2"), str(tmp_path / "b2"))
+
+
+def test_concurrent_link_and_prune_keeps_linked_objects(tmp_path):
+    """Pruning while files are linked never removes a linked object."""
+    store_dir = str(tmp_path / "store")
+    src_dir = tmp_path / "src"
+    dest_dir = tmp_path / "dest"
+    src_dir.mkdir()
+    dest_dir.mkdir()
+    num_files = 200
+    for index in range(num_files):
+        # only a few distinct contents, so links race on the same objects
+        (src_dir / str(index)).write_text("contents {0}".format(index % 7))
+
+    def link(index):
+        store.link_file(
+            store_dir,
+            str(src_dir / str(index)),
+            str(dest_dir / str(index)),
+        )
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        prunes = [executor.submit(store.prune, store_dir) for _ in range(20)]
+        list(executor.map(link, range(num_files)))
+        for prune in prunes:
+            prune.result()
+    store.prune(store_dir)
+
+    for index in range(num_files):
+        dest_path = str(dest_dir / str(index))
+        assert open(dest_path).read() == "contents {0}".format(index % 7)
+        assert os.stat(dest_path).st_nlink >= 2
+    assert len(_get_objects(store_dir)) == 7
+
+
+def test_prune_removes_unlinked_objects(tmp_path):
+    """Objects whose only link is in the store are pruned."""
+    store_dir = str(tmp_path / "store")
+    (tmp_path / "a").write_text("kept")
+    (tmp_path / "b").write_text("removed")
+    store.link_file(store_dir, str(tmp_path / "a"), str(tmp_path / "a2"))
+    store.link_file(store_dir, str(tmp_path / "b"), str(tmp_path / "b2"))
+    os.remove(str(tmp_path / "b2"))
+
+    assert store.prune(store_dir) == len("removed")
+    objects = _get_objects(store_dir)
+    assert len(objects) == 1
+    assert os.path.samefile(objects[0], str(tmp_path / "a2"))
+
+
+def test_add_file_replaces_object_edited_in_place(tmp_path):
+    """An object changed through one of its links isn't linked again."""
+    store_dir = str(tmp_path / "store")
+    (tmp_path / "a").write_text("original")
+    store.link_file(store_dir, str(tmp_path / "a"), str(tmp_path / "a2"))
+    with open(str(tmp_path / "a2"), "a") as file_:
+        file_.write(" edited")
+
+    store.link_file(store_dir, str(tmp_path / "a"), str(tmp_path / "a3"))
+
+    assert open(str(tmp_path / "a3")).read() == "original"
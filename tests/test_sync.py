@@ -0,0 +1,110 @@
+"""Tests for incremental syncs of package directories."""
+
+import os
+
+from pkg import build, constants, manifest, utils, watch
+
+
+def _sync(src_dir, dest_dir):
+    """Incrementally sync directories with the default ignore patterns."""
+    return utils.sync_directory(
+        str(src_dir),
+        str(dest_dir),
+        utils.get_ignore_matcher([]),
+    )
+
+
+def test_sync_directory_only_copies_changes(tmp_path):
+    """Unchanged files are skipped, and removed files are deleted."""
+    src_dir = tmp_path / "src"
+    dest_dir = tmp_path / "dest"
+    (src_dir / "sub").mkdir(parents=True)
+    (src_dir / "a.py").write_text("a")
+    (src_dir / "sub" / "b.py").write_text("b")
+    (src_dir / "c.pyc").write_text("ignored")
+
+    strategies, num_removed = _sync(src_dir, dest_dir)
+    assert (len(strategies), num_removed) == (2, 0)
+    assert not (dest_dir / "c.pyc").exists()
+
+    strategies, num_removed = _sync(src_dir, dest_dir)
+    assert (len(strategies), num_removed) == (0, 0)
+
+    (src_dir / "a.py").write_text("changed")
+    os.remove(str(src_dir / "sub" / "b.py"))
+    os.rmdir(str(src_dir / "sub"))
+    strategies, num_removed = _sync(src_dir, dest_dir)
+    assert (len(strategies), num_removed) == (1, 1)
+    assert (dest_dir / "a.py").read_text() == "changed"
+    assert not (dest_dir / "sub").exists()
+
+
+def test_sync_directory_hashes_touched_files(tmp_path):
+    """A touched file with the same contents isn't copied again."""
+    src_dir = tmp_path / "src"
+    dest_dir = tmp_path / "dest"
+    src_dir.mkdir()
+    (src_dir / "a.py").write_text("a")
+    _sync(src_dir, dest_dir)
+
+    src_stat = os.stat(str(src_dir / "a.py"))
+    os.utime(
+        str(src_dir / "a.py"),
+        ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns + 10 ** 9),
+    )
+    strategies, _ = _sync(src_dir, dest_dir)
+    assert strategies == []
+
+
+def test_incremental_build_matches_full_build(roots, make_package):
+    """An incremental rebuild picks up changed, added and removed files."""
+    src_dir = make_package("foo")
+    assert build.run_build("1.0", False, True, incremental=True,
+                           src_dir=src_dir)
+    with open(os.path.join(src_dir, "sub", "mod.py"), "w") as file_:
+        file_.write("x = 2\n")
+    with open(os.path.join(src_dir, "new.py"), "w") as file_:
+        file_.write("")
+    os.remove(os.path.join(src_dir, "__init__.py"))
+    assert build.run_build("1.0", False, True, incremental=True,
+                           src_dir=src_dir)
+
+    build_dir = os.path.join(roots["PKG_BUILDS_DIR"], "foo", "1.0")
+    build_manifest = manifest.read_manifest(build_dir)
+    assert sorted(build_manifest) == [
+        "new.py",
+        "sub/mod.py",
+        constants.VERSION_INFO_FILE_NAME,
+    ]
+    with open(os.path.join(build_dir, "sub", "mod.py")) as file_:
+        assert file_.read() == "x = 2\n"
+
+
+def test_sync_changes_replaces_directory_with_file(roots, make_package):
+    """A directory replaced by a file is dropped from the manifest."""
+    src_dir = make_package("foo", version=constants.DEFAULT_DEV_VERSION)
+    assert build.run_build(constants.DEFAULT_DEV_VERSION, True, True,
+                           src_dir=src_dir)
+    os.remove(os.path.join(src_dir, "sub", "mod.py"))
+    os.rmdir(os.path.join(src_dir, "sub"))
+    with open(os.path.join(src_dir, "sub"), "w") as file_:
+        file_.write("now a file")
+
+    num_copied, num_removed = watch.sync_changes(
+        src_dir,
+        "foo",
+        constants.DEFAULT_DEV_VERSION,
+        utils.get_ignore_matcher([]),
+        {"sub"},
+    )
+
+    build_dir = os.path.join(
+        roots["DEV_PKG_BUILDS_DIR"],
+        "foo",
+        constants.DEFAULT_DEV_VERSION,
+    )
+    assert (num_copied, num_removed) == (1, 1)
+    assert os.path.isfile(os.path.join(build_dir, "sub"))
+    build_manifest = manifest.read_manifest(build_dir)
+    assert "sub" in build_manifest
+    assert "sub/mod.py" not in build_manifest
@@ -0,0 +1,91 @@
+"""Tests for moving removed trees to the trash and purging them."""
+
+import os
+import time
+
+from pkg import purge, store, trash
+
+
+def _make_tree(path):
+    """Make small directory tree at path."""
+    os.makedirs(os.path.join(path, "sub"))
+    with open(os.path.join(path, "sub", "file.txt"), "w") as file_:
+        file_.write("contents")
+
+
+def test_remove_tree_deletes_in_place_by_default(roots):
+    """Library callers get trees deleted before remove_tree returns."""
+    tree_dir = os.path.join(roots["PKGS_DIR"], "foo")
+    _make_tree(tree_dir)
+
+    trash.remove_tree(tree_dir)
+
+    assert not os.path.exists(tree_dir)
+    assert not os.path.exists(trash.get_trash_dir(roots["PKGS_DIR"]))
+
+
+def test_background_remove_moves_tree_to_trash(roots):
+    """Trees are only moved once background deletes are enabled."""
+    trash.enable_background_deletes()
+    tree_dir = os.path.join(roots["PKGS_DIR"], "foo")
+    _make_tree(tree_dir)
+
+    trash.remove_tree(tree_dir)
+
+    assert not os.path.exists(tree_dir)
+    trash_dir = trash.get_trash_dir(roots["PKGS_DIR"])
+    assert len(os.listdir(trash_dir)) == 1
+    assert purge.run_purge([roots["PKGS_DIR"]]) == 1
+    assert os.listdir(trash_dir) == []
+
+
+def test_tree_outside_roots_is_deleted_in_place(roots, tmp_path):
+    """Trees that aren't in a pkg root have no trash to go to."""
+    trash.enable_background_deletes()
+    tree_dir = str(tmp_path / "elsewhere")
+    _make_tree(tree_dir)
+
+    trash.remove_tree(tree_dir)
+
+    assert not os.path.exists(tree_dir)
+    trash.start_purge()
+
+
+def test_purge_prunes_store_of_trashed_builds(roots):
+    """Store objects only used by a purged build are removed."""
+    builds_dir = roots["PKG_BUILDS_DIR"]
+    store_dir = store.get_store_dir(builds_dir)
+    build_dir = os.path.join(builds_dir, "foo", "1.0")
+    os.makedirs(build_dir)
+    src_path = os.path.join(roots["PKGS_DIR"], "src.txt")
+    with open(src_path, "w") as file_:
+        file_.write("stored")
+    store.link_file(store_dir, src_path, os.path.join(build_dir, "file.txt"))
+
+    assert trash.move_to_trash(build_dir)
+    assert purge.run_purge([builds_dir]) == 1
+
+    assert [
+        file_name
+        for root, _, file_names in os.walk(store_dir)
+        for file_name in file_names
+        if root != store_dir
+    ] == []
+
+
+def test_start_purge_empties_trash_in_background(roots):
+    """A single detached purge process empties the trashed roots."""
+    trash.enable_background_deletes()
+    for name in ("foo", "bar"):
+        tree_dir = os.path.join(roots["PKGS_DIR"], name)
+        _make_tree(tree_dir)
+        trash.remove_tree(tree_dir)
+    trash_dir = trash.get_trash_dir(roots["PKGS_DIR"])
+    assert len(os.listdir(trash_dir)) == 2
+
+    trash.start_purge()
+
+    deadline = time.time() + 30
+    while os.listdir(trash_dir) and time.time() < deadline:
+        time.sleep(0.05)
+    assert os.listdir(trash_dir) == []
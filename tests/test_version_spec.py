@@ -0,0 +1,95 @@
+"""Tests for version ordering and version spec resolution."""
+
+import pytest
+
+from pkg import utils, version_spec
+
+
+VERSIONS = [
+    "0.9",
+    "1.0",
+    "1.2.0-rc1",
+    "1.2.0",
+    "1.2.5",
+    "1.3.0-rc1",
+    "1.3",
+    "1.10",
+    "2.0",
+]
+
+
+def _get_index(versions):
+    """Get sorted version index, as stored in the build registry."""
+    index = sorted(
+        (version_spec.get_version_key(version), version)
+        for version in versions
+    )
+    return [key for key, _ in index], [version for _, version in index]
+
+
+def test_versions_sort_numerically_with_prereleases_first():
+    """Parts compare as numbers, and pre-releases below their release."""
+    assert sorted(
+        ["1.10", "1.2.0", "1.2.0-rc10", "1.2.0-rc2", "1.2.0-beta", "1.9"],
+        key=version_spec.get_version_key,
+    ) == ["1.2.0-beta", "1.2.0-rc2", "1.2.0-rc10", "1.2.0", "1.9", "1.10"]
+
+
+def test_trailing_zeros_compare_equal():
+    """1.2 and 1.2.0 are the same version."""
+    assert (
+        version_spec.get_version_key("1.2")
+        == version_spec.get_version_key("1.2.0")
+    )
+
+
+def test_numeric_suffix_is_not_a_prerelease():
+    """A number after a - is another part of the release."""
+    assert sorted(
+        ["1.2-3", "1.2"],
+        key=version_spec.get_version_key,
+    ) == ["1.2", "1.2-3"]
+
+
+@pytest.mark.parametrize("spec, expected", [
+    ("latest", "2.0"),
+    ("1.2.5", "1.2.5"),
+    (">=1.2,<1.2.9", "1.2.5"),
+    ("<1.3", "1.3.0-rc1"),
+    ("~1.2", "1.2.5"),
+    ("~1", "1.10"),
+    ("<1.2", "1.2.0-rc1"),
+    (">1.2,!=1.2.5,<1.3", "1.3.0-rc1"),
+    ("==1.3", "1.3"),
+    (">2", None),
+])
+def test_resolve(spec, expected):
+    """The highest version matching the spec is picked."""
+    keys, versions = _get_index(VERSIONS)
+    assert version_spec.resolve(spec, keys, versions) == expected
+
+
+def test_tilde_excludes_prereleases_of_upper_bound():
+    """~1.2 stops below every pre-release of 1.3."""
+    keys, versions = _get_index(VERSIONS)
+    assert version_spec.filter_versions("~1.2", keys, versions) == [
+        "1.2.0",
+        "1.2.5",
+    ]
+
+
+@pytest.mark.parametrize("spec", [">=", "~a.b", ">=1,~2", "=>1"])
+def test_invalid_specs_raise(spec):
+    """Malformed specs raise PkgError."""
+    keys, versions = _get_index(VERSIONS)
+    with pytest.raises(utils.PkgError):
+        version_spec.resolve(spec, keys, versions)
+
+
+def test_matches():
+    """Exact versions only match themselves, and None matches anything."""
+    assert version_spec.matches("1.2", None)
+    assert version_spec.matches("1.2", "1.2")
+    assert not version_spec.matches("1.2.0", "1.2")
+    assert version_spec.matches("1.2.0", ">=1.2")
+    assert not version_spec.matches("1.3.0-rc1", "~1.2")
@@ -0,0 +1,213 @@
+"""Timing instrumentation for pkg commands.
+
+Spans record how long each phase of a command takes (reading metadata,
+matching ignore patterns, copying, deleting, writing pkg-info, waiting at
+prompts), and counters record how much work was done (files and bytes
+copied, trees deleted). Nothing is recorded unless enable has been called,
+so instrumented functions only pay for a flag check the rest of the time.
+
+Spans are recorded from every thread, so the totals of phases run on
+thread pools can add up to more than the wall-clock time of the command.
+Recorded spans can be printed as a summary table, or written as a Chrome
+trace file to view in chrome://tracing or Perfetto.
+"""
+
+from collections import Counter, OrderedDict
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+
+_STATE = {"enabled": False, "start_ns": 0}
+_LOCK = threading.Lock()
+# each span is (name, start_ns, duration_ns, thread id, args)
+_SPANS = []
+# total duration and call count of phases too fine-grained to record as spans
+_TOTALS = OrderedDict()
+_COUNTERS = Counter()
+
+
+def enable():
+    """Start recording spans and counters, clearing any already recorded."""
+    with _LOCK:
+        del _SPANS[:]
+        _TOTALS.clear()
+        _COUNTERS.clear()
+        _STATE["start_ns"] = time.perf_counter_ns()
+        _STATE["enabled"] = True
+
+
+def disable():
+    """Stop recording spans and counters."""
+    _STATE["enabled"] = False
+
+
+def is_enabled():
+    """Check whether spans and counters are being recorded.
+
+    Returns:
+        (bool): whether recording is enabled.
+    """
+    return _STATE["enabled"]
+
+
+@contextlib.contextmanager
+def span(name, **args):
+    """Record time taken by the code in this context.
+
+    Args:
+        name (str): name of phase.
+        args (dict): extra info to show with the span in traces.
+    """
+    if not _STATE["enabled"]:
+        yield
+        return
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter_ns() - start
+        _SPANS.append((name, start, duration, threading.get_ident(), args))
+
+
+def timed(name):
+    """Decorate function to record a span for each call.
+
+    Args:
+        name (str): name of phase.
+
+    Returns:
+        (function): decorator.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapped(*args, **kwargs):
+            if not _STATE["enabled"]:
+                return function(*args, **kwargs)
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def add_total(name, duration_ns, calls):
+    """Add to total time of a phase without recording individual spans.
+
+    Args:
+        name (str): name of phase.
+        duration_ns (int): nanoseconds taken.
+        calls (int): number of calls the duration covers.
+    """
+    if not _STATE["enabled"]:
+        return
+    with _LOCK:
+        total_ns, total_calls = _TOTALS.get(name, (0, 0))
+        _TOTALS[name] = (total_ns + duration_ns, total_calls + calls)
+
+
+def count(name, value=1):
+    """Add to counter.
+
+    Args:
+        name (str): name of counter.
+        value (int): amount to add.
+    """
+    if not _STATE["enabled"]:
+        return
+    with _LOCK:
+        _COUNTERS[name] += value
+
+
+def get_summary():
+    """Get total time and call count of each recorded phase.
+
+    Returns:
+        (OrderedDict(str, tuple(int, int, int))): total nanoseconds, number of
+            calls and longest call in nanoseconds of each phase, in order of
+            total time. The longest call is None for phases recorded with
+            add_total.
+    """
+    totals = {}
+    for name, _, duration, _, _ in list(_SPANS):
+        total_ns, calls, max_ns = totals.get(name, (0, 0, 0))
+        totals[name] = (total_ns + duration, calls + 1, max(max_ns, duration))
+    with _LOCK:
+        for name, (total_ns, calls) in _TOTALS.items():
+            totals[name] = (total_ns, calls, None)
+    return OrderedDict(
+        sorted(totals.items(), key=lambda item: item[1][0], reverse=True)
+    )
+
+
+def format_summary():
+    """Format summary table of recorded phases and counters.
+
+    Returns:
+        (str): summary table.
+    """
+    elapsed_ns = time.perf_counter_ns() - _STATE["start_ns"]
+    lines = [
+        " Timings ({0:.1f}ms elapsed)".format(elapsed_ns / 1e6),
+        " -------",
+        " {0:<24}{1:>8}{2:>12}{3:>12}{4:>12}".format(
+            "phase", "calls", "total ms", "mean ms", "max ms"
+        ),
+    ]
+    for name, (total_ns, calls, max_ns) in get_summary().items():
+        lines.append(" {0:<24}{1:>8}{2:>12.2f}{3:>12.3f}{4:>12}".format(
+            name,
+            calls,
+            total_ns / 1e6,
+            total_ns / 1e6 / calls,
+            "-" if max_ns is None else "{0:.3f}".format(max_ns / 1e6),
+        ))
+    with _LOCK:
+        counters = sorted(_COUNTERS.items())
+    if counters:
+        lines.extend(["", " {0:<24}{1:>8}".format("counter", "value")])
+        lines.extend(
+            " {0:<24}{1:>8}".format(name, value) for name, value in counters
+        )
+    return "\n".join(lines)
+
+
+def write_trace(trace_file):
+    """Write recorded spans and counters as Chrome trace json.
+
+    Args:
+        trace_file (str): path to write trace to.
+    """
+    pid = os.getpid()
+    start_ns = _STATE["start_ns"]
+    events = [
+        {
+            "name": name,
+            "ph": "X",
+            "ts": (span_start - start_ns) / 1e3,
+            "dur": duration / 1e3,
+            "pid": pid,
+            "tid": thread_id,
+            "args": args,
+        }
+        for name, span_start, duration, thread_id, args in list(_SPANS)
+    ]
+    with _LOCK:
+        other_data = {
+            "counters": dict(_COUNTERS),
+            "totals_ms": dict(
+                (name, total_ns / 1e6)
+                for name, (total_ns, _) in _TOTALS.items()
+            ),
+        }
+    with open(trace_file, "w") as file_:
+        json.dump(
+            {
+                "traceEvents": events,
+                "displayTimeUnit": "ms",
+                "otherData": other_data,
+            },
+            file_,
+        )
@@ -0,0 +1,224 @@
+"""Background deletion of package trees.
+
+Rather than deleting trees in place, the pkg command renames them into a
+trash directory at the top of their pkg root, which is instant since it's
+on the same filesystem. Once the command has finished, a single detached
+pkg-purge process is started to delete the contents of the trash of each
+root it trashed trees in, so commands don't have to wait for deletes to
+finish. Anything left in the trash by an interrupted purge is deleted by
+the next one.
+
+Background deletes are only used once enabled with
+enable_background_deletes, which the pkg command does, so that library
+callers delete trees before returning unless they opt in, and then call
+start_purge themselves.
+"""
+
+import os
+import stat
+import threading
+
+from pkg import constants, timings
+
+
+# whether trees are moved to the trash rather than deleted in place, and the
+# roots that trees have been moved to the trash of since the last purge
+_BACKGROUND_STATE = {"enabled": False, "root_dirs": set()}
+_BACKGROUND_LOCK = threading.Lock()
+
+
+def get_root_dirs():
+    """Get all pkg root directories.
+
+    Returns:
+        (list(str)): install and build directories.
+    """
+    return [
+        constants.PKGS_DIR,
+        constants.PKG_BUILDS_DIR,
+        constants.DEV_PKGS_DIR,
+        constants.DEV_PKG_BUILDS_DIR,
+    ]
+
+
+def get_trash_dir(root_dir):
+    """Get trash directory for given pkg root.
+
+    Args:
+        root_dir (str): install or build directory.
+
+    Returns:
+        (str): path to trash directory.
+    """
+    return os.path.join(root_dir, constants.TRASH_DIR_NAME)
+
+
+def _get_root_dir(path):
+    """Get pkg root directory containing path.
+
+    Args:
+        path (str): path to find root for.
+
+    Returns:
+        (str or None): root directory, if path is in one.
+    """
+    path = os.path.abspath(path)
+    for root_dir in get_root_dirs():
+        root_dir = os.path.abspath(root_dir)
+        if path.startswith(root_dir + os.sep):
+            return root_dir
+    return None
+
+
+def enable_background_deletes():
+    """Move removed trees to the trash, rather than deleting them in place.
+
+    start_purge must be called once the trees have been removed, to delete
+    them.
+    """
+    with _BACKGROUND_LOCK:
+        _BACKGROUND_STATE["enabled"] = True
+
+
+@timings.timed("remove_tree")
+def remove_tree(path, background=True):
+    """Remove directory tree, deleting it in the background if possible.
+
+    Trees are only deleted in the background once background deletes have
+    been enabled, and are left in the trash until start_purge is called.
+
+    Args:
+        path (str): path to directory to remove.
+        background (bool): if False, delete the tree before returning.
+    """
+    if not background or not _BACKGROUND_STATE["enabled"]:
+        delete_tree(path)
+        return
+    root_dir = _get_root_dir(path)
+    if move_to_trash(path) is None:
+        delete_tree(path)
+        return
+    with _BACKGROUND_LOCK:
+        _BACKGROUND_STATE["root_dirs"].add(root_dir)
+
+
+def move_to_trash(path):
+    """Move directory tree into the trash of its pkg root.
+
+    Args:
+        path (str): path to directory to move.
+
+    Returns:
+        (str or None): path of tree in the trash, or None if it couldn't be
+            moved, eg. it's not in a pkg root or is on a different filesystem
+            to the trash.
+    """
+    root_dir = _get_root_dir(path)
+    if root_dir is None:
+        return None
+    trash_dir = get_trash_dir(root_dir)
+    trash_path = os.path.join(
+        trash_dir,
+        "{0}-{1}".format(os.path.basename(path), os.urandom(16).hex()),
+    )
+    try:
+        if not os.path.isdir(trash_dir):
+            os.makedirs(trash_dir, exist_ok=True)
+        os.rename(path, trash_path)
+    except OSError:
+        return None
+    return trash_path
+
+
+def start_purge():
+    """Start detached process to empty trashes that trees were moved to.
+
+    Only one process is started for all the trees removed since the last
+    purge was started, and none if no trees were moved to the trash.
+    """
+    with _BACKGROUND_LOCK:
+        root_dirs = sorted(_BACKGROUND_STATE["root_dirs"])
+        _BACKGROUND_STATE["root_dirs"].clear()
+    if not root_dirs:
+        return
+    # imported here, as this module is imported by every pkg command
+    import subprocess
+    import sys
+
+    # the package may not be importable from the purge process's default
+    # path, eg. when run from a checkout
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] + [
+            path for path in env.get("PYTHONPATH", "").split(os.pathsep)
+            if path
+        ]
+    )
+    subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            __package__,
+            constants.PURGE,
+        ] + root_dirs,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env=env,
+        close_fds=True,
+        start_new_session=True,
+    )
+
+
+def empty_trash(root_dir):
+    """Delete everything in trash directory of given pkg root.
+
+    Args:
+        root_dir (str): install or build directory.
+
+    Returns:
+        (int): number of trees deleted.
+    """
+    trash_dir = get_trash_dir(root_dir)
+    if not os.path.isdir(trash_dir):
+        return 0
+    num_deleted = 0
+    for name in os.listdir(trash_dir):
+        delete_tree(os.path.join(trash_dir, name))
+        num_deleted += 1
+    return num_deleted
+
+
+@timings.timed("delete_tree")
+def delete_tree(path):
+    """Delete directory tree immediately.
+
+    Errors from files that have already been deleted (eg. by another purge
+    running at the same time) are ignored.
+
+    Args:
+        path (str): path to delete.
+    """
+    # imported here, as this module is imported by every pkg command,
+    # including ones that never delete trees
+    import shutil
+
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, onerror=_on_delete_error)
+    elif os.path.lexists(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _on_delete_error(func, path, exc_info):
+    """Function to call if shutil.rmtree errors when deleting trees."""
+    if isinstance(exc_info[1], FileNotFoundError):
+        return
+    # path contains the path of the file that couldn't be removed
+    try:
+        os.chmod(path, stat.S_IWRITE)
+        func(path)
+    except FileNotFoundError:
+        pass
@@ -2,9 +2,8 @@
 
 
 import os
-import shutil
 
-from pkg import constants, utils
+from pkg import constants, registry, trash, utils
 
 
 def add_subparser_command(subparser):
@@ -40,6 +39,29 @@ def add_subparser_command(subparser):
     )
 
 
+def is_installed_version(pkgs_dir, pkg_name, version):
+    """Check whether version of package is the one currently installed.
+
+    Builds of installed versions mustn't be removed, so the pkg-info of the
+    install is read directly rather than trusting the registry.
+
+    Args:
+        pkgs_dir (str): install directory.
+        pkg_name (str): name of package.
+        version (str): version to check.
+
+    Returns:
+        (bool): whether version is installed.
+    """
+    _, installed_pkg_info = utils.get_package_info(
+        os.path.join(pkgs_dir, pkg_name),
+        print_on_error=False,
+    )
+    if not installed_pkg_info:
+        return False
+    return installed_pkg_info.get(constants.VERSION_KEY) == version
+
+
 def main(args):
     """Unbuild package based on commandline args.
 
@@ -67,23 +89,16 @@ def main(args):
         )
         return
 
-    installed_pkg_path = os.path.join(pkgs_dir, args.pkg_name)
-    _, installed_pkg_info = utils.get_package_info(
-        installed_pkg_path,
-        print_on_error=False,
-    )
-    if installed_pkg_info:
-        installed_version = installed_pkg_info.get(constants.VERSION_KEY)
-        if installed_version == args.version:
-            utils.print_error(
-                "Cannot unbuild the version {0} build for package {1} "
-                "as this version is currently installed. Run a pkg "
-                "uninstall first".format(
-                    args.version,
-                    args.pkg_name,
-                )
+    if is_installed_version(pkgs_dir, args.pkg_name, args.version):
+        utils.print_error(
+            "Cannot unbuild the version {0} build for package {1} "
+            "as this version is currently installed. Run a pkg "
+            "uninstall first".format(
+                args.version,
+                args.pkg_name,
             )
-            return
+        )
+        return
 
     continue_unbuild = args.f or utils.prompt_user_confirmation(
         "{0} package with version {1} found in {2}.\nContinue uninstall? "
@@ -99,5 +114,7 @@ def main(args):
         print ("Aborting.")
         return
 
-    shutil.rmtree(pkg_version_dir, onerror=utils.on_rmtree_error)
+    # unused store objects are pruned once the tree has been deleted
+    trash.remove_tree(pkg_version_dir)
+    registry.update_build(pkg_builds_dir, args.pkg_name, args.version)
     print (success_message)
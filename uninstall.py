@@ -1,9 +1,8 @@
 """pkg-uninstall command."""
 
 import os
-import shutil
 
-from pkg import constants, utils
+from pkg import constants, registry, trash, utils
 
 
 def add_subparser_command(subparser):
@@ -70,5 +69,7 @@ def main(args):
         print ("Aborting.")
         return
 
-    shutil.rmtree(pkg_path, onerror=utils.on_rmtree_error)
+    root_mtime = registry.get_root_mtime(pkgs_dir)
+    trash.remove_tree(pkg_path)
+    registry.update_install(pkgs_dir, args.pkg_name, root_mtime)
     print (success_message)
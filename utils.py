@@ -1,19 +1,52 @@
-"""Util functions for all pkg scripts."""
+"""Util functions for all pkg scripts.
 
+Quick commands like pkg query only use a few of these functions, so modules
+that are slow to import (yaml, six, shutil, hashlib and the pkg modules for
+copying and deleting trees) are imported by the functions that use them
+rather than at the top of this module.
+"""
+
+import contextlib
+import functools
 import json
 import os
-import six
-import shutil
 import stat
-import yaml
+import threading
 
-from pkg import constants
+from pkg import constants, timings
 
 
 class PkgError(Exception):
     """Exception class for any package errors."""
 
 
+# prompts may come from several packages being processed at once
+_PROMPT_LOCK = threading.Lock()
+
+# errors collected in each thread by capture_errors, instead of printed
+_THREAD_STATE = threading.local()
+
+
+@contextlib.contextmanager
+def capture_errors():
+    """Collect error messages in the current thread instead of printing them.
+
+    Prompts are also declined rather than shown, with the prompt message
+    collected as an error, so that pkg functions can be run without a user
+    at the console.
+
+    Yields:
+        (list(str)): list that error messages are added to.
+    """
+    old_errors = getattr(_THREAD_STATE, "errors", None)
+    _THREAD_STATE.errors = []
+    try:
+        yield _THREAD_STATE.errors
+    finally:
+        _THREAD_STATE.errors = old_errors
+
+
+@timings.timed("prompt")
 def prompt_user_confirmation(
         message,
         confirmation_chars=('y', ''),
@@ -29,21 +62,34 @@ def prompt_user_confirmation(
     Returns:
         (bool): whether or not user has confirmed.
     """
+    errors = getattr(_THREAD_STATE, "errors", None)
+    if errors is not None:
+        errors.append("Declined prompt: " + message)
+        return False
+
+    import six
+
     answer = None
-    while answer not in accepted_chars:
-        # six.moves.input is called input in python3, raw_input in python2
-        answer = six.moves.input(message).lower()
+    with _PROMPT_LOCK:
+        while answer not in accepted_chars:
+            # six.moves.input is called input in python3, raw_input in python2
+            answer = six.moves.input(message).lower()
     return answer in confirmation_chars
 
 
-def print_error(message, *format_args):
+def print_error(message, *format_args, output=None):
     """Print error message to console.
 
     Args:
         message (str): error message to print.
         format_args (list(str)): additional args to pass to format function.
+        output (file or None): stream to print to. If None, print to stdout.
     """
-    print ("[ERROR] " + message.format(*format_args))
+    errors = getattr(_THREAD_STATE, "errors", None)
+    if errors is not None:
+        errors.append(message.format(*format_args))
+        return
+    print ("[ERROR] " + message.format(*format_args), file=output)
 
 
 def raise_error(message, *format_args):
@@ -68,6 +114,7 @@ def get_package_info_file(package_dir):
     return os.path.join(package_dir, constants.PKG_INFO_FILE_NAME)
 
 
+@timings.timed("get_package_info")
 def get_package_info(package_dir, print_on_error=True):
     """Get package info dict from package directory.
 
@@ -101,6 +148,23 @@ def get_package_info(package_dir, print_on_error=True):
             return None, None
 
 
+@timings.timed("write_package_info")
+def write_package_info(pkg_info_file, pkg_info):
+    """Write pkg info dict to file.
+
+    Any existing file is removed rather than overwritten, so that writing
+    never modifies a file that is hardlinked elsewhere (eg. into the store).
+
+    Args:
+        pkg_info_file (str): path of pkg-info file to write.
+        pkg_info (dict): pkg-info dictionary.
+    """
+    if os.path.isfile(pkg_info_file):
+        os.remove(pkg_info_file)
+    with open(pkg_info_file, "w") as file_:
+        json.dump(pkg_info, file_, indent=4)
+
+
 def get_version_info_file(package_dir):
     """Get version info file for given package directory.
 
@@ -113,6 +177,7 @@ def get_version_info_file(package_dir):
     return os.path.join(package_dir, constants.VERSION_INFO_FILE_NAME)
 
 
+@timings.timed("get_version_info")
 def get_version_info(package_dir):
     """Get version info dict from package directory.
 
@@ -124,69 +189,418 @@ def get_version_info(package_dir):
         (dict or None): dict from version info file, or None if file couldn't
             be read or doesn't exist.
     """
+    import yaml
+
     version_info_file = get_version_info_file(package_dir)
     if not os.path.isfile(version_info_file):
         return None, None
 
+    # libyaml's parser is much faster than the pure python one, where available
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
     with open(version_info_file, "r") as file_:
         try:
-            return version_info_file, yaml.safe_load(file_)
+            return version_info_file, yaml.load(file_, Loader=loader)
         except yaml.YAMLError:
             return None, None
 
 
+def confirm_overwrite(dest_dir, pkg_name, dev_mode, force, output=None):
+    """Check whether to continue if package directory already exists.
+
+    Args:
+        dest_dir (str): path to destination directory.
+        pkg_name (str): name of package.
+        dev_mode (str): if True, we're in dev mode.
+        force (bool): whether to force overwrite if the dest_dir already
+            exists.
+        output (file or None): stream to print progress to. If None, print
+            to stdout.
+
+    Returns:
+        (bool): whether to continue.
+    """
+    if not os.path.isdir(dest_dir) or force:
+        return True
+    continue_build = prompt_user_confirmation(
+        "{0}{1} package already exists. Overwrite? [Y|n]".format(
+            pkg_name,
+            " dev" if dev_mode else ""
+        ),
+        confirmation_chars=['y', ''],
+        accepted_chars=['y', 'n', ''],
+    )
+    if not continue_build:
+        print ("Aborting.", file=output)
+    return continue_build
+
+
+def get_staging_dir(dest_dir, suffix="staging"):
+    """Get temporary directory to stage changes to a directory in.
+
+    Staging directories are hidden siblings of the directory, so they're on
+    the same filesystem and can be renamed into place.
+
+    Args:
+        dest_dir (str): path to directory.
+        suffix (str): suffix to identify what the directory is used for.
+
+    Returns:
+        (str): path to staging directory, unique to this process.
+    """
+    return os.path.join(
+        os.path.dirname(dest_dir),
+        ".{0}.{1}-{2}".format(os.path.basename(dest_dir), suffix, os.getpid()),
+    )
+
+
+def clear_stale_staging_dirs(dest_dir):
+    """Remove staging directories left behind by interrupted processes.
+
+    Args:
+        dest_dir (str): path to directory that was being staged.
+    """
+    from pkg import trash
+
+    parent_dir = os.path.dirname(dest_dir)
+    prefix = ".{0}.".format(os.path.basename(dest_dir))
+    if not os.path.isdir(parent_dir):
+        return
+    for name in os.listdir(parent_dir):
+        if not name.startswith(prefix):
+            continue
+        pid = name.rpartition("-")[2]
+        if not pid.isdigit() or _is_process_running(int(pid)):
+            continue
+        trash.remove_tree(os.path.join(parent_dir, name))
+
+
+def _is_process_running(pid):
+    """Check if process with given id is running.
+
+    Args:
+        pid (int): process id.
+
+    Returns:
+        (bool): whether process is running.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # eg. process exists but is owned by someone else
+        return True
+    return True
+
+
+@timings.timed("swap_directory")
+def swap_directory(src_dir, dest_dir):
+    """Move directory into place, replacing any existing directory.
+
+    Where the platform supports it the two directories are exchanged in a
+    single atomic rename, otherwise the existing directory is renamed out
+    of the way first. Either way dest_dir is never partially written. The
+    old tree is removed afterwards.
+
+    Args:
+        src_dir (str): directory to move into place.
+        dest_dir (str): path to move it to. Must be on the same filesystem.
+    """
+    from pkg import trash
+
+    if not os.path.lexists(dest_dir):
+        os.rename(src_dir, dest_dir)
+        return
+    if _exchange_paths(src_dir, dest_dir):
+        old_dir = src_dir
+    else:
+        old_dir = get_staging_dir(dest_dir, "old")
+        os.rename(dest_dir, old_dir)
+        os.rename(src_dir, dest_dir)
+    trash.remove_tree(old_dir)
+
+
+def _exchange_paths(path_a, path_b):
+    """Atomically exchange two paths, using renameat2 where available.
+
+    Args:
+        path_a (str): first path.
+        path_b (str): second path.
+
+    Returns:
+        (bool): whether the paths were exchanged.
+    """
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        renameat2 = libc.renameat2
+    except (AttributeError, OSError, TypeError):
+        return False
+    at_fdcwd = -100
+    rename_exchange = 2
+    result = renameat2(
+        at_fdcwd,
+        os.fsencode(path_a),
+        at_fdcwd,
+        os.fsencode(path_b),
+        rename_exchange,
+    )
+    return result == 0
+
+
 def copy_package_directory(
         src_dir,
         dest_dir,
         pkg_name,
         extra_ignore_patterns,
         dev_mode,
-        force):
+        force,
+        copy_function=None,
+        incremental=False,
+        workers=None,
+        output=None):
     """Copy pkg directory over from src to dest directory.
 
     Args:
         src_dir (str): path to source directory.
         dest_dir (str): path to destination directory.
         pkg_name (str): name of package.
-        extra_ignore_patterns (str): additional patterns to ignore when copying
-            over, on top of the standard python ignore patterns.
+        extra_ignore_patterns (list(str)): additional gitignore-style patterns
+            to ignore when copying over, on top of the standard python ignore
+            patterns.
         dev_mode (str): if True, we're in dev mode.
         force (bool): whether to force overwrite if the dest_dir already
             exists.
+        copy_function (function or None): function used to copy each file,
+            as passed to files.copy_tree. If None, use files.copy_file.
+        incremental (bool): if True, only copy files that have changed since
+            the last incremental copy into dest_dir, and only delete files
+            that have since been removed from src_dir.
+        workers (int or None): number of threads to copy files with. If None,
+            use the default number.
+        output (file or None): stream to print progress to. If None, print
+            to stdout.
 
     Returns:
         (bool): whether copying was successful.
     """
+    from pkg import files, trash
+
+    copy_function = copy_function or files.copy_file
     if not os.path.isdir(src_dir):
         print_error("{0} is not a valid directory", src_dir)
     if not os.path.isdir(os.path.dirname(dest_dir)):
         print_error("{0} is not a valid directory to write to", dest_dir)
-    if os.path.isdir(dest_dir):
-        continue_build = force or prompt_user_confirmation(
-            "{0}{1} package already exists. Overwrite? [Y|n]".format(
-                pkg_name,
-                " dev" if dev_mode else ""
-            ),
-            confirmation_chars=['y', ''],
-            accepted_chars=['y', 'n', ''],
+    if not confirm_overwrite(dest_dir, pkg_name, dev_mode, force, output):
+        return False
+    # incremental copies can only be trusted against a destination whose
+    # contents were recorded by a previous incremental copy
+    if os.path.isdir(dest_dir) and (
+            not incremental
+            or not os.path.isfile(get_build_state_file(dest_dir))):
+        trash.remove_tree(dest_dir)
+
+    matcher = get_ignore_matcher(extra_ignore_patterns)
+    if incremental:
+        strategies, num_removed = sync_directory(
+            src_dir,
+            dest_dir,
+            matcher,
+            copy_function,
+            workers,
         )
-        if not continue_build:
-            print ("Aborting.")
-            return False
-        else:
-            shutil.rmtree(dest_dir, onerror=on_rmtree_error)
+        print ("Copied {0} changed files ({1}), removed {2} files".format(
+            len(strategies),
+            files.summarise_strategies(strategies) or "none",
+            num_removed,
+        ), file=output)
+    else:
+        strategies = files.copy_tree(
+            src_dir,
+            dest_dir,
+            matcher=matcher,
+            copy_function=copy_function,
+            workers=workers,
+        )
+        print ("Copied {0} files ({1})".format(
+            len(strategies),
+            files.summarise_strategies(strategies) or "none",
+        ), file=output)
+    return True
 
-    shutil.copytree(
-        src_dir,
-        dest_dir,
-        ignore=shutil.ignore_patterns(
+
+def get_ignore_matcher(extra_ignore_patterns):
+    """Get matcher for files to ignore when copying packages.
+
+    Matchers are cached, so each set of patterns is only compiled once.
+
+    Args:
+        extra_ignore_patterns (list(str)): additional gitignore-style patterns
+            to ignore when copying over, on top of the standard python ignore
+            patterns.
+
+    Returns:
+        (ignore.IgnoreMatcher): matcher for paths to ignore.
+    """
+    return _get_ignore_matcher(tuple(extra_ignore_patterns))
+
+
+@functools.lru_cache(maxsize=None)
+def _get_ignore_matcher(extra_ignore_patterns):
+    """Get cached matcher for files to ignore when copying packages.
+
+    Args:
+        extra_ignore_patterns (tuple(str)): additional ignore patterns.
+
+    Returns:
+        (ignore.IgnoreMatcher): matcher for paths to ignore.
+    """
+    from pkg import ignore
+
+    return ignore.IgnoreMatcher(
+        (
             "*.pyc",
             ".git*",
             "__pycache__",
-            *extra_ignore_patterns
-        )
+            constants.BUILD_STATE_FILE_NAME,
+        ) + extra_ignore_patterns
     )
-    return True
+
+
+def get_build_state_file(dest_dir):
+    """Get build state file for given destination directory.
+
+    Args:
+        dest_dir (str): directory that is synced to incrementally.
+
+    Returns:
+        (str): path of build state file.
+    """
+    return os.path.join(dest_dir, constants.BUILD_STATE_FILE_NAME)
+
+
+@timings.timed("sync_directory")
+def sync_directory(
+        src_dir,
+        dest_dir,
+        matcher,
+        copy_function=None,
+        workers=None):
+    """Incrementally sync dest directory with src directory.
+
+    The size, mtime and mode of each source file copied is recorded in a
+    build state file in the destination directory. On later syncs, files
+    whose stats are unchanged are skipped. Files whose stats have changed
+    but whose size hasn't are hashed and only copied if their contents
+    differ. Files that are no longer in the source are deleted.
+
+    Args:
+        src_dir (str): path to source directory.
+        dest_dir (str): path to destination directory.
+        matcher (ignore.IgnoreMatcher): matcher for paths to ignore.
+        copy_function (function or None): function used to copy each file,
+            as passed to files.copy_tree. If None, use files.copy_file.
+        workers (int or None): number of threads to copy files with. If None,
+            use the default number.
+
+    Returns:
+        (list(str)): strategies used to copy each changed file.
+        (int): number of files removed.
+    """
+    import shutil
+
+    from pkg import files
+
+    copy_function = copy_function or files.copy_file
+    state_file = get_build_state_file(dest_dir)
+    state = {}
+    if os.path.isfile(state_file):
+        with open(state_file, "r") as file_:
+            try:
+                state = json.load(file_)
+            except json.decoder.JSONDecodeError:
+                state = {}
+
+    dir_paths, file_paths = files.walk_tree(src_dir, matcher)
+    for dir_path in [os.curdir] + dir_paths:
+        dest_path = os.path.normpath(os.path.join(dest_dir, dir_path))
+        if not os.path.isdir(dest_path):
+            if os.path.lexists(dest_path):
+                os.remove(dest_path)
+            os.makedirs(dest_path)
+
+    new_state = {}
+    file_pairs = []
+    for rel_path in file_paths:
+        src_path = os.path.join(src_dir, rel_path)
+        dest_path = os.path.join(dest_dir, rel_path)
+        src_stat = os.stat(src_path)
+        entry = [src_stat.st_size, src_stat.st_mtime_ns, src_stat.st_mode]
+
+        old_entry = state.get(rel_path)
+        if old_entry and os.path.isfile(dest_path):
+            if old_entry[:3] == entry:
+                new_state[rel_path] = old_entry
+                continue
+            # size and mode unchanged, so fall back to hashing contents
+            if old_entry[0] == entry[0] and old_entry[2] == entry[2]:
+                src_hash = hash_file(src_path)
+                if src_hash == (old_entry[3] or hash_file(dest_path)):
+                    new_state[rel_path] = entry + [src_hash]
+                    continue
+
+        # remove rather than overwrite dest, in case it's a hardlink
+        if os.path.isdir(dest_path) and not os.path.islink(dest_path):
+            shutil.rmtree(dest_path, onerror=on_rmtree_error)
+        elif os.path.lexists(dest_path):
+            os.remove(dest_path)
+        file_pairs.append((src_path, dest_path))
+        # hashes are only calculated when first needed
+        new_state[rel_path] = entry + [None]
+    strategies = files.copy_files(file_pairs, copy_function, workers)
+
+    num_removed = 0
+    for rel_path in state:
+        if rel_path in new_state:
+            continue
+        dest_path = os.path.join(dest_dir, rel_path)
+        if os.path.isfile(dest_path) or os.path.islink(dest_path):
+            os.remove(dest_path)
+            num_removed += 1
+        # clear up any parent directories left empty
+        parent_dir = os.path.dirname(dest_path)
+        while (os.path.normpath(parent_dir) != os.path.normpath(dest_dir)
+                and os.path.isdir(parent_dir)
+                and not os.listdir(parent_dir)
+                and not os.path.isdir(
+                    os.path.join(src_dir, os.path.relpath(parent_dir, dest_dir))
+                )):
+            os.rmdir(parent_dir)
+            parent_dir = os.path.dirname(parent_dir)
+
+    with open(state_file, "w") as file_:
+        json.dump(new_state, file_)
+    return strategies, num_removed
+
+
+def hash_file(path, block_size=1024 * 1024):
+    """Get hash of file contents.
+
+    Args:
+        path (str): path to file.
+        block_size (int): number of bytes to read at a time.
+
+    Returns:
+        (str): hex digest of file contents.
+    """
+    import hashlib
+
+    hasher = hashlib.sha256()
+    with open(path, "rb") as file_:
+        for block in iter(lambda: file_.read(block_size), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
 
 
 def on_rmtree_error(func, path, exc_info):
@@ -0,0 +1,131 @@
+"""pkg-verify command to check installs against their build manifests."""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from pkg import constants, manifest, utils
+
+
+def add_subparser_command(subparser):
+    """Add pkg-verify subparser commands.
+
+    Args:
+        subparser (argparse.Parser): argparse object.
+    """
+    verify_command = subparser.add_parser(
+        constants.VERIFY,
+        help="verify installed packages match their builds",
+    )
+    verify_command.add_argument(
+        "pkg_names",
+        nargs="*",
+        type=str,
+        help="names of packages to verify. If not given, verify all installs",
+    )
+    verify_command.add_argument(
+        "-d",
+        action="store_true",
+        help="verify develop installs",
+    )
+    verify_command.add_argument(
+        "-j",
+        type=int,
+        default=None,
+        metavar="WORKERS",
+        help="number of processes to hash files with (default: cpu count)",
+    )
+
+
+def run_verify(pkgs_dir, pkg_names, workers=None):
+    """Verify installed packages against their manifests.
+
+    Stats are compared first, and only files whose mtime has changed are
+    hashed. Hashing for all packages is spread across a process pool.
+
+    Args:
+        pkgs_dir (str): install directory.
+        pkg_names (list(str)): names of packages to verify.
+        workers (int or None): number of processes to hash files with.
+
+    Returns:
+        (dict(str, dict(str, list(str)) or None)): problems found for each
+            package, keyed by type of problem, or None if the package has no
+            manifest to verify against.
+    """
+    results = {}
+    hash_jobs = []
+    for pkg_name in pkg_names:
+        pkg_dir = os.path.join(pkgs_dir, pkg_name)
+        pkg_manifest = manifest.read_manifest(pkg_dir)
+        if pkg_manifest is None:
+            results[pkg_name] = None
+            continue
+        missing, extra, modified, unknown = manifest.compare_stats(
+            pkg_dir,
+            pkg_manifest,
+        )
+        results[pkg_name] = {
+            "missing": missing,
+            "extra": extra,
+            "modified": modified,
+        }
+        for path in unknown:
+            hash_jobs.append((
+                pkg_name,
+                path,
+                os.path.join(pkg_dir, path),
+                pkg_manifest[path]["sha256"],
+            ))
+
+    if hash_jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            hashes = executor.map(
+                utils.hash_file,
+                [full_path for _, _, full_path, _ in hash_jobs],
+                chunksize=16,
+            )
+            for (pkg_name, path, _, expected_hash), file_hash in zip(
+                    hash_jobs, hashes):
+                if file_hash != expected_hash:
+                    results[pkg_name]["modified"].append(path)
+    return results
+
+
+def main(args):
+    """Verify installed packages based on commandline args.
+
+    Args:
+        args (argparse.Namespace): arguments from commandline.
+    """
+    pkgs_dir = constants.DEV_PKGS_DIR if args.d else constants.PKGS_DIR
+    pkg_names = args.pkg_names
+    if not pkg_names:
+        pkg_names = sorted(
+            name for name in os.listdir(pkgs_dir)
+            if not name.startswith(".")
+            and os.path.isfile(
+                utils.get_package_info_file(os.path.join(pkgs_dir, name))
+            )
+        )
+    for pkg_name in pkg_names:
+        if not os.path.isdir(os.path.join(pkgs_dir, pkg_name)):
+            utils.print_error(
+                "The given package {0} is not currently installed in {1}",
+                pkg_name,
+                pkgs_dir,
+            )
+            return
+
+    results = run_verify(pkgs_dir, pkg_names, args.j)
+    for pkg_name in pkg_names:
+        problems = results[pkg_name]
+        if problems is None:
+            print (" {0}    no manifest".format(pkg_name))
+            continue
+        if not any(problems.values()):
+            print (" {0}    OK".format(pkg_name))
+            continue
+        print (" {0}    FAILED".format(pkg_name))
+        for problem, paths in sorted(problems.items()):
+            for path in sorted(paths):
+                print ("     {0}: {1}".format(problem, path))
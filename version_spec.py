@@ -0,0 +1,273 @@
+"""Parsing and resolving of version strings and version specs.
+
+A version spec is either a version string, which only matches that exact
+version, or one of:
+
+- latest: the highest version.
+- a comma-separated list of comparisons, eg. >=1.2,<2, which all have to
+  match. The comparison operators are ==, !=, >=, <=, > and <.
+- ~version, eg. ~1.2, which matches versions from the given version up to
+  the next increment of its second part (or its only part), so ~1.2 and
+  ~1.2.3 both match up to but not including 1.3, and ~1 matches up to but
+  not including 2.
+
+A version may have a pre-release suffix, which is anything after a '-'
+that isn't followed by a number, eg. 1.2.0-rc1. Pre-releases sort below
+their release, so 1.2.0-rc1 < 1.2.0, and aren't matched by ~ specs of
+the version below, so ~1.2 doesn't match 1.3.0-rc1.
+
+Specs are resolved against a version index: the versions of a package
+sorted by their parsed keys, which is searched with bisect.
+"""
+
+import bisect
+import re
+
+from pkg import utils
+
+
+LATEST = "latest"
+
+# changed whenever the keys made by get_version_key change, so that keys
+# stored by an older version are recomputed
+KEY_FORMAT = 2
+
+_OPERATORS = ("==", "!=", ">=", "<=", ">", "<")
+_SPEC_CHARS = set("<>=!~,")
+
+
+def _split_prerelease(version):
+    """Split version string into its release and pre-release parts.
+
+    Args:
+        version (str): version string, eg. 1.2.0-rc1.
+
+    Returns:
+        (str): release part, eg. 1.2.0.
+        (str or None): pre-release part, eg. rc1, or None if the version
+            isn't a pre-release.
+    """
+    for match in re.finditer(r"-([^.\-]*)", version):
+        if not match.group(1).isdigit():
+            return version[:match.start()], version[match.start() + 1:]
+    return version, None
+
+
+def _get_parts_key(parts):
+    """Get sort key of version parts.
+
+    Args:
+        parts (list(str)): version parts.
+
+    Returns:
+        (list(list)): sort key of each part.
+    """
+    return [
+        [0, int(part), ""] if part.isdigit() else [1, 0, part]
+        for part in parts
+    ]
+
+
+def get_version_key(version):
+    """Get key to sort and compare version strings by.
+
+    Numeric parts compare as numbers and come before non-numeric parts.
+    Trailing zero parts of the release are dropped, so that eg. 1.2 and
+    1.2.0 compare equal. Pre-releases sort below their release, and runs of
+    digits in them compare as numbers, so that rc2 < rc10. Keys are lists
+    rather than tuples so that they're unchanged by being stored as json.
+
+    Args:
+        version (str): version string, eg. 1.2.3.
+
+    Returns:
+        (list): sort key.
+    """
+    release, prerelease = _split_prerelease(version)
+    release_key = _get_parts_key(re.split(r"[.\-]", release))
+    while release_key and release_key[-1] == [0, 0, ""]:
+        release_key.pop()
+    if prerelease is None:
+        # above any pre-release, whose parts all start with 0 or 1
+        prerelease_key = [[2, 0, ""]]
+    else:
+        prerelease_key = _get_parts_key(
+            re.findall(r"\d+|[^\d.\-]+", prerelease)
+        )
+    return [release_key, prerelease_key]
+
+
+def is_spec(version):
+    """Check whether version string is a spec, rather than an exact version.
+
+    Args:
+        version (str): version string or spec.
+
+    Returns:
+        (bool): whether string is a spec.
+    """
+    return version == LATEST or bool(_SPEC_CHARS.intersection(version))
+
+
+def _get_tilde_bounds(version):
+    """Get bounds matched by ~version spec.
+
+    Args:
+        version (str): version string given after the ~.
+
+    Returns:
+        (list(tuple(str, list))): comparisons matched by the spec.
+    """
+    key = get_version_key(version)
+    parts = re.split(r"[.\-]", _split_prerelease(version)[0])
+    num_bumped_parts = min(len(parts), 2)
+    if not all(part.isdigit() for part in parts[:num_bumped_parts]):
+        utils.raise_error("Invalid version spec ~{0}", version)
+    upper_parts = [int(part) for part in parts[:num_bumped_parts]]
+    upper_parts[-1] += 1
+    upper_release = ".".join(str(part) for part in upper_parts)
+    # below every pre-release of the upper bound, not just its release
+    upper_key = [get_version_key(upper_release)[0], []]
+    return [(">=", key), ("<", upper_key)]
+
+
+def parse_spec(spec):
+    """Parse version spec into comparisons.
+
+    Args:
+        spec (str): version spec.
+
+    Raises:
+        (utils.PkgError): if the spec is invalid.
+
+    Returns:
+        (list(tuple(str, list))): operators and version keys that a version
+            must match. If spec is 'latest' this is empty.
+    """
+    spec = spec.strip()
+    if spec == LATEST:
+        return []
+    if spec.startswith("~"):
+        return _get_tilde_bounds(spec[1:].strip())
+    if not is_spec(spec):
+        return [("==", get_version_key(spec))]
+    comparisons = []
+    for part in spec.split(","):
+        part = part.strip()
+        operator = next(
+            (operator for operator in _OPERATORS if part.startswith(operator)),
+            None,
+        )
+        version = part[len(operator or ""):].strip()
+        if operator is None or not version or is_spec(version):
+            utils.raise_error("Invalid version spec {0}", spec)
+        comparisons.append((operator, get_version_key(version)))
+    return comparisons
+
+
+def _get_bound_indexes(comparisons, keys):
+    """Get range of index that comparisons can match.
+
+    Args:
+        comparisons (list(tuple(str, list))): parsed version spec.
+        keys (list(list)): sorted version keys.
+
+    Returns:
+        (int): first index that can match.
+        (int): index after the last index that can match.
+    """
+    start = 0
+    end = len(keys)
+    for operator, key in comparisons:
+        if operator in ("==", ">="):
+            start = max(start, bisect.bisect_left(keys, key))
+        elif operator == ">":
+            start = max(start, bisect.bisect_right(keys, key))
+        if operator in ("==", "<="):
+            end = min(end, bisect.bisect_right(keys, key))
+        elif operator == "<":
+            end = min(end, bisect.bisect_left(keys, key))
+    return start, end
+
+
+def _is_excluded(comparisons, key):
+    """Check whether key is excluded by any != comparisons.
+
+    Args:
+        comparisons (list(tuple(str, list))): parsed version spec.
+        key (list): version key.
+
+    Returns:
+        (bool): whether key is excluded.
+    """
+    return any(
+        operator == "!=" and key == excluded_key
+        for operator, excluded_key in comparisons
+    )
+
+
+def resolve(spec, keys, versions):
+    """Get highest version in index matching spec.
+
+    Args:
+        spec (str): version spec.
+        keys (list(list)): sorted version keys.
+        versions (list(str)): versions corresponding to keys.
+
+    Raises:
+        (utils.PkgError): if the spec is invalid.
+
+    Returns:
+        (str or None): highest matching version, if any match.
+    """
+    comparisons = parse_spec(spec)
+    start, end = _get_bound_indexes(comparisons, keys)
+    for index in range(end - 1, start - 1, -1):
+        if not _is_excluded(comparisons, keys[index]):
+            return versions[index]
+    return None
+
+
+def filter_versions(spec, keys, versions):
+    """Get all versions in index matching spec.
+
+    Args:
+        spec (str): version spec.
+        keys (list(list)): sorted version keys.
+        versions (list(str)): versions corresponding to keys.
+
+    Raises:
+        (utils.PkgError): if the spec is invalid.
+
+    Returns:
+        (list(str)): matching versions, in ascending order.
+    """
+    if spec.strip() == LATEST:
+        return versions[-1:]
+    comparisons = parse_spec(spec)
+    start, end = _get_bound_indexes(comparisons, keys)
+    return [
+        versions[index] for index in range(start, end)
+        if not _is_excluded(comparisons, keys[index])
+    ]
+
+
+def matches(version, spec):
+    """Check whether version matches spec.
+
+    Args:
+        version (str): version string.
+        spec (str or None): version spec. If None, any version matches.
+
+    Raises:
+        (utils.PkgError): if the spec is invalid.
+
+    Returns:
+        (bool): whether version matches.
+    """
+    if spec is None or spec.strip() == LATEST:
+        return True
+    if not is_spec(spec):
+        return version == spec
+    key = get_version_key(version)
+    return bool(filter_versions(spec, [key], [version]))
@@ -0,0 +1,666 @@
+"""Watching package sources, to sync changes into dev builds and installs.
+
+Rather than copying the whole package into its build and install again on
+every change, pkg cycle --watch waits for files in the source tree to
+change and copies just those files across. Changes are read from inotify
+on Linux, falling back to polling file stats elsewhere. Events are
+batched until the tree has been quiet for a moment, so saving many files
+at once is synced in one go.
+"""
+
+from datetime import datetime
+import errno
+import functools
+import json
+import os
+import select
+import shutil
+import struct
+import sys
+import time
+
+from pkg import constants, files, fingerprint, manifest, registry, store
+from pkg import timings, utils
+
+
+# inotify event flags (sys/inotify.h)
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ONLYDIR = 0x1000000
+_IN_ISDIR = 0x40000000
+_WATCH_MASK = (
+    _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO
+    | _IN_CREATE | _IN_DELETE | _IN_ONLYDIR
+)
+
+# wd, mask, cookie and name length of each inotify event
+_EVENT_HEADER = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+# changed path meaning the whole source tree needs checking
+WHOLE_TREE = ""
+
+# files in the package root that are written by builds and installs
+_GENERATED_FILES = (
+    constants.PKG_INFO_FILE_NAME,
+    constants.MANIFEST_FILE_NAME,
+)
+
+
+def _join(rel_dir, name):
+    """Join relative paths the way files.walk_tree does.
+
+    Args:
+        rel_dir (str): relative directory, or an empty string for the root.
+        name (str): path within directory.
+
+    Returns:
+        (str): joined path.
+    """
+    return rel_dir + "/" + name if rel_dir else name
+
+
+def is_ignored(matcher, rel_path, is_dir=False):
+    """Check whether path, or any directory containing it, is ignored.
+
+    Args:
+        matcher (ignore.IgnoreMatcher): matcher for paths to ignore.
+        rel_path (str): path relative to the package root.
+        is_dir (bool): whether the path is a directory.
+
+    Returns:
+        (bool): whether path is ignored.
+    """
+    parts = rel_path.split("/")
+    for index in range(1, len(parts)):
+        if matcher.match("/".join(parts[:index]), True):
+            return True
+    return matcher.match(rel_path, is_dir)
+
+
+class _PrefixedMatcher(object):
+    """Ignore matcher for walking a subdirectory of the package root."""
+
+    def __init__(self, matcher, rel_dir):
+        """Initialise matcher.
+
+        Args:
+            matcher (ignore.IgnoreMatcher): matcher for paths relative to the
+                package root.
+            rel_dir (str): subdirectory being walked.
+        """
+        self._matcher = matcher
+        self._rel_dir = rel_dir
+
+    def match(self, rel_path, is_dir=False):
+        """Check whether path is ignored.
+
+        Args:
+            rel_path (str): path relative to the subdirectory.
+            is_dir (bool): whether the path is a directory.
+
+        Returns:
+            (bool): whether path is ignored.
+        """
+        return self._matcher.match(_join(self._rel_dir, rel_path), is_dir)
+
+
+def _walk_subtree(src_dir, rel_dir, matcher):
+    """Walk subdirectory of package, skipping ignored files.
+
+    Args:
+        src_dir (str): directory of package.
+        rel_dir (str): subdirectory to walk, relative to src_dir.
+        matcher (ignore.IgnoreMatcher): matcher for paths to ignore.
+
+    Returns:
+        (list(str)): paths of all subdirectories, relative to src_dir.
+        (list(str)): paths of all files, relative to src_dir.
+    """
+    dir_paths, file_paths = files.walk_tree(
+        os.path.join(src_dir, rel_dir),
+        _PrefixedMatcher(matcher, rel_dir),
+    )
+    return (
+        [_join(rel_dir, path) for path in dir_paths],
+        [_join(rel_dir, path) for path in file_paths],
+    )
+
+
+def _get_libc():
+    """Get C library, if it has inotify functions.
+
+    Returns:
+        (ctypes.CDLL or None): C library.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1
+    except (AttributeError, OSError, TypeError):
+        return None
+    return libc
+
+
+def _get_libc_error(path=None):
+    """Get error raised by the last failed C library call.
+
+    Args:
+        path (str or None): path the call was made on, if any.
+
+    Returns:
+        (OSError): error.
+    """
+    import ctypes
+
+    error_number = ctypes.get_errno()
+    return OSError(error_number, os.strerror(error_number), path)
+
+
+class InotifyWatcher(object):
+    """Watcher for changes to a package source tree, using inotify.
+
+    Every directory that isn't ignored is watched, and watches are added as
+    new directories are created or moved in.
+    """
+
+    def __init__(self, src_dir, matcher):
+        """Initialise watcher.
+
+        Args:
+            src_dir (str): directory of package.
+            matcher (ignore.IgnoreMatcher): matcher for paths to ignore.
+
+        Raises:
+            (OSError): if inotify isn't available, or the directory can't be
+                watched (eg. the limit on watches has been reached).
+        """
+        self._libc = _get_libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self._src_dir = src_dir
+        self._matcher = matcher
+        self._watched_dirs = {}
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise _get_libc_error()
+        try:
+            self._add_watches("")
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watches(self, rel_dir):
+        """Watch directory and all directories under it.
+
+        Directories that are removed before they can be watched are skipped.
+
+        Args:
+            rel_dir (str): directory to watch, relative to the source
+                directory.
+        """
+        try:
+            dir_paths, _ = _walk_subtree(self._src_dir, rel_dir, self._matcher)
+        except FileNotFoundError:
+            return
+        for dir_path in [rel_dir] + dir_paths:
+            path = os.path.join(self._src_dir, dir_path)
+            watch_descriptor = self._libc.inotify_add_watch(
+                self._fd,
+                os.fsencode(path),
+                _WATCH_MASK,
+            )
+            if watch_descriptor < 0:
+                error = _get_libc_error(path)
+                if error.errno in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                raise error
+            # adding a watch to an already watched directory (eg. one that's
+            # been moved) returns its existing descriptor
+            self._watched_dirs[watch_descriptor] = dir_path
+
+    def _remove_watches(self, rel_dir):
+        """Stop watching directory and all directories under it.
+
+        Args:
+            rel_dir (str): directory to stop watching, relative to the source
+                directory.
+        """
+        for watch_descriptor, dir_path in list(self._watched_dirs.items()):
+            if dir_path == rel_dir or dir_path.startswith(rel_dir + "/"):
+                self._libc.inotify_rm_watch(self._fd, watch_descriptor)
+                del self._watched_dirs[watch_descriptor]
+
+    def read_changes(self, timeout=None):
+        """Wait for changes to source tree.
+
+        Args:
+            timeout (float or None): seconds to wait for changes. If None,
+                wait until there are some.
+
+        Returns:
+            (set(str)): paths of changed files and directories, relative to
+                the source directory. This contains WHOLE_TREE if events
+                were lost and everything needs checking.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self._fd, _READ_SIZE)
+        except BlockingIOError:
+            return set()
+
+        changes = set()
+        offset = 0
+        while offset < len(data):
+            watch_descriptor, mask, _, length = _EVENT_HEADER.unpack_from(
+                data,
+                offset,
+            )
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                changes.add(WHOLE_TREE)
+                continue
+            if mask & _IN_IGNORED:
+                self._watched_dirs.pop(watch_descriptor, None)
+                continue
+            rel_dir = self._watched_dirs.get(watch_descriptor)
+            if rel_dir is None or not name:
+                # removals of watched directories are reported by their parents
+                continue
+            rel_path = _join(rel_dir, name)
+            is_dir = bool(mask & _IN_ISDIR)
+            if is_ignored(self._matcher, rel_path, is_dir):
+                continue
+            changes.add(rel_path)
+            if is_dir and mask & _IN_MOVED_FROM:
+                self._remove_watches(rel_path)
+            elif is_dir and mask & (_IN_CREATE | _IN_MOVED_TO):
+                self._add_watches(rel_path)
+        return changes
+
+    def close(self):
+        """Stop watching source tree."""
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher(object):
+    """Watcher for changes to a package source tree, polling file stats."""
+
+    def __init__(self, src_dir, matcher, interval=None):
+        """Initialise watcher.
+
+        Args:
+            src_dir (str): directory of package.
+            matcher (ignore.IgnoreMatcher): matcher for paths to ignore.
+            interval (float or None): seconds between checking for changes.
+                If None, use the default interval.
+        """
+        self._src_dir = src_dir
+        self._matcher = matcher
+        self._interval = interval or constants.WATCH_POLL_INTERVAL
+        self._snapshot = self._get_snapshot() or {}
+
+    def _get_snapshot(self):
+        """Get stats of every file and directory in source tree.
+
+        Returns:
+            (dict(str, tuple or None) or None): size, mtime and mode of each
+                file, or None for directories, keyed by relative path. None
+                if the tree changed while it was being walked.
+        """
+        try:
+            dir_paths, file_paths = files.walk_tree(
+                self._src_dir,
+                self._matcher,
+            )
+        except FileNotFoundError:
+            return None
+        snapshot = dict.fromkeys(dir_paths)
+        for path in file_paths:
+            try:
+                file_stat = os.stat(os.path.join(self._src_dir, path))
+            except FileNotFoundError:
+                continue
+            snapshot[path] = (
+                file_stat.st_size,
+                file_stat.st_mtime_ns,
+                file_stat.st_mode,
+            )
+        return snapshot
+
+    def read_changes(self, timeout=None):
+        """Wait for changes to source tree.
+
+        Args:
+            timeout (float or None): seconds to wait for changes. If None,
+                wait until there are some.
+
+        Returns:
+            (set(str)): paths of changed files and directories, relative to
+                the source directory.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            interval = self._interval
+            if deadline is not None:
+                interval = min(interval, max(deadline - time.monotonic(), 0))
+            time.sleep(interval)
+            snapshot = self._get_snapshot()
+            if snapshot is not None:
+                changes = set(
+                    path for path in set(snapshot) | set(self._snapshot)
+                    if path not in snapshot
+                    or path not in self._snapshot
+                    or snapshot[path] != self._snapshot[path]
+                )
+                self._snapshot = snapshot
+                if changes:
+                    return changes
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+
+    def close(self):
+        """Stop watching source tree."""
+
+
+def get_watcher(src_dir, matcher, poll=False):
+    """Get watcher for changes to package source tree.
+
+    Args:
+        src_dir (str): directory of package.
+        matcher (ignore.IgnoreMatcher): matcher for paths to ignore.
+        poll (bool): if True, poll for changes even if inotify is available.
+
+    Returns:
+        (InotifyWatcher or PollingWatcher): watcher.
+    """
+    if not poll:
+        try:
+            return InotifyWatcher(src_dir, matcher)
+        except OSError as error:
+            print ("Can't watch with inotify ({0}), polling instead".format(
+                error.strerror or error
+            ))
+    return PollingWatcher(src_dir, matcher)
+
+
+def wait_for_changes(watcher, delay=None):
+    """Wait for a batch of changes to source tree.
+
+    Once something has changed, changes are collected until none have been
+    made for the given delay.
+
+    Args:
+        watcher (InotifyWatcher or PollingWatcher): watcher.
+        delay (float or None): seconds without changes that end a batch. If
+            None, use the default delay.
+
+    Returns:
+        (set(str)): paths of changed files and directories, relative to the
+            source directory.
+    """
+    delay = delay or constants.WATCH_BATCH_DELAY
+    changes = set()
+    while not changes:
+        changes = watcher.read_changes()
+    while True:
+        new_changes = watcher.read_changes(delay)
+        if not new_changes:
+            return changes
+        changes.update(new_changes)
+
+
+def _remove_path(path):
+    """Remove file, symlink or directory tree, if it exists.
+
+    Args:
+        path (str): path to remove.
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, onerror=utils.on_rmtree_error)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _is_unchanged(src_path, entry):
+    """Check whether source file has the same contents as a manifest entry.
+
+    Args:
+        src_path (str): path to source file.
+        entry (dict or None): manifest entry for file in build.
+
+    Returns:
+        (bool): whether file is unchanged.
+    """
+    if entry is None:
+        return False
+    stats = manifest.get_file_stats(src_path)
+    if stats["size"] != entry["size"] or stats["mode"] != entry["mode"]:
+        return False
+    if stats["mtime_ns"] == entry["mtime_ns"]:
+        return True
+    return utils.hash_file(src_path) == entry.get("sha256")
+
+
+def _get_paths_to_sync(src_dir, matcher, changes, build_manifest):
+    """Get files to copy and paths to remove for a batch of changes.
+
+    Args:
+        src_dir (str): directory of package.
+        matcher (ignore.IgnoreMatcher): matcher for paths to ignore.
+        changes (set(str)): changed paths, relative to src_dir.
+        build_manifest (dict): manifest of build.
+
+    Returns:
+        (list(str)): paths of files to copy.
+        (list(str)): paths of files and directories to remove.
+    """
+    paths_to_copy = set()
+    paths_to_remove = set()
+    for rel_path in changes:
+        src_path = os.path.join(src_dir, rel_path)
+        if rel_path in _GENERATED_FILES:
+            continue
+        if os.path.isdir(src_path):
+            if rel_path != WHOLE_TREE and is_ignored(matcher, rel_path, True):
+                continue
+            _, file_paths = _walk_subtree(src_dir, rel_path, matcher)
+            file_paths = set(file_paths) - set(_GENERATED_FILES)
+            paths_to_copy.update(file_paths)
+            if rel_path in build_manifest:
+                # replacing a file of the same name
+                paths_to_remove.add(rel_path)
+            # anything under the directory that's no longer in the source
+            prefix = _join(rel_path, "")
+            paths_to_remove.update(
+                path for path in build_manifest
+                if path.startswith(prefix) and path not in file_paths
+            )
+        elif os.path.isfile(src_path):
+            prefix = _join(rel_path, "")
+            if any(path.startswith(prefix) for path in build_manifest):
+                # replacing a directory of the same name
+                paths_to_remove.add(rel_path)
+            if not is_ignored(matcher, rel_path):
+                paths_to_copy.add(rel_path)
+        else:
+            paths_to_remove.add(rel_path)
+    paths_to_copy = [
+        path for path in sorted(paths_to_copy)
+        if not _is_unchanged(
+            os.path.join(src_dir, path),
+            build_manifest.get(path),
+        )
+    ]
+    return paths_to_copy, sorted(paths_to_remove)
+
+
+def _update_fingerprint(pkg_info_file, source_fingerprint):
+    """Update source fingerprint in pkg-info file.
+
+    Args:
+        pkg_info_file (str): path to pkg-info file.
+        source_fingerprint (str): new fingerprint of source tree.
+    """
+    with open(pkg_info_file, "r") as file_:
+        pkg_info = json.load(file_)
+    pkg_info[constants.SOURCE_FINGERPRINT_KEY] = source_fingerprint
+    utils.write_package_info(pkg_info_file, pkg_info)
+
+
+@timings.timed("sync_changes")
+def sync_changes(
+        src_dir,
+        pkg_name,
+        version,
+        matcher,
+        changes,
+        workers=None):
+    """Sync changed source files into dev build and install.
+
+    Only files whose contents have changed are copied, and files removed
+    from the source are removed from the build and install. The build's
+    manifest and the build and install times in their pkg-info files are
+    then updated to match. The install is only synced if it's of the given
+    version.
+
+    Args:
+        src_dir (str): directory of package.
+        pkg_name (str): name of package.
+        version (str): version of dev build to sync into.
+        matcher (ignore.IgnoreMatcher): matcher for paths to ignore.
+        changes (set(str)): changed paths, relative to src_dir.
+        workers (int or None): number of threads to copy files with.
+
+    Returns:
+        (int): number of files copied.
+        (int): number of files and directories removed.
+    """
+    builds_dir = constants.DEV_PKG_BUILDS_DIR
+    pkgs_dir = constants.DEV_PKGS_DIR
+    build_dir = os.path.join(builds_dir, pkg_name, version)
+    install_dir = os.path.join(pkgs_dir, pkg_name)
+
+    build_pkg_info_file, build_pkg_info = utils.get_package_info(build_dir)
+    if not build_pkg_info:
+        utils.raise_error("Package {0} has no build to sync into", pkg_name)
+    _, install_pkg_info = utils.get_package_info(
+        install_dir,
+        print_on_error=False,
+    )
+    install_pkg_info = install_pkg_info or {}
+    if install_pkg_info.get(constants.VERSION_KEY) != version:
+        install_dir = None
+    link_mode = install_pkg_info.get(constants.LINK_MODE_KEY)
+
+    # fingerprint the source before copying, so that anything changed while
+    # copying is picked up by the next build
+    source_fingerprint, _ = fingerprint.get_fingerprint(src_dir, matcher)
+    build_manifest = manifest.read_manifest(build_dir)
+    if build_manifest is None:
+        build_manifest = manifest.create_manifest(build_dir, workers)
+    paths_to_copy, paths_to_remove = _get_paths_to_sync(
+        src_dir,
+        matcher,
+        changes,
+        build_manifest,
+    )
+    if not paths_to_copy and not paths_to_remove:
+        # files were only touched, so just keep the fingerprints current for
+        # the next cycle
+        if build_pkg_info.get(constants.SOURCE_FINGERPRINT_KEY) not in (
+                None, source_fingerprint):
+            _update_fingerprint(build_pkg_info_file, source_fingerprint)
+            if install_dir:
+                _update_fingerprint(
+                    utils.get_package_info_file(install_dir),
+                    source_fingerprint,
+                )
+                registry.update_install(pkgs_dir, pkg_name)
+            registry.update_build(builds_dir, pkg_name, version)
+        return 0, 0
+
+    for rel_path in paths_to_remove:
+        _remove_path(os.path.join(build_dir, rel_path))
+        # symlinked installs only link the top level entries of the build
+        if install_dir and (
+                link_mode != constants.SYMLINK or "/" not in rel_path):
+            _remove_path(os.path.join(install_dir, rel_path))
+        prefix = rel_path + "/"
+        for path in list(build_manifest):
+            if path == rel_path or path.startswith(prefix):
+                del build_manifest[path]
+
+    build_pairs = []
+    install_pairs = []
+    for rel_path in paths_to_copy:
+        build_path = os.path.join(build_dir, rel_path)
+        # remove rather than overwrite, as build files are hardlinks
+        _remove_path(build_path)
+        os.makedirs(os.path.dirname(build_path), exist_ok=True)
+        build_pairs.append((os.path.join(src_dir, rel_path), build_path))
+        if not install_dir:
+            continue
+        install_path = os.path.join(install_dir, rel_path)
+        if link_mode == constants.SYMLINK:
+            if "/" not in rel_path and not os.path.lexists(install_path):
+                os.symlink(os.path.abspath(build_path), install_path)
+            continue
+        _remove_path(install_path)
+        os.makedirs(os.path.dirname(install_path), exist_ok=True)
+        install_pairs.append((build_path, install_path))
+    files.copy_files(
+        build_pairs,
+        functools.partial(store.link_file, store.get_store_dir(builds_dir)),
+        workers,
+    )
+    files.copy_files(
+        install_pairs,
+        files.link_file if link_mode == constants.HARDLINK else files.copy_file,
+        workers,
+    )
+
+    for rel_path in paths_to_copy:
+        build_path = os.path.join(build_dir, rel_path)
+        build_manifest[rel_path] = manifest.get_file_stats(build_path)
+        build_manifest[rel_path]["sha256"] = utils.hash_file(build_path)
+    manifest.write_manifest(build_dir, build_manifest)
+
+    build_pkg_info[constants.BUILD_TIME_KEY] = str(
+        datetime.now().replace(microsecond=0)
+    )
+    build_pkg_info[constants.SOURCE_FINGERPRINT_KEY] = source_fingerprint
+    utils.write_package_info(build_pkg_info_file, build_pkg_info)
+    registry.update_build(builds_dir, pkg_name, version)
+
+    if install_dir:
+        if link_mode != constants.SYMLINK:
+            manifest.write_manifest(install_dir, build_manifest)
+        install_pkg_info = dict(build_pkg_info)
+        install_pkg_info[constants.INSTALL_TIME_KEY] = str(
+            datetime.now().replace(microsecond=0)
+        )
+        if link_mode:
+            install_pkg_info[constants.LINK_MODE_KEY] = link_mode
+        utils.write_package_info(
+            utils.get_package_info_file(install_dir),
+            install_pkg_info,
+        )
+        registry.update_install(pkgs_dir, pkg_name)
+    return len(paths_to_copy), len(paths_to_remove)